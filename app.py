@@ -1,12 +1,13 @@
 import os
-import torch
 from flask import Flask
 
 # --- 引入 Engine ---
 # 确保 utils 文件夹下有 __init__.py，或者该路径在 PYTHONPATH 中
-from extensions import db, login_manager
+from extensions import db, login_manager, sqlite_engine_options, install_sqlite_pragmas
 from models import User
-# from utils.sam3_wrapper import SAM3Engine
+from permissions import ensure_permission_index
+from utils.startup import StartupReport, warmup, import_module_step, torch_device_step
+from utils.AI_wrapper import SAM3Engine
 
 # --- 解决 Windows 下库冲突 ---
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
@@ -14,16 +15,75 @@ os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
 def create_app():
     """创建并配置Flask应用实例"""
+    report = StartupReport()
     app = Flask(__name__)
+    app.extensions['startup_report'] = report
 
     # --- 安全配置 ---
     app.config['SECRET_KEY'] = 'ChangeThisToARandomSecretKey'  # 生产环境请修改
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # SQLite：写冲突时最多等待的毫秒数、WAL 下的 synchronous 级别、连接池大小 (多线程服务)
+    app.config['SQLITE_BUSY_TIMEOUT_MS'] = 5000
+    app.config['SQLITE_SYNCHRONOUS'] = 'NORMAL'
+    app.config['SQLITE_POOL_SIZE'] = 10
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options(
+        busy_timeout_ms=app.config['SQLITE_BUSY_TIMEOUT_MS'], pool_size=app.config['SQLITE_POOL_SIZE'])
 
     # --- 基本配置 ---
     app.config['DATA_DIR'] = os.path.join(app.root_path, 'data')
     app.config['MODELS_FOLDER'] = os.path.join(app.root_path, 'models')
+    # 训练调度槽位：默认单槽位 (同一时间只跑一个训练)。多核 / 多卡机器可配置多个槽位并行，例如
+    # [{'name': 'gpu0', 'devices': ['0']}, {'name': 'cpu-a', 'devices': ['cpu'], 'cpus': [0, 1, 2, 3]}]
+    app.config['TRAIN_SLOTS'] = [{'name': 'default'}]
+    app.config['TRAIN_MEM_BUDGET_MB'] = None  # 所有运行中任务 mem_mb 之和的上限，None 表示不限制
+    # 训练任务持久化 (队列、状态、PID、日志偏移)，服务重启后恢复
+    app.config['JOB_DB_PATH'] = os.path.join(app.instance_path, 'jobs.db')
+    # 服务重启时训练进程已不存在、但已有 last.pt 的任务，自动从断点续训
+    app.config['AUTO_RESUME_INTERRUPTED'] = True
+    # 模型导出进程池：进程数 (None 为 CPU 核数 / 4) 和每个导出进程的计算线程数 (None 为平均分配 CPU 核)
+    app.config['EXPORT_WORKERS'] = None
+    app.config['EXPORT_THREADS'] = None
+    # 预热的训练进程 (仅 Linux / macOS)：常驻进程预先导入 torch / ultralytics，每个训练任务从中 fork，
+    # 执行 WARM_TRAINER_MAX_JOBS 个任务或内存增长超过上限后自动更换
+    app.config['WARM_TRAINERS_ENABLED'] = True
+    app.config['WARM_TRAINERS'] = 1
+    app.config['WARM_TRAINER_MAX_JOBS'] = 20
+    app.config['WARM_TRAINER_MAX_RSS_GROWTH_MB'] = 1024
+    # 资源监控：采样间隔 (秒) 和每个任务保留的采样点数
+    app.config['RESOURCE_SAMPLE_INTERVAL'] = 2.0
+    app.config['RESOURCE_HISTORY'] = 1800
+    # 内存准入：启动新任务后整机剩余内存需不少于该值 (MB)，否则任务继续排队；None 表示不检查。
+    # 未填写 mem_mb 的任务按 TRAIN_DEFAULT_MEM_MB 估算
+    app.config['TRAIN_MIN_FREE_MEM_MB'] = 2048
+    app.config['TRAIN_DEFAULT_MEM_MB'] = 4096
+    # 训练图片预缩放缓存 (按内容哈希寻址，多个任务共享)，不能放在 DATA_DIR 下，否则会被当成 owner 列出
+    app.config['IMAGE_CACHE_DIR'] = os.path.join(app.root_path, 'cache', 'resized')
+    # 评估任务的原始预测缓存 (按权重哈希 / 图片内容哈希寻址)
+    app.config['EVAL_CACHE_DIR'] = os.path.join(app.root_path, 'cache', 'predictions')
+    # SAM 后端 ('disabled' 为开源版默认，'fake' 为测试用) 和图片编码缓存上限 (MB)
+    app.config['SAM_BACKEND'] = 'disabled'
+    app.config['SAM_EMBEDDING_CACHE_MB'] = 1024
+    # SAM 推理队列：短窗口 (毫秒) 内到达的请求合并为一批，单批上限、排队上限和单个请求的超时 (秒)
+    app.config['SAM_MAX_BATCH'] = 8
+    app.config['SAM_BATCH_WAIT_MS'] = 10
+    app.config['SAM_MAX_QUEUE'] = 256
+    app.config['SAM_REQUEST_TIMEOUT'] = 30
+    # 打开一张图片时在后台预先编码其后 (自然排序) 的几张图片，0 为关闭
+    app.config['SAM_PREFETCH_DEPTH'] = 3
+    # SAM 输出多边形的简化：Douglas-Peucker 像素容差 (0 为不简化) 和顶点数上限 (None 为不限制)
+    app.config['SAM_POLYGON_TOLERANCE'] = 1.0
+    app.config['SAM_POLYGON_MAX_VERTICES'] = 200
+    # 辅助标注推理 (/api/model/predict)：常驻内存的模型数量 / 估算内存上限 (MB)，空闲多久 (秒) 后释放
+    app.config['MODEL_CACHE_MAX_MODELS'] = 4
+    app.config['MODEL_CACHE_MAX_MB'] = 2048
+    app.config['MODEL_CACHE_IDLE_SECONDS'] = 600
+    # 并发推理请求合批：单批最多张数，第一张到达后最多等待的毫秒数
+    app.config['PREDICT_MAX_BATCH'] = 8
+    app.config['PREDICT_BATCH_WAIT_MS'] = 5
+    # 启动后在后台线程中预先导入 torch / ultralytics (Web 服务不等待，进度见 /api/system/ready)。
+    # 关闭时这些模块在第一次训练 / 推理时才导入
+    app.config['WARMUP_ON_START'] = True
 
     os.makedirs(app.config['DATA_DIR'], exist_ok=True)
     os.makedirs(app.config['MODELS_FOLDER'], exist_ok=True)
@@ -35,23 +95,25 @@ def create_app():
 
     # --- 注册蓝图 ---
     try:
-        from blueprints.main_routes import main_bp
-        from blueprints.annotate_routes import annotate_bp
-        from blueprints.train_routes import train_bp
-        from blueprints.sam_routes import sam_bp
-        from blueprints.auth_routes import auth_bp
-
-        app.register_blueprint(main_bp)
-        app.register_blueprint(annotate_bp)
-        app.register_blueprint(train_bp)
-        app.register_blueprint(sam_bp)
-        app.register_blueprint(auth_bp)
+        with report.timed('import blueprints'):
+            from blueprints.main_routes import main_bp
+            from blueprints.annotate_routes import annotate_bp
+            from blueprints.train_routes import train_bp
+            from blueprints.sam_routes import sam_bp
+            from blueprints.auth_routes import auth_bp
+            from blueprints.infer_routes import infer_bp
+
+        for bp in (main_bp, annotate_bp, train_bp, sam_bp, auth_bp, infer_bp):
+            with report.timed(f'register {bp.name}'):
+                app.register_blueprint(bp)
     except ImportError as e:
         print(f"Warning: Could not import some blueprints. Ensure file structure is correct. Error: {e}")
 
     # --- 数据库与初始用户 ---
-    with app.app_context():
+    with report.timed('init database'), app.app_context():
+        install_sqlite_pragmas(db.engine, app.config['SQLITE_BUSY_TIMEOUT_MS'], app.config['SQLITE_SYNCHRONOUS'])
         db.create_all()
+        ensure_permission_index()
         # 创建默认管理员
         if not User.query.filter_by(username='admin').first():
             print("Creating default admin user (admin/Maikouce)...")
@@ -65,8 +127,15 @@ def create_app():
     def load_user(user_id):
         return db.session.get(User, int(user_id))
 
+    if app.config.get('WARMUP_ON_START'):
+        warmup.add('torch', torch_device_step)
+        warmup.add('ultralytics', import_module_step('ultralytics'))
+        warmup.add('sam', lambda: SAM3Engine.get_instance().warmup())
+        warmup.start()
+
+    report.finish()
     print("=" * 50)
-    print("YOLOv8/SAM3 Web Platform is running.")
+    print(f"YOLOv8/SAM3 Web Platform is running. (startup {report.finished * 1000:.0f} ms)")
     print(f"Data directory: {app.config['DATA_DIR']}")
     print("Access the platform at: http://127.0.0.1:8001")
     print("=" * 50)
@@ -77,25 +146,11 @@ def create_app():
 if __name__ == '__main__':
     yolo_app = create_app()
 
-    # ---【关键修改】程序启动时，在开启 Web 服务端口前，先初始化模型 ---
-    # 这会阻塞主线程，直到模型真正加载到显存中
-    print(f">>> [System] Initializing Ultralytics SAM3 Model on {('CUDA' if torch.cuda.is_available() else 'CPU')}...")
-
-    try:
-        # 获取单例实例，触发 __init__ 中的加载逻辑
-        # global_engine = SAM3Engine.get_instance()
-
-        # 可选：可以做一个空的 Warmup 推理来确保 CUDA kernel 已初始化
-        # print(">>> [System] Warming up models...")
-        # global_engine.warmup()
-
-        print(">>> [System] SAM3 Model Loaded Successfully! Ready to serve.")
-    except Exception as e:
-        print(f">>> [System] SAM3 Model Load Failed: {e}")
-        import traceback
-
-        traceback.print_exc()
-        print(">>> The web server will still start, but SAM features will error out.")
+    # 不再在开启端口前阻塞加载模型：torch / ultralytics 由后台预热线程导入 (WARMUP_ON_START)，
+    # SAM 后端在第一次请求时加载，预热进度见 /api/system/ready
+    print(">>> [System] Startup timings:")
+    for line in yolo_app.extensions['startup_report'].lines():
+        print(f"    {line}")
 
     # 启动 Flask
     # 注意：debug=False 防止重载器导致模型加载两次
@@ -5,21 +5,15 @@ import math
 import io
 import zipfile
 import mimetypes
-import re  # 新增：用于正则表达式处理自然排序
 from flask import Blueprint, request, jsonify, send_file, current_app, abort, render_template
 from flask_login import login_required, current_user
 from PIL import Image, ImageOps  # 修改引入 ImageOps
+from utils.label_io import list_task_images, annotations_to_yolo_lines, write_label_file, atomic_write_text
+from utils.AI_wrapper import SAM3Engine
 annotate_bp = Blueprint('annotate', __name__)
 
 # --- 权限辅助 ---
-from models import TaskPermission
-
-
-def check_perm(owner, task_name):
-    if current_user.is_admin: return True
-    if owner == current_user.username: return True
-    perm = TaskPermission.query.filter_by(user_id=current_user.id, owner_name=owner, task_name=task_name).first()
-    return True if perm else False
+from permissions import check_perm
 
 
 def protect_route(f):
@@ -39,64 +33,6 @@ def protect_route(f):
 
 # --- 辅助函数 ---
 
-def _natural_sort_key(s):
-    """
-    自然排序键值生成函数。
-    将字符串拆分为文本和数字列表，例如 'cam10.jpg' -> ['cam', 10, '.jpg']
-    这样比较时，数字部分会按数值大小比较，而不是按字符比较。
-    """
-    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
-
-
-def _normalize_points(points, width, height, type_str):
-    if width == 0 or height == 0: return []
-    normalized = []
-    try:
-        if type_str == 'rect':
-            cx, cy = (points['x'] + points['w'] / 2) / width, (points['y'] + points['h'] / 2) / height
-            nw, nh = points['w'] / width, points['h'] / height
-            normalized = [max(0, min(1, cx)), max(0, min(1, cy)), max(0, min(1, nw)), max(0, min(1, nh))]
-
-        elif type_str == 'obb':
-            # 【修复】保存为 YOLO OBB 标准的 4点坐标 (x1 y1 x2 y2 x3 y3 x4 y4)
-            # 这样可以兼容 ultralytics yolo11-obb 训练
-            cx, cy = points['x'], points['y']
-            w, h = points['w'], points['h']
-            rot = points['rotation']
-
-            # 计算四个角点
-            cos_a = math.cos(rot)
-            sin_a = math.sin(rot)
-
-            # 半宽和半高向量
-            wx, wy = (w / 2) * cos_a, (w / 2) * sin_a
-            hx, hy = - (h / 2) * sin_a, (h / 2) * cos_a
-
-            # p1: tl, p2: tr, p3: br, p4: bl (相对于旋转后的方向)
-            # 注意：这里计算出的是绝对像素坐标的偏移量
-            corners = [
-                (cx - wx - hx, cy - wy - hy),
-                (cx + wx - hx, cy + wy - hy),
-                (cx + wx + hx, cy + wy + hy),
-                (cx - wx + hx, cy - wy + hy)
-            ]
-
-            # 归一化并展平
-            for px, py in corners:
-                normalized.extend([
-                    max(0, min(1, px / width)),
-                    max(0, min(1, py / height))
-                ])
-
-        elif type_str == 'polygon':
-            for x, y in points:
-                normalized.extend([max(0, min(1, x / width)), max(0, min(1, y / height))])
-    except Exception as e:
-        print(f"Error normalizing points: {e}")
-        return []
-    return normalized
-
-
 def _parse_yolo_annotations(txt_path, width, height, labels):
     annotations = []
     if not os.path.exists(txt_path): return annotations
@@ -224,19 +160,12 @@ def get_task_data(owner, task_name):
             labels = []
 
     images_data = []
-    # 只列出图片文件
-    valid_exts = {'.png', '.jpg', '.jpeg', '.bmp', '.webp'}
     try:
-        all_files = os.listdir(task_path)
+        # 只列出图片文件，使用 natural_sort_key 进行排序
+        image_files = list_task_images(task_path)
     except OSError:
         return jsonify({"error": "无法读取任务目录"}), 500
 
-    # 筛选出图片
-    filtered_files = [f for f in all_files if os.path.splitext(f)[1].lower() in valid_exts]
-
-    # 关键修改：使用 natural_sort_key 进行排序
-    image_files = sorted(filtered_files, key=_natural_sort_key)
-
     for filename in image_files:
         image_path = os.path.join(task_path, filename)
         txt_path = os.path.splitext(image_path)[0] + '.txt'
@@ -298,6 +227,9 @@ def get_image_data(owner, task_name, image_name):
     # 3. 解析标注
     annotations = _parse_yolo_annotations(txt_path, width, height, labels)
 
+    # 后台预先编码接下来的几张图片，切换到下一张后第一次 SAM 点击无需等待编码
+    SAM3Engine.get_instance().prefetch_after(task_path, image_name)
+
     # --- 修复核心：如果是仅获取元数据，直接返回，不读取图片流 ---
     if meta_only:
         return jsonify({
@@ -357,38 +289,23 @@ def save_annotation():
     task_path = os.path.join(DATA_DIR, owner, task_name)
     os.makedirs(task_path, exist_ok=True)
 
-    # 原子写入标签文件防止损坏
+    # 原子写入标签文件防止损坏 (批量预标注等后台任务可能同时在读写)
 
     # 保存标签
     try:
-        with open(os.path.join(task_path, 'labels.json'), 'w', encoding='utf-8') as f:
-            json.dump(labels, f, ensure_ascii=False, indent=2)
+        atomic_write_text(os.path.join(task_path, 'labels.json'), json.dumps(labels, ensure_ascii=False, indent=2))
     except Exception as e:
         return jsonify({"error": f"Save labels failed: {e}"}), 500
 
     # 保存 TXT
     label_to_index = {label['name']: i for i, label in enumerate(labels)}
-    yolo_strings = []
-
-    for ann in annotations:
-        if 'label' not in ann or ann['label'] not in label_to_index: continue
-        idx = label_to_index[ann['label']]
-
-        try:
-            pts = _normalize_points(ann['points'], img_width, img_height, ann['type'])
-            if not pts: continue
-            # 格式化字符串，减少小数点位数节省空间
-            coord_str = " ".join([f"{p:.6f}" for p in pts])
-            yolo_strings.append(f"{idx} {coord_str}")
-        except Exception:
-            continue
+    yolo_strings = annotations_to_yolo_lines(annotations, label_to_index, img_width, img_height)
 
     txt_filename = os.path.splitext(image_name)[0] + '.txt'
     txt_full_path = os.path.join(task_path, txt_filename)
 
     try:
-        with open(txt_full_path, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(yolo_strings))
+        write_label_file(txt_full_path, yolo_strings)
     except Exception as e:
         return jsonify({"error": f"Save annotation failed: {e}"}), 500
 
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, redirect, url_for, request, flash,
 from flask_login import login_user, logout_user, login_required, current_user
 from extensions import db
 from models import User, TaskPermission
+from permissions import grant, revoke, grant_many, revoke_many
 import os
 
 auth_bp = Blueprint('auth', __name__)
@@ -130,17 +131,14 @@ def list_permissions():
     """列出当前的授权记录"""
     if not current_user.is_admin: return jsonify([]), 403
 
-    perms = TaskPermission.query.all()
-    result = []
-    for p in perms:
-        u = User.query.get(p.user_id)
-        if u:
-            result.append({
-                "id": p.id,
-                "username": u.username,
-                "task_name": p.task_name,
-                "owner": p.owner_name
-            })
+    # 一次 JOIN 查询，代替逐条记录查询用户
+    rows = db.session.query(TaskPermission, User.username).join(User, User.id == TaskPermission.user_id).all()
+    result = [{
+        "id": p.id,
+        "username": username,
+        "task_name": p.task_name,
+        "owner": p.owner_name
+    } for p, username in rows]
     return jsonify(result)
 
 
@@ -161,21 +159,61 @@ def grant_permission():
     if not os.path.exists(public_task_path):
         return jsonify({"error": "公共任务不存在"}), 404
 
-    exists = TaskPermission.query.filter_by(user_id=user.id, owner_name='public', task_name=task_name).first()
-    if not exists:
-        perm = TaskPermission(user_id=user.id, owner_name='public', task_name=task_name)
-        db.session.add(perm)
-        db.session.commit()
+    grant(user.id, 'public', task_name)
 
     return jsonify({"success": True})
 
 
+def _bulk_targets(data):
+    """
+    解析批量授权 / 撤销的参数: usernames (用户名列表) × task_names (public 下的任务名列表)。
+    返回 (user_ids, task_names, 错误响应)。
+    """
+    usernames = [u for u in data.get('usernames') or [] if u]
+    task_names = [t for t in data.get('task_names') or [] if t]
+    if not usernames or not task_names:
+        return None, None, (jsonify({"error": "usernames 和 task_names 不能为空"}), 400)
+    users = User.query.filter(User.username.in_(set(usernames))).all()
+    missing = sorted(set(usernames) - {u.username for u in users})
+    if missing:
+        return None, None, (jsonify({"error": f"用户不存在: {', '.join(missing)}"}), 404)
+    return [u.id for u in users], task_names, None
+
+
+@auth_bp.route('/api/admin/permissions/bulk_grant', methods=['POST'])
+@login_required
+def bulk_grant_permissions():
+    """一次授权多个用户 × 多个公共任务 (一个事务)。JSON: {"usernames": [...], "task_names": [...]}"""
+    if not current_user.is_admin: return jsonify({"error": "权限不足"}), 403
+
+    user_ids, task_names, error = _bulk_targets(request.get_json(silent=True) or {})
+    if error: return error
+    public_path = os.path.join(current_app.config['DATA_DIR'], 'public')
+    missing = sorted(t for t in set(task_names) if not os.path.isdir(os.path.join(public_path, t)))
+    if missing:
+        return jsonify({"error": f"公共任务不存在: {', '.join(missing)}"}), 404
+
+    created = grant_many(user_ids, 'public', task_names)
+    return jsonify({"success": True, "created": created})
+
+
+@auth_bp.route('/api/admin/permissions/bulk_revoke', methods=['POST'])
+@login_required
+def bulk_revoke_permissions():
+    """一次撤销多个用户 × 多个公共任务的授权 (一个事务)。JSON: {"usernames": [...], "task_names": [...]}"""
+    if not current_user.is_admin: return jsonify({"error": "权限不足"}), 403
+
+    user_ids, task_names, error = _bulk_targets(request.get_json(silent=True) or {})
+    if error: return error
+    deleted = revoke_many(user_ids, 'public', task_names)
+    return jsonify({"success": True, "deleted": deleted})
+
+
 @auth_bp.route('/api/admin/revoke_permission', methods=['POST'])
 @login_required
 def revoke_permission():
     if not current_user.is_admin: return jsonify({"error": "权限不足"}), 403
 
     perm_id = request.json.get('id')
-    TaskPermission.query.filter_by(id=perm_id).delete()
-    db.session.commit()
+    revoke(perm_id)
     return jsonify({"success": True})
\ No newline at end of file
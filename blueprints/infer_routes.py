@@ -0,0 +1,123 @@
+# blueprints/infer_routes.py
+import json
+import os
+import re
+import time
+
+import numpy as np
+from flask import Blueprint, request, jsonify, current_app
+from flask_login import login_required, current_user
+
+from permissions import check_perm
+from utils.batch_infer import find_best_weights, pick_weights, onnx_batch_size, result_to_annotations, decode_image
+from utils.microbatch import MicroBatcher
+from utils.model_cache import ModelCache
+
+infer_bp = Blueprint('infer', __name__)
+
+
+def _load_model(weights):
+    """加载模型并用一张空图预热 (首次推理的算子融合 / 初始化不计入用户请求的延迟)。"""
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    batch = onnx_batch_size(weights, None) if weights.endswith('.onnx') else None
+    model.predict([np.zeros((640, 640, 3), dtype=np.uint8)], device='cpu', verbose=False)
+    return {'model': model, 'batch': batch}
+
+
+def _predict_batch(key, items):
+    """MicroBatcher handler：同一模型、同样 imgsz / iou 的请求合并成一次前向推理，按最低的置信度阈值推理后再各自过滤。"""
+    _, imgsz, iou = key
+    loaded = items[0]['loaded']
+    step = loaded['batch'] or len(items)  # 静态 batch 的 ONNX 模型按其固定 batch 分块
+    conf = min(item['conf'] for item in items)
+    results = []
+    for i in range(0, len(items), step):
+        chunk = items[i:i + step]
+        results.extend(loaded['model'].predict([item['image'] for item in chunk], imgsz=imgsz, conf=conf, iou=iou,
+                                               device='cpu', verbose=False))
+    return results
+
+
+model_cache = ModelCache(_load_model)
+batcher = MicroBatcher(_predict_batch, name='model-predict')
+
+
+@infer_bp.record_once
+def _init_inference(state):
+    config = state.app.config
+    model_cache.configure(max_models=config.get('MODEL_CACHE_MAX_MODELS'),
+                          max_mem_mb=config.get('MODEL_CACHE_MAX_MB'),
+                          idle_seconds=config.get('MODEL_CACHE_IDLE_SECONDS'))
+    model_cache.start()
+    batcher.configure(max_batch=config.get('PREDICT_MAX_BATCH'), max_wait_ms=config.get('PREDICT_BATCH_WAIT_MS'))
+
+
+def _label_colors(task_path):
+    try:
+        with open(os.path.join(task_path, 'labels.json'), 'r', encoding='utf-8') as f:
+            return {label['name']: label.get('color') for label in json.load(f)}
+    except (OSError, ValueError):
+        return {}
+
+
+@infer_bp.route('/api/model/predict', methods=['POST'])
+@login_required
+def model_predict():
+    """
+    用某次训练运行的模型对当前图片推理，返回与 /api/sam/predict 相同格式的标注 (另附 confidence)。
+    JSON 参数: owner / taskName / imageName / runName，可选 confidence / iou / imgsz / annType / preferOnnx
+    """
+    data = request.json or {}
+    owner = data.get('owner')
+    task_name = data.get('taskName')
+
+    if not check_perm(owner, task_name):
+        return jsonify({"error": "Access Denied"}), 403
+
+    image_name = data.get('imageName') or ''
+    run_name = data.get('runName') or ''
+    if not re.match(r'^[\w\-\.]+$', run_name) or os.path.basename(image_name) != image_name:
+        return jsonify({"error": "Invalid Name"}), 400
+    confidence = float(data.get('confidence', 0.25))
+    iou = float(data.get('iou', 0.7))
+    imgsz = int(data.get('imgsz', 640))
+
+    task_path = os.path.join(current_app.config['DATA_DIR'], owner, task_name)
+    image_path = os.path.join(task_path, image_name)
+    weights = find_best_weights(os.path.join(task_path, 'runs', run_name))
+    if not weights:
+        return jsonify({"error": "该运行没有可用的权重文件"}), 404
+    if not os.path.exists(image_path):
+        return jsonify({"error": "图片不存在"}), 404
+
+    try:
+        started = time.perf_counter()
+        key, loaded = model_cache.get(pick_weights(weights, data.get('preferOnnx', True)))
+        loaded_at = time.perf_counter()
+        image = decode_image(image_path)
+        if image is None:
+            return jsonify({"error": "无法读取图片"}), 400
+        result = batcher.submit((key, imgsz, iou), {'loaded': loaded, 'image': image, 'conf': confidence},
+                                timeout=60)
+        colors = _label_colors(task_path)
+        annotations = []
+        for ann in result_to_annotations(result, data.get('annType')):
+            if ann['confidence'] < confidence:
+                continue
+            ann['color'] = colors.get(ann['label'], "#FF0000")
+            annotations.append(ann)
+        return jsonify({"success": True, "annotations": annotations,
+                        "timing": {"load_ms": round((loaded_at - started) * 1000, 1),
+                                   "total_ms": round((time.perf_counter() - started) * 1000, 1)}})
+    except Exception as e:
+        print(f"Model Predict Error: {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@infer_bp.route('/api/model/cache', methods=['GET'])
+@login_required
+def model_cache_stats():
+    if not current_user.is_admin:
+        return jsonify({"error": "Access Denied"}), 403
+    return jsonify({"success": True, "models": model_cache.stats()})
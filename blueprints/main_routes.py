@@ -4,10 +4,15 @@ import shutil
 from functools import wraps
 from flask import Blueprint, render_template, jsonify, current_app, request
 from flask_login import login_required, current_user
-from models import TaskPermission
+from permissions import check_perm, granted_tasks, invalidate, revoke_task
+from utils.startup import warmup
+from utils.task_catalog import TaskCatalog
 
 main_bp = Blueprint('main', __name__)
 
+# 任务目录缓存 (任务列表和每个任务的摘要)，按目录 mtime 失效
+catalog = TaskCatalog()
+
 NAME_RE = re.compile(r'^[A-Za-z0-9_\-\u4e00-\u9fff ]+$')
 
 
@@ -43,20 +48,15 @@ def verify_access(f):
 
         # 3. 访问 Public 目录 -> 需要更细致的检查
         if owner == 'public':
-            # 如果只是 GET 请求获取任务列表 (main.get_tasks)，允许通过
-            # 因为 get_tasks 内部还有一层过滤逻辑，只返回用户可见的任务
-            if request.method == 'GET' and request.endpoint == 'main.get_tasks':
+            # 如果只是 GET 请求获取任务列表 (main.get_tasks / main.get_task_summaries)，允许通过
+            # 因为它们内部还有一层过滤逻辑，只返回用户可见的任务
+            if request.method == 'GET' and request.endpoint in ('main.get_tasks', 'main.get_task_summaries'):
                 return f(*args, **kwargs)
 
             # 如果是具体操作某个任务 (删除、修改、标注、上传)
             if task_name:
-                # 检查数据库 TaskPermission 表
-                perm = TaskPermission.query.filter_by(
-                    user_id=current_user.id,
-                    owner_name='public',
-                    task_name=task_name
-                ).first()
-                if perm:
+                # 检查 TaskPermission 授权 (带缓存)
+                if check_perm('public', task_name):
                     return f(*args, **kwargs)
 
         # 4. 其他情况一律拒绝（例如普通用户想访问别人的目录）
@@ -82,6 +82,18 @@ def task_page(owner):
     return render_template('tasks.html', owner=owner, user=current_user)
 
 
+@main_bp.route('/api/system/ready', methods=['GET'])
+def system_ready():
+    """
+    就绪检查 (无需登录，可用于负载均衡 / 进程管理的探针)：后台预热 (torch / ultralytics / SAM) 全部结束前返回 503。
+    Web 服务本身在此之前已可正常使用，只是训练 / 推理的第一次请求需要等待对应模块导入。
+    """
+    status = warmup.status()
+    report = current_app.extensions.get('startup_report')
+    status['startup'] = report.as_dict() if report else None
+    return jsonify(status), 200 if status['ready'] else 503
+
+
 @main_bp.route('/api/owners', methods=['GET'])
 @login_required
 def get_owners():
@@ -100,9 +112,7 @@ def get_owners():
 
     if current_user.is_admin:
         # 管理员看到所有物理文件夹
-        owners = [d for d in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR, d))]
-        owners.sort()
-        return jsonify(owners)
+        return jsonify(catalog.subdirs(DATA_DIR))
     else:
         # 普通用户只能看到自己和 public，绝对看不到其他人
         visible_owners = [current_user.username, 'public']
@@ -120,40 +130,44 @@ def get_tasks(owner):
         - Admin: 返回所有物理任务。
         - User: 查 DB，只返回被授权的任务名。
     """
-    DATA_DIR = current_app.config['DATA_DIR']
-    owner_path = os.path.join(DATA_DIR, owner)
+    return jsonify(_visible_tasks(owner))
 
-    if not os.path.exists(owner_path):
-        return jsonify([])
 
-    # 获取物理文件列表
-    try:
-        physical_tasks = [d for d in os.listdir(owner_path) if os.path.isdir(os.path.join(owner_path, d))]
-    except OSError:
-        return jsonify([])
+def _visible_tasks(owner):
+    """当前用户在 owner 下能看到的任务名 (已排序)。"""
+    # 获取物理文件列表 (缓存，owner 目录未变化时不重新列目录)
+    physical_tasks = catalog.subdirs(os.path.join(current_app.config['DATA_DIR'], owner))
 
     # 逻辑过滤
     if current_user.is_admin:
         # 管理员看一切
-        physical_tasks.sort()
-        return jsonify(physical_tasks)
+        return physical_tasks
 
     if owner == current_user.username:
         # 自己看自己的一切
-        physical_tasks.sort()
-        return jsonify(physical_tasks)
+        return physical_tasks
 
     if owner == 'public':
         # public 目录：只看授权的
-        perms = TaskPermission.query.filter_by(user_id=current_user.id, owner_name='public').all()
-        allowed_task_names = set(p.task_name for p in perms)
+        allowed_task_names = {task for owner_name, task in granted_tasks(current_user.id) if owner_name == 'public'}
 
         # 取交集：物理存在的 AND 授权的
-        visible_tasks = [t for t in physical_tasks if t in allowed_task_names]
-        visible_tasks.sort()
-        return jsonify(visible_tasks)
+        return [t for t in physical_tasks if t in allowed_task_names]
 
-    return jsonify([])
+    return []
+
+
+@main_bp.route('/api/task_summaries/<owner>', methods=['GET'])
+@login_required
+@verify_access
+def get_task_summaries(owner):
+    """
+    任务列表及每个任务的摘要 (与 /api/tasks/<owner> 的可见范围相同):
+    [{name, images, labelled, classes, disk_bytes, last_run: {name, modified} | null}]
+    摘要按任务目录的 mtime 缓存，只有发生变化的任务才会重新扫描。
+    """
+    owner_path = os.path.join(current_app.config['DATA_DIR'], owner)
+    return jsonify(catalog.summaries(owner_path, _visible_tasks(owner)))
 
 
 @main_bp.route('/api/tasks/create', methods=['POST'])
@@ -207,9 +221,7 @@ def delete_task():
             shutil.rmtree(task_path)
             # 清理权限记录
             if owner == 'public':
-                TaskPermission.query.filter_by(owner_name='public', task_name=taskName).delete()
-                from extensions import db
-                db.session.commit()
+                revoke_task('public', taskName)
             return jsonify({"success": True})
         except Exception as e:
             return jsonify({"error": str(e)}), 500
@@ -243,6 +255,7 @@ def delete_owner():
             if u:
                 db.session.delete(u)
                 db.session.commit()
+                invalidate(u.id)
             return jsonify({"success": True})
         except Exception as e:
             return jsonify({"error": str(e)}), 500
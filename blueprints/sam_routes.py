@@ -1,10 +1,17 @@
 # blueprints/sam_routes.py
 import os
+import time
+import uuid
 from collections import defaultdict
 from flask import Blueprint, request, jsonify, current_app
 from flask_login import login_required, current_user
+from blueprints.train_routes import scheduler, active_tasks_map, submit_background_job
 from utils.AI_wrapper import SAM3Engine
-from models import TaskPermission
+from utils.microbatch import QueueFull
+from utils.sam_backend import create_backend, DisabledSamBackend
+from utils.polygon import simplify_polygon
+from utils.sam_annotate import results_to_annotations
+from permissions import check_perm
 
 sam_bp = Blueprint('sam', __name__)
 
@@ -13,11 +20,24 @@ def get_engine():
     return SAM3Engine.get_instance()
 
 
-def check_perm(owner, task_name):
-    if current_user.is_admin: return True
-    if owner == current_user.username: return True
-    perm = TaskPermission.query.filter_by(user_id=current_user.id, owner_name=owner, task_name=task_name).first()
-    return True if perm else False
+@sam_bp.record_once
+def _init_engine(state):
+    """按配置选择 SAM 后端和编码缓存上限 (模型在第一次请求时才加载)。"""
+    config = state.app.config
+    cache_mb = config.get('SAM_EMBEDDING_CACHE_MB')
+    backend_name = config.get('SAM_BACKEND') or 'disabled'
+    get_engine().configure(backend=None if backend_name == 'disabled' else create_backend(backend_name),
+                           cache_bytes=int(cache_mb * 1024 * 1024) if cache_mb is not None else None,
+                           max_batch=config.get('SAM_MAX_BATCH'), max_wait_ms=config.get('SAM_BATCH_WAIT_MS'),
+                           max_queue=config.get('SAM_MAX_QUEUE'), request_timeout=config.get('SAM_REQUEST_TIMEOUT'),
+                           prefetch_depth=config.get('SAM_PREFETCH_DEPTH'))
+
+
+def _simplify(points):
+    """按配置简化 SAM 输出的稠密多边形 (SAM_POLYGON_TOLERANCE 像素容差，SAM_POLYGON_MAX_VERTICES 顶点上限)。"""
+    config = current_app.config
+    return simplify_polygon(points, config.get('SAM_POLYGON_TOLERANCE') or 0,
+                            config.get('SAM_POLYGON_MAX_VERTICES'))
 
 
 @sam_bp.route('/api/sam/predict', methods=['POST'])
@@ -39,6 +59,7 @@ def sam_predict():
     DATA_DIR = current_app.config['DATA_DIR']
     image_path = os.path.join(DATA_DIR, owner, task_name, image_name)
     engine = get_engine()
+    engine.prefetch_after(os.path.join(DATA_DIR, owner, task_name), image_name)
 
     groups = defaultdict(lambda: {
         'boxes': [], 'box_labels': [],
@@ -68,20 +89,23 @@ def sam_predict():
     generated_annotations = []
 
     try:
-        for label_name, g in groups.items():
-            if not g['boxes'] and not g['points']: continue
-
-            results = engine.predict_mixed(
-                image_path,
-                bboxes=g['boxes'],
-                bbox_labels=g['box_labels'],
-                points=g['points'],
-                point_labels=g['point_labels'],
-                text_prompt=label_name,
-                conf_thres=confidence,
-                sam_mode=sam_mode  # 【新增】传入模式
-            )
-
+        # 所有标签的提示组一次性提交：共享同一次图片编码，并批量解码
+        labels = [label_name for label_name, g in groups.items() if g['boxes'] or g['points']]
+        batch_results = engine.predict_mixed_batch(
+            image_path,
+            [{
+                'bboxes': groups[label_name]['boxes'],
+                'bbox_labels': groups[label_name]['box_labels'],
+                'points': groups[label_name]['points'],
+                'point_labels': groups[label_name]['point_labels'],
+                'text_prompt': label_name,
+            } for label_name in labels],
+            conf_thres=confidence,
+            sam_mode=sam_mode  # 【新增】传入模式
+        )
+
+        for label_name, results in zip(labels, batch_results):
+            g = groups[label_name]
             for res in results:
                 final_label = label_name
                 if g['rotation'] != 0:
@@ -91,10 +115,13 @@ def sam_predict():
                     "type": "polygon",
                     "label": final_label,
                     "color": g['color'],
-                    "points": res['points']
+                    "points": _simplify(res['points'])
                 })
 
         return jsonify({"success": True, "annotations": generated_annotations})
+    except (QueueFull, TimeoutError) as e:
+        # 推理队列过载：让前端稍后重试，而不是无限等待
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         print(f"SAM Predict Error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -118,23 +145,77 @@ def sam_auto_annotate():
     image_path = os.path.join(DATA_DIR, owner, task_name, image_name)
     engine = get_engine()
 
-    texts = [item['text'] for item in prompt_config]
+    prompt_by_text = {item['text']: item for item in prompt_config}
 
     try:
-        results = engine.predict_text(image_path, texts, conf_thres=confidence)
-        final_anns = []
-
-        for res in results:
-            cfg = next((c for c in prompt_config if c['text'] == res['label_text']), None)
-            if cfg:
-                final_anns.append({
-                    "type": "polygon",
-                    "label": cfg['label'],
-                    "color": cfg['color'],
-                    "points": res['points']
-                })
+        results = engine.predict_text(image_path, list(prompt_by_text), conf_thres=confidence)
+        config = current_app.config
+        final_anns = results_to_annotations(results, prompt_by_text, config.get('SAM_POLYGON_TOLERANCE') or 0,
+                                            config.get('SAM_POLYGON_MAX_VERTICES'))
 
         return jsonify({"success": True, "annotations": final_anns})
+    except (QueueFull, TimeoutError) as e:
+        # 推理队列过载：让前端稍后重试，而不是无限等待
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         print(f"SAM Auto Annotate Error: {e}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+
+@sam_bp.route('/api/sam/auto_annotate_task/<owner>/<task_name>', methods=['POST'])
+@login_required
+def sam_auto_annotate_task(owner, task_name):
+    """
+    用 SAM 文本提示自动标注整个任务 (后台任务，由训练调度器的 'sam_annotate' runner 执行，进度通过 /stream/<stream_id> 推送)。
+    JSON 参数: promptConfig ([{text, label, color}]，与 /api/sam/auto_annotate 相同) / confidence /
+              overwrite (覆盖已有标注，默认 false) / images (只处理指定图片) / batch (每批提交的图片数，默认 8) /
+              writeEmpty (没有检测到目标的图片也写入空标注，默认 false)
+    """
+    if not check_perm(owner, task_name):
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+    if isinstance(get_engine().backend, DisabledSamBackend):
+        return jsonify({'status': 'error', 'message': 'SAM 引擎未启用 (SAM_BACKEND=disabled)'}), 503
+    task_key = f"{owner}/{task_name}"
+    if task_key in active_tasks_map():
+        return jsonify({'status': 'error', 'message': '该任务已有后台任务在运行中'}), 400
+    task_path = os.path.join(current_app.config['DATA_DIR'], owner, task_name)
+    if not os.path.isdir(task_path):
+        return jsonify({'status': 'error', 'message': '任务不存在'}), 404
+
+    data = request.get_json(silent=True) or {}
+    prompt_config = [c for c in data.get('promptConfig') or [] if c.get('text') and c.get('label')]
+    if not prompt_config:
+        return jsonify({'status': 'error', 'message': '缺少提示词配置'}), 400
+    config = current_app.config
+    try:
+        conf = float(data.get('confidence', 0.25))
+        batch = int(data.get('batch', config.get('SAM_MAX_BATCH') or 8))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'confidence 必须是数字，batch 必须是整数'}), 400
+    spec = {
+        'task_path': task_path,
+        'prompt_config': prompt_config,
+        'conf': conf,
+        'overwrite': bool(data.get('overwrite', False)),
+        'write_empty': bool(data.get('writeEmpty', False)),
+        'images': data.get('images'),
+        'batch': batch,
+        'tolerance': config.get('SAM_POLYGON_TOLERANCE') or 0,
+        'max_vertices': config.get('SAM_POLYGON_MAX_VERTICES'),
+    }
+    stream_id = str(uuid.uuid4())
+    job = submit_background_job({
+        'stream_id': stream_id, 'kind': 'sam_annotate', 'task_key': task_key, 'user': current_user.username,
+        'device': 'cpu', 'mem_mb': 0, 'runs_dir': os.path.join(task_path, 'infer_jobs'),
+        'base_name': f"sam_{int(time.time())}_{stream_id[:8]}", 'spec': spec,
+    }, "SAM 自动标注任务已加入队列...")
+    return jsonify({'status': 'ok', 'stream_id': stream_id, 'queue_position': scheduler.position(job['stream_id'])})
+
+
+@sam_bp.route('/api/sam/stats', methods=['GET'])
+@login_required
+def sam_stats():
+    """推理队列 (排队数、批大小、排队 / 总耗时分位数、超时与拒绝数) 和编码缓存的统计。"""
+    if not current_user.is_admin:
+        return jsonify({"error": "Access Denied"}), 403
+    return jsonify({"success": True, **get_engine().stats()})
@@ -6,59 +6,77 @@ import uuid
 import shutil
 import re
 import time
-import queue
 import signal
+import json
 from flask import Blueprint, render_template, request, jsonify, Response, send_from_directory, current_app, abort
 from flask_login import login_required, current_user
 from utils.dataset_helper import prepare_dataset_for_training
-from models import TaskPermission
+from utils.train_scheduler import TrainScheduler, resolve_device, apply_cpu_affinity
+from utils.job_store import JobStore
+from utils.export_queue import ExportQueue, parse_formats, parse_export_options
+from utils.run_registry import RunRegistry, SORT_COLUMNS
+from utils.warm_pool import WarmTrainerPool
+from utils.resource_monitor import ResourceMonitor
+from utils.batch_infer import PROGRESS_PREFIX, find_best_weights
+from utils.sweep import expand_trials, HalvingPolicy, TRAIN_EXTRA_ARGS, TRAIN_BASE_ARGS
+from utils.train_metrics import MetricsCollector, read_results
+from utils.log_store import LogBuffer, SegmentedLog, END_MARKER, read_log_index, read_segments
+from utils import sam_annotate
+from utils.AI_wrapper import SAM3Engine
+from utils.process_util import popen_detached, follow_log, process_create_time, is_same_process_alive, \
+    AttachedProcess
+from permissions import check_perm
 
 train_bp = Blueprint('train', __name__)
 
 # ============ 全局状态管理 ============
-training_streams = {}  # 存储日志流数据 (stream_id -> list[str])
-task_queue = queue.Queue()
-is_training_active = False
+training_streams = {}  # 存储日志流数据 (stream_id -> LogBuffer)
+
+# 调度器：多槽位并行执行，排队 / 运行状态都由它维护
+scheduler = TrainScheduler()
+# 导出队列：训练结束后的模型导出在独立的进程池中并行执行
+exporter = ExportQueue()
+# 预热的训练进程池：已导入 torch / ultralytics 的常驻进程，按任务 fork 出训练进程
+warm_pool = WarmTrainerPool()
+# 资源监控：定时采样 running_processes 中每个任务的进程树 (CPU / RSS / 线程 / 磁盘读写)
+monitor = ResourceMonitor()
+# 运行注册表 (RunRegistry)：任务开始 / 结束时登记，list_runs 等查询不再遍历目录；蓝图注册时初始化
+registry = None
+
+training_metrics = {}  # stream_id -> MetricsCollector (结构化的逐 epoch 指标)
+sweep_policies = {}  # sweep_id -> HalvingPolicy (超参搜索的早停状态)
+deferred_resumes = []  # [(原任务, 缓存目录)]：启动恢复时所在任务还有其他排队 / 运行中的任务，等任务空闲后再续训
 
 # 进程管理
 running_processes = {}  # stream_id -> subprocess.Popen
-# 记录每个 Task 对应的 active stream_id，用于刷新页面后重连
-# 格式: { "owner/task_name": "stream_id" }
-active_tasks_map = {}
 
 cancelled_tasks = set()
 process_lock = threading.Lock()
 
 
-# ============ 辅助函数 ============
+def is_training_active():
+    return scheduler.is_active()
 
-def check_perm(owner, task_name):
-    if current_user.is_admin: return True
-    if owner == current_user.username: return True
-    perm = TaskPermission.query.filter_by(user_id=current_user.id, owner_name=owner, task_name=task_name).first()
-    return True if perm else False
 
+def active_tasks_map():
+    """记录每个 Task 对应的 active stream_id，用于刷新页面后重连。格式: { "owner/task_name": "stream_id" }"""
+    return scheduler.active_tasks()
 
-def find_latest_run_dir(runs_dir: str, base_name_prefix: str):
-    if not os.path.isdir(runs_dir): return None
-    candidates = []
-    for d in os.listdir(runs_dir):
-        if d.startswith(base_name_prefix):
-            full = os.path.join(runs_dir, d)
-            if os.path.isdir(full):
-                try:
-                    mtime = os.path.getmtime(full)
-                except:
-                    mtime = 0
-                candidates.append((mtime, full))
-    if not candidates: return None
-    candidates.sort(key=lambda x: x[0], reverse=True)
-    return candidates[0][1]
 
+# ============ 辅助函数 ============
 
 def kill_task(stream_id):
     """强制终止任务"""
     print(f"[手动停止] 收到终止请求: {stream_id}")
+
+    # 还在排队：直接从调度器移除
+    if scheduler.cancel(stream_id):
+        if stream_id in training_streams:
+            training_streams[stream_id].append("__ERROR__:任务在排队期间已被取消")
+            training_streams[stream_id].append("__END_OF_STREAM__")
+        _close_stream(stream_id)
+        return
+
     cancelled_tasks.add(stream_id)
 
     with process_lock:
@@ -79,146 +97,630 @@ def kill_task(stream_id):
                     del running_processes[stream_id]
 
 
-# ============ 核心：后台训练工作线程 ============
-def training_worker():
-    global is_training_active
+# ============ 核心：后台训练任务 ============
+def _build_train_script(job, device):
+    safe_model_path = job['model_path'].replace('\\', '/')
+    safe_yaml_path = job['yaml_path'].replace('\\', '/')
+    safe_runs_dir = job['runs_dir'].replace('\\', '/')
+    params = job['params']
+    # 超参搜索等场景透传的额外训练参数 (白名单内的字段，值用 repr 保证是合法的 Python 字面量)
+    extra_args = "".join(f",\n            {k}={v!r}" for k, v in sorted(params.get('extra_args', {}).items())
+                         if k in TRAIN_EXTRA_ARGS)
+
+    if job.get('resume'):
+        # 断点续训：Ultralytics 从 last.pt 读取原来的全部训练参数 (数据集、轮数、运行目录等)，只覆盖设备
+        train_call = f"model.train(resume=True, device={str(device)!r})"
+    else:
+        train_call = f"""model.train(
+            data=r'{safe_yaml_path}',
+            epochs={int(params["epochs"])},
+            imgsz={int(params["imgsz"])},
+            batch={int(params["batch"])},
+            device={str(device)!r},
+            project=r'{safe_runs_dir}',
+            name={job["base_name"]!r},
+            # 运行目录在启动前已创建 (存放 stdout.log)，不能让 Ultralytics 另起 name2
+            exist_ok=True{extra_args}
+        )"""
 
-    while True:
-        task = task_queue.get()
-        stream_id = task['stream_id']
-        # 记录任务所有者，用于状态映射
-        task_key = task.get('task_key')
+    # 构造训练脚本 (加入 stdout flush 保证日志实时)
+    train_script = f"""
+from ultralytics import YOLO
+import sys
+import signal
 
-        if stream_id in cancelled_tasks:
-            if stream_id in training_streams:
-                training_streams[stream_id].append("__ERROR__:任务在排队期间已被取消")
-                training_streams[stream_id].append("__END_OF_STREAM__")
+# 简单的信号处理，防止 Python 内部忽略信号
+def signal_handler(sig, frame):
+    print("Python script received signal, exiting...")
+    sys.exit(0)
+signal.signal(signal.SIGTERM, signal_handler)
 
-            # 清理映射
-            if task_key and active_tasks_map.get(task_key) == stream_id:
-                del active_tasks_map[task_key]
+if __name__ == '__main__':
+    try:
+        print("Initializing model...")
+        model = YOLO(r'{safe_model_path}')
+        print("Starting training loop...")
 
-            task_queue.task_done()
-            cancelled_tasks.discard(stream_id)
-            continue
+        # 训练
+        {train_call}
+    except Exception as e:
+        print(f"Training Error: {{e}}")
+        sys.exit(1)
+"""
+    return train_script
+
+
+def _push(stream_id, line):
+    if stream_id in training_streams:
+        training_streams[stream_id].append(line)
 
-        is_training_active = True
-        cmd = task['cmd']
-        runs_dir = task['runs_dir']
-        base_name = task['base_name']
-        export_params = task['export_params']
-        env = task['env']
 
-        process = None
+def _open_stream(stream_id, run_path):
+    """创建任务的日志流：内存环形缓冲区 + 运行目录 logs/ 下的磁盘日志。"""
+    buffer = LogBuffer(sink=SegmentedLog(os.path.join(run_path, 'logs')))
+    training_streams[stream_id] = buffer
+    return buffer
 
+
+def submit_background_job(job, message):
+    """
+    其他蓝图提交后台任务的入口 (如 sam_routes 的整任务自动标注)：在 runs_dir/base_name 下打开日志流，
+    推送排队提示后交给调度器。job 需包含 stream_id / kind / task_key / runs_dir / base_name 等字段，返回调度器中的任务。
+    """
+    _open_stream(job['stream_id'], os.path.join(job['runs_dir'], job['base_name']))
+    _push(job['stream_id'], "__QUEUED__")
+    _push(job['stream_id'], message)
+    return scheduler.submit(job)
+
+
+def _close_stream(stream_id):
+    """任务结束：压缩最后一个日志分段。内存中的日志仍保留，供页面继续查看。"""
+    buffer = training_streams.get(stream_id)
+    if buffer is not None and buffer.sink is not None:
         try:
-            if stream_id in training_streams:
-                training_streams[stream_id].append(f"__STARTING__")
-                training_streams[stream_id].append(f"🚀 任务开始执行 (后台运行中)...\n")
-
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                encoding='utf-8',
-                env=env,
-                bufsize=1,
-                universal_newlines=True
-            )
-
-            with process_lock:
-                if stream_id in cancelled_tasks:
-                    process.kill()
-                    raise Exception("任务启动时被取消")
-                running_processes[stream_id] = process
-
-            ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
-
-            # 实时读取日志
-            with process.stdout:
-                for line in iter(process.stdout.readline, ''):
-                    if not line: break
-                    clean_line = ansi_escape.sub('', line).rstrip()
-                    # 限制内存：如果日志太长，切掉前面的（防止跑几天内存爆炸）
-                    if stream_id in training_streams:
-                        if len(training_streams[stream_id]) > 5000:
-                            training_streams[stream_id] = training_streams[stream_id][-4000:]
-                        training_streams[stream_id].append(clean_line)
-
-            process.wait()
+            buffer.sink.close()
+        except Exception as e:
+            print(f"关闭日志文件失败: {e}")
+
+
+def _attached_run_succeeded(job, run_path):
+    """重新接管的进程拿不到退出码：按 results.csv 中已完成的 epoch 数判断训练是否跑完。"""
+    results_csv = os.path.join(run_path, 'results.csv')
+    if not os.path.exists(results_csv):
+        return False
+    with open(results_csv, 'r', encoding='utf-8', errors='replace') as f:
+        epochs_done = max(0, sum(1 for line in f if line.strip()) - 1)
+    return epochs_done >= int(job['params']['epochs'])
+
+
+def _sweep_policy(sweep_id):
+    """取超参搜索的早停策略；服务重启后按各子任务已有的 results.csv 重建里程碑记录。"""
+    policy = sweep_policies.get(sweep_id)
+    if policy is None and scheduler.store:
+        sweep = scheduler.store.get_sweep(sweep_id)
+        if sweep is None:
+            return None
+        halving = sweep['config'].get('halving') or {}
+        policy = HalvingPolicy(metric=sweep['config'].get('metric', 'map50_95'),
+                               min_epochs=halving.get('min_epochs', 5), eta=halving.get('eta', 3),
+                               mode=sweep['config'].get('mode', 'max'))
+        for child in scheduler.store.jobs_for_sweep(sweep_id):
+            results = read_results(os.path.join(child['runs_dir'], child['base_name']))
+            for row in results['epochs']:
+                policy.report(child.get('trial_id', child['stream_id']), row['epoch'], row.get(policy.metric),
+                              child['params']['epochs'])
+        sweep_policies[sweep_id] = policy
+    return policy
+
+
+def _check_sweep_pruning(job, metrics):
+    """超参搜索子任务每完成一个 epoch 汇报一次指标，落后的试验被提前终止。"""
+    snapshot = metrics.snapshot(job.get('_reported_epoch', 0))
+    if not snapshot['epochs'] or job.get('pruned'):
+        return
+    policy = _sweep_policy(job['sweep_id'])
+    if policy is None or not policy.metric:
+        return
+    for row in snapshot['epochs']:
+        job['_reported_epoch'] = row['epoch']
+        # 续训产生的新任务沿用原试验的 trial_id，不会在里程碑中重复计入
+        trial_id = job.get('trial_id', job['stream_id'])
+        if not policy.report(trial_id, row['epoch'], row.get(policy.metric), job['params']['epochs']):
+            job['pruned'] = True
+            _push(job['stream_id'], f"✂️ [超参搜索] epoch {row['epoch']} 时 {policy.metric}={row.get(policy.metric)} "
+                                    f"落后于其他试验，提前终止")
+            kill_task(job['stream_id'])
+            return
+
+
+def run_training_job(job, slot):
+    """
+    调度器 runner：在分配到的槽位上执行一次训练 (原 training_worker 的循环体)。
+    子进程的输出写入运行目录下的 stdout.log，再由本线程跟读推送到日志流；
+    这样服务重启不会切断子进程的输出，重启后可以按记录的 PID 和偏移重新接管。
+    """
+    stream_id = job['stream_id']
+    store = scheduler.store
+
+    if stream_id in cancelled_tasks:
+        _push(stream_id, "__ERROR__:任务在排队期间已被取消")
+        _push(stream_id, "__END_OF_STREAM__")
+        _close_stream(stream_id)
+        cancelled_tasks.discard(stream_id)
+        return 'cancelled'
+
+    runs_dir = job['runs_dir']
+    base_name = job['base_name']
+    export_params = job['export_params']
+    run_path = os.path.join(runs_dir, base_name)
+    spool_path = os.path.join(run_path, 'stdout.log')
+    device = resolve_device(job, slot)
+    job_env = {"PYTHONUTF8": "1"}
+    if slot.get('cpus'):
+        # 限制 torch / OpenMP 线程数与绑定的核数一致，避免多个 CPU 任务互相抢核
+        job_env["OMP_NUM_THREADS"] = str(len(slot['cpus']))
+
+    process = None
+    reattached = bool(job.get('reattach'))
+    final_state = 'failed'
 
-            if stream_id in cancelled_tasks:
-                final_status = "__ERROR__:任务已被用户手动停止"
-            elif process.returncode == 0:
-                run_path = find_latest_run_dir(runs_dir, base_name)
-                if run_path:
-                    # --- 自动导出逻辑 (保持不变) ---
-                    best_pt = os.path.join(run_path, 'weights', 'metal2.pt')  # 注意：你的代码里写死为metal2.pt，请确认是否正确，通常是best.pt
-                    if not os.path.exists(best_pt):
-                        best_pt = os.path.join(run_path, 'weights', 'best.pt')
-
-                    if os.path.exists(best_pt):
-                        try:
-                            if stream_id in training_streams:
-                                training_streams[stream_id].append(f"\n--- [自动导出] {export_params['format']} ---")
-
-                            safe_best_pt = best_pt.replace('\\', '/')
-                            export_script = f"""
-from ultralytics import YOLO
-import sys
-if __name__ == '__main__':
     try:
-        model = YOLO(r'{safe_best_pt}')
-        res = model.export(format='{export_params["format"]}', opset={export_params["opset"]})
-        print(f"Export Success: {{res}}")
+        if reattached:
+            process = AttachedProcess(job['pid'])
+            _push(stream_id, f"♻️ 服务重启后已重新接管训练进程 (PID {job['pid']})")
+        else:
+            _push(stream_id, f"__STARTING__")
+            _push(stream_id, f"🚀 任务开始执行 (槽位 {slot['name']}，设备 {device or 'auto'})...\n")
+            if job.get('resume'):
+                _push(stream_id, f"⏯️ 从断点续训: {job['model_path']}")
+            os.makedirs(run_path, exist_ok=True)
+            # 续训时同一运行目录下可能残留上次中断的 stdout.log，只跟读本次追加的部分
+            job['log_offset'] = os.path.getsize(spool_path) if os.path.exists(spool_path) else 0
+            train_script = _build_train_script(job, device)
+            # 优先在预热好的进程中 fork 执行 (省去导入 torch / ultralytics 的时间)，不可用时启动新的解释器
+            process = warm_pool.launch(stream_id, train_script, spool_path, env=job_env)
+            if process is None:
+                with open(spool_path, 'ab') as spool:
+                    process = popen_detached([sys.executable, '-u', '-c', train_script], stdout=spool,
+                                             env={**os.environ, **job_env})
+            else:
+                _push(stream_id, f"⚡ 使用预热的训练进程 (PID {process.pid})")
+            if store:
+                store.update(stream_id, pid=process.pid, pid_ctime=process_create_time(process.pid),
+                             log_offset=job['log_offset'])
+            if registry:
+                registry.record_start(job)
+
+        with process_lock:
+            if stream_id in cancelled_tasks:
+                process.kill()
+                raise Exception("任务启动时被取消")
+            running_processes[stream_id] = process
+        if not reattached:
+            apply_cpu_affinity(process.pid, slot)
+
+        ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
+
+        # 日志偏移每隔几秒落库一次，避免每行都写数据库
+        last_saved = [0.0]
+
+        def save_offset(offset):
+            if store and time.time() - last_saved[0] > 2.0:
+                last_saved[0] = time.time()
+                store.update(stream_id, log_offset=offset)
+
+        metrics = training_metrics[stream_id] = MetricsCollector(run_path)
+
+        # 实时读取日志 (重新接管时从记录的偏移继续读，之前的内容已在磁盘日志中)
+        for line in follow_log(spool_path, job.get('log_offset', 0), lambda: process.poll() is None, on_offset=save_offset):
+            clean_line = ansi_escape.sub('', line).rstrip()
+            # LogBuffer 是定长环形缓冲区，跑几天也不会让内存无限增长
+            _push(stream_id, clean_line)
+            metrics.feed_stdout(clean_line)
+            if job.get('sweep_id'):
+                _check_sweep_pruning(job, metrics)
+
+        process.wait()
+        metrics.poll()
+        if store:
+            store.update(stream_id, log_offset=os.path.getsize(spool_path))
+
+        succeeded = _attached_run_succeeded(job, run_path) if reattached else process.returncode == 0
+        if job.get('pruned'):
+            final_status = "__ERROR__:超参搜索早停：该配置指标落后于其他试验"
+            final_state = 'pruned'
+        elif stream_id in cancelled_tasks:
+            final_status = "__ERROR__:任务已被用户手动停止"
+            final_state = 'cancelled'
+        elif succeeded:
+            # run_path 在训练开始前就已创建 (split.json / stdout.log)，以是否产出权重判断训练是否真的完成
+            best_pt = find_best_weights(run_path)
+            if best_pt:
+                # 导出交给独立的导出队列并行执行，不再占用训练槽位
+                formats = export_params.get('formats') or [export_params['format']]
+                if formats:
+                    exports = exporter.submit(best_pt, formats,
+                                              {'opset': export_params.get('opset'), 'imgsz': job['params']['imgsz']},
+                                              task_key=job['task_key'], run_name=os.path.basename(run_path))
+                    _push(stream_id, f"\n--- [自动导出] 已提交 {', '.join(e['format'] for e in exports)}，"
+                                     f"在后台导出队列中进行 ---")
+
+                run_name = os.path.basename(run_path)
+                final_status = f"__SUCCESS__:{run_name}"
+                final_state = 'succeeded'
+            else:
+                final_status = "__ERROR__:训练完成但未找到产物 (weights/best.pt)"
+                job['message'] = final_status
+        elif reattached:
+            final_status = "__ERROR__:重新接管的训练进程已退出，但训练未跑完全部 epoch"
+            job['message'] = final_status
+        else:
+            final_status = f"__ERROR__:训练异常退出 (Code: {process.returncode})"
+            job['message'] = final_status
+
+        if stream_id in training_streams:
+            training_streams[stream_id].append(final_status)
+            training_streams[stream_id].append("__END_OF_STREAM__")
+
     except Exception as e:
-        print(f"Export Error: {{e}}")
-        sys.exit(1)
-"""
-                            export_cmd = [sys.executable, '-u', '-c', export_script]
-                            res = subprocess.run(export_cmd, capture_output=True, text=True, encoding='utf-8',
-                                                 check=False, env=env)
-
-                            if stream_id in training_streams:
-                                training_streams[stream_id].append("\n" + res.stdout + "\n" + res.stderr)
-                        except Exception as e:
-                            if stream_id in training_streams:
-                                training_streams[stream_id].append(f"\n--- 导出流程异常: {e} ---\n")
-
-                    run_name = os.path.basename(run_path)
-                    final_status = f"__SUCCESS__:{run_name}"
-                else:
-                    final_status = "__ERROR__:训练完成但未找到产物"
+        if stream_id in training_streams:
+            training_streams[stream_id].append(f"__ERROR__:执行错误: {str(e)}")
+            training_streams[stream_id].append("__END_OF_STREAM__")
+
+    finally:
+        with process_lock:
+            if stream_id in running_processes:
+                del running_processes[stream_id]
+
+        _close_stream(stream_id)
+        if registry:
+            try:
+                registry.record_finish(job['task_key'], base_name, os.path.join(runs_dir, base_name), final_state,
+                                       job)
+            except Exception as e:
+                print(f"[注册表] 登记运行结果失败: {e}")
+        # 原始输出已完整写入 logs/，不再需要 stdout.log
+        if process is not None and process.poll() is not None and os.path.exists(spool_path):
+            try:
+                os.remove(spool_path)
+            except OSError:
+                pass
+        cancelled_tasks.discard(stream_id)
+
+    return final_state
+
+
+scheduler.register_runner('train', run_training_job)
+
+
+def _last_infer_progress(spool_path, tail_bytes=64 * 1024):
+    try:
+        with open(spool_path, 'rb') as f:
+            f.seek(max(0, os.path.getsize(spool_path) - tail_bytes))
+            lines = f.read().decode('utf-8', errors='replace').splitlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        if line.startswith(PROGRESS_PREFIX):
+            try:
+                return json.loads(line[len(PROGRESS_PREFIX):])
+            except ValueError:
+                return None
+    return None
+
+
+# 以脚本子进程运行的推理类任务: kind -> (utils 下的脚本, 任务名称)
+_SCRIPT_JOBS = {
+    'infer': ('batch_infer.py', '预标注'),
+    'eval': ('evaluation.py', '评估'),
+    'simplify': ('polygon.py', '多边形简化'),
+}
+
+
+def run_infer_job(job, slot):
+    """
+    调度器 runner：批量预标注 (kind='infer') 和模型评估 (kind='eval')。
+    对应脚本在独立子进程中运行，输出写入任务目录下的 stdout.log 并转发到日志流，
+    "__PROGRESS__ {json}" 行转换为 "__PROGRESS__:{json}" 推送 (已处理 / 总数 / 吞吐 images/s 等)。
+    """
+    script_name, title = _SCRIPT_JOBS[job.get('kind', 'infer')]
+    stream_id = job['stream_id']
+    store = scheduler.store
+    job_dir = os.path.join(job['runs_dir'], job['base_name'])
+    spool_path = os.path.join(job_dir, 'stdout.log')
+    reattached = bool(job.get('reattach'))
+    process = None
+    progress = {}
+    final_state = 'failed'
+
+    if stream_id in cancelled_tasks:
+        _push(stream_id, "__ERROR__:任务在排队期间已被取消")
+        _push(stream_id, END_MARKER)
+        _close_stream(stream_id)
+        cancelled_tasks.discard(stream_id)
+        return 'cancelled'
+
+    try:
+        if reattached:
+            process = AttachedProcess(job['pid'])
+            _push(stream_id, f"♻️ 服务重启后已重新接管{title}进程 (PID {job['pid']})")
+        else:
+            _push(stream_id, "__STARTING__")
+            _push(stream_id, f"🚀 {title}开始执行 (槽位 {slot['name']})...")
+            os.makedirs(job_dir, exist_ok=True)
+            spec_path = os.path.join(job_dir, 'spec.json')
+            with open(spec_path, 'w', encoding='utf-8') as f:
+                json.dump(job['spec'], f, ensure_ascii=False)
+            job['log_offset'] = os.path.getsize(spool_path) if os.path.exists(spool_path) else 0
+            env = {**os.environ, 'PYTHONUTF8': '1'}
+            if slot.get('cpus'):
+                env['OMP_NUM_THREADS'] = str(len(slot['cpus']))
+            script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'utils',
+                                  script_name)
+            with open(spool_path, 'ab') as spool:
+                process = popen_detached([sys.executable, '-u', script, spec_path], stdout=spool, env=env)
+            if store:
+                store.update(stream_id, pid=process.pid, pid_ctime=process_create_time(process.pid),
+                             log_offset=job['log_offset'])
+
+        with process_lock:
+            if stream_id in cancelled_tasks:
+                process.kill()
+                raise Exception("任务启动时被取消")
+            running_processes[stream_id] = process
+        if not reattached:
+            apply_cpu_affinity(process.pid, slot)
+
+        last_saved = [0.0]
+
+        def save_offset(offset):
+            if store and time.time() - last_saved[0] > 2.0:
+                last_saved[0] = time.time()
+                store.update(stream_id, log_offset=offset)
+
+        for line in follow_log(spool_path, job.get('log_offset', 0), lambda: process.poll() is None,
+                               on_offset=save_offset):
+            line = line.rstrip()
+            if line.startswith(PROGRESS_PREFIX):
+                try:
+                    progress = json.loads(line[len(PROGRESS_PREFIX):])
+                except ValueError:
+                    continue
+                _push(stream_id, f"__PROGRESS__:{json.dumps(progress)}")
             else:
-                final_status = f"__ERROR__:训练异常退出 (Code: {process.returncode})"
+                _push(stream_id, line)
+        process.wait()
+
+        if reattached:
+            # 重新接管的进程拿不到退出码，按日志中最后一次进度判断是否处理完了全部图片
+            progress = _last_infer_progress(spool_path) or progress
+        finished = progress.get('total') is not None and progress.get('done') == progress.get('total') \
+            and progress.get('phase', 'done') == 'done'
+        if stream_id in cancelled_tasks:
+            _push(stream_id, "__ERROR__:任务已被用户手动停止")
+            final_state = 'cancelled'
+        elif (reattached and finished) or (not reattached and process.returncode == 0):
+            if job.get('kind') == 'eval':
+                _push(stream_id, "__SUCCESS__:评估完成")
+            elif job.get('kind') == 'simplify':
+                _push(stream_id, f"__SUCCESS__:多边形简化完成，修改 {progress.get('changed', 0)} 个文件 "
+                                 f"(顶点 {progress.get('points_before', 0)} -> {progress.get('points_after', 0)})")
+            else:
+                _push(stream_id, f"__SUCCESS__:预标注完成，写入 {progress.get('written', 0)} 张")
+            final_state = 'succeeded'
+        else:
+            _push(stream_id, f"__ERROR__:{title}异常退出 (Code: {process.returncode})")
+    except Exception as e:
+        _push(stream_id, f"__ERROR__:执行错误: {str(e)}")
+        if stream_id in cancelled_tasks:
+            final_state = 'cancelled'
+    finally:
+        _push(stream_id, END_MARKER)
+        with process_lock:
+            running_processes.pop(stream_id, None)
+        _close_stream(stream_id)
+        cancelled_tasks.discard(stream_id)
+    return final_state
 
-            if stream_id in training_streams:
-                training_streams[stream_id].append(final_status)
-                training_streams[stream_id].append("__END_OF_STREAM__")
 
-        except Exception as e:
-            if stream_id in training_streams:
-                training_streams[stream_id].append(f"__ERROR__:执行错误: {str(e)}")
-                training_streams[stream_id].append("__END_OF_STREAM__")
+scheduler.register_runner('infer', run_infer_job)
+scheduler.register_runner('eval', run_infer_job)
+scheduler.register_runner('simplify', run_infer_job)
 
-        finally:
-            with process_lock:
-                if stream_id in running_processes:
-                    del running_processes[stream_id]
 
-            # 任务结束后，清理映射关系
-            if task_key and active_tasks_map.get(task_key) == stream_id:
-                del active_tasks_map[task_key]
+def run_sam_annotate_job(job, slot):
+    """
+    调度器 runner：整任务的 SAM 文本提示自动标注 (kind='sam_annotate')。
+    SAM 引擎在本进程内，任务直接在调度线程中运行；停止请求在当前批次结束后生效。
+    """
+    stream_id = job['stream_id']
+    final_state = 'failed'
+    if stream_id in cancelled_tasks:
+        _push(stream_id, "__ERROR__:任务在排队期间已被取消")
+        _push(stream_id, END_MARKER)
+        _close_stream(stream_id)
+        cancelled_tasks.discard(stream_id)
+        return 'cancelled'
+
+    try:
+        _push(stream_id, "__STARTING__")
+        _push(stream_id, f"🚀 SAM 自动标注开始执行 (槽位 {slot['name']})...")
+        finished, progress = sam_annotate.run(
+            SAM3Engine.get_instance(), job['spec'], report=lambda line: _push(stream_id, line),
+            progress=lambda fields: _push(stream_id, f"__PROGRESS__:{json.dumps(fields)}"),
+            should_stop=lambda: stream_id in cancelled_tasks)
+        if not finished:
+            _push(stream_id, "__ERROR__:任务已被用户手动停止")
+            final_state = 'cancelled'
+        else:
+            _push(stream_id, f"__SUCCESS__:自动标注完成，写入 {progress['written']} 张")
+            final_state = 'succeeded'
+    except Exception as e:
+        _push(stream_id, f"__ERROR__:执行错误: {str(e)}")
+    finally:
+        _push(stream_id, END_MARKER)
+        _close_stream(stream_id)
+        cancelled_tasks.discard(stream_id)
+    return final_state
 
-            cancelled_tasks.discard(stream_id)
-            is_training_active = False
-            task_queue.task_done()
 
+scheduler.register_runner('sam_annotate', run_sam_annotate_job)
 
-# 启动线程
-worker_thread = threading.Thread(target=training_worker, daemon=True)
-worker_thread.start()
+
+def _load_split_manifest(run_path):
+    path = os.path.join(run_path, 'split.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _last_checkpoint(run_path):
+    last_pt = os.path.join(run_path, 'weights', 'last.pt')
+    return last_pt if os.path.exists(last_pt) else None
+
+
+def _enqueue_resume_job(old_job, user, cache_dir=None):
+    """
+    为一次被停止 / 崩溃 / 因服务重启中断的训练创建续训任务 (不依赖请求上下文，启动恢复时也可调用)。
+    运行目录、训练参数沿用原任务；TrainData 按 split.json 还原为原来的划分，data.yaml 路径不变。
+    """
+    task_path = os.path.dirname(old_job['runs_dir'])
+    run_path = os.path.join(old_job['runs_dir'], old_job['base_name'])
+    last_pt = _last_checkpoint(run_path)
+    if not last_pt:
+        raise ValueError("该运行没有 weights/last.pt，无法续训")
+    split = _load_split_manifest(run_path)
+    if not split:
+        raise ValueError("该运行缺少 split.json (数据划分记录)，无法还原原来的数据集划分")
+
+    params = old_job['params']
+    prep = prepare_dataset_for_training(task_path, params['train_ratio'], imgsz=params['imgsz'],
+                                        cache_dir=cache_dir if params.get('resize_cache') else None, split=split)
+    if not prep['success']:
+        raise ValueError(prep['message'])
+
+    stream_id = str(uuid.uuid4())
+    _open_stream(stream_id, run_path)
+    training_streams[stream_id].append(prep['message'])
+    training_streams[stream_id].append(f"__QUEUED__")
+    training_streams[stream_id].append(f"续训任务已加入队列 (原任务 {old_job['stream_id']})...")
+
+    job = {k: v for k, v in old_job.items()
+           if k not in ('state', 'slot', 'pid', 'pid_ctime', 'log_offset', 'message', 'reattach', 'submitted_at',
+                        'pruned', '_reported_epoch')}
+    job.update({
+        'stream_id': stream_id,
+        'user': user,
+        'model_path': last_pt,
+        'yaml_path': prep['yaml_path'],
+        'resume': True,
+        'resumed_from': old_job['stream_id'],
+    })
+    if job.get('sweep_id'):
+        job['trial_id'] = old_job.get('trial_id', old_job['stream_id'])
+    return scheduler.submit(job)
+
+
+def _recover_jobs(store, config):
+    """
+    服务启动时恢复上次未结束的任务：排队中的重新入队，运行中的重新接管存活进程；
+    进程已不存在时，有 last.pt 的标记为 interrupted 并自动续训 (AUTO_RESUME_INTERRUPTED)，否则标记为失败。
+    续训会重建任务共享的 TrainData：同一任务还有排队 / 运行中的任务 (例如超参搜索的其他试验) 时，
+    续训推迟到该任务空闲后进行 (_resume_when_idle)，避免删掉它们正在读取的数据集。
+    """
+    resumables = []
+    for job in store.load_unfinished():
+        stream_id = job['stream_id']
+        buffer = _open_stream(stream_id, os.path.join(job['runs_dir'], job['base_name']))
+        # 用磁盘日志的末尾恢复内存中的日志视图 (不重复写盘)
+        for line in buffer.sink.tail(500):
+            buffer.append(line, persist=False)
+        if job['state'] == 'queued' or job.get('kind') == 'sam_annotate':
+            # 进程内运行的 SAM 自动标注随服务一起停止，重新排队即可 (默认跳过已写入标注的图片)
+            _push(stream_id, "__QUEUED__")
+            _push(stream_id, "服务重启后任务已恢复到队列中...")
+            scheduler.submit(job)
+        elif is_same_process_alive(job.get('pid'), job.get('pid_ctime')):
+            job['reattach'] = True
+            scheduler.adopt(job)
+        else:
+            message = '服务重启时训练进程已不存在'
+            run_path = os.path.join(job['runs_dir'], job['base_name'])
+            resumable = config.get('AUTO_RESUME_INTERRUPTED') and _last_checkpoint(run_path) \
+                and not _attached_run_succeeded(job, run_path)
+            _push(stream_id, f"__ERROR__:{message}" + ("，将自动从断点续训" if resumable else ""))
+            _push(stream_id, "__END_OF_STREAM__")
+            # 先关闭旧日志流，续训任务会在同一运行目录下重新打开磁盘日志
+            _close_stream(stream_id)
+            if resumable:
+                resumables.append(job)
+            else:
+                store.set_state(stream_id, 'failed', message=message)
+
+    # 排队中和重新接管的任务都已登记到调度器后再决定哪些续训可以立即进行
+    for job in resumables:
+        if job['task_key'] in scheduler.active_tasks():
+            deferred_resumes.append((job, config.get('IMAGE_CACHE_DIR')))
+            store.set_state(job['stream_id'], 'interrupted',
+                            message='服务重启时训练进程已不存在，等待该任务的其他训练结束后自动续训')
+        else:
+            _auto_resume(store, job, config.get('IMAGE_CACHE_DIR'))
+    if deferred_resumes:
+        threading.Thread(target=_resume_when_idle, args=(store,), name='deferred-resume', daemon=True).start()
+
+
+def _auto_resume(store, job, cache_dir):
+    message = '服务重启时训练进程已不存在'
+    try:
+        resumed = _enqueue_resume_job(job, job.get('user'), cache_dir)
+        store.set_state(job['stream_id'], 'interrupted',
+                        message=f"{message}，已自动从断点续训 (新任务 {resumed['stream_id']})")
+    except Exception as e:
+        store.set_state(job['stream_id'], 'failed', message=f"{message}，自动续训失败: {e}")
+
+
+def _resume_when_idle(store, interval=5):
+    """后台线程：逐个检查推迟的续训，所在任务没有排队 / 运行中的任务时再重建 TrainData 并入队。"""
+    while deferred_resumes:
+        time.sleep(interval)
+        active = scheduler.active_tasks()
+        for entry in list(deferred_resumes):
+            job, cache_dir = entry
+            if job['task_key'] in active:
+                continue
+            deferred_resumes.remove(entry)
+            _auto_resume(store, job, cache_dir)
+            active = scheduler.active_tasks()  # 刚入队的续训任务使该任务重新变为活动状态
+
+
+@train_bp.record_once
+def _init_scheduler(state):
+    """应用注册蓝图时按配置初始化调度槽位、恢复持久化的任务并启动调度线程。"""
+    global registry
+    config = state.app.config
+    scheduler.configure(slots=config.get('TRAIN_SLOTS'), mem_budget_mb=config.get('TRAIN_MEM_BUDGET_MB'))
+    job_db = config.get('JOB_DB_PATH') or os.path.join(state.app.instance_path, 'jobs.db')
+    store = JobStore(job_db)
+    scheduler.set_store(store)
+    registry = RunRegistry(job_db)
+    threading.Thread(target=registry.backfill, args=(config['DATA_DIR'],), daemon=True).start()
+    exporter.configure(workers=config.get('EXPORT_WORKERS'), threads_per_worker=config.get('EXPORT_THREADS'))
+    exporter.set_store(store)
+    exporter.recover()
+    warm_pool.configure(enabled=config.get('WARM_TRAINERS_ENABLED'), size=config.get('WARM_TRAINERS'),
+                        max_jobs=config.get('WARM_TRAINER_MAX_JOBS'),
+                        max_rss_growth_mb=config.get('WARM_TRAINER_MAX_RSS_GROWTH_MB'))
+    warm_pool.start()
+    monitor.configure(interval=config.get('RESOURCE_SAMPLE_INTERVAL'), history=config.get('RESOURCE_HISTORY'))
+    monitor.start(lambda: {sid: p.pid for sid, p in list(running_processes.items())})
+    reserve_mb = config.get('TRAIN_MIN_FREE_MEM_MB')
+    if reserve_mb:
+        scheduler.add_admission_check(lambda job: monitor.memory_admission(
+            job, [(j['stream_id'], j.get('mem_mb')) for j in scheduler.running_jobs()], reserve_mb=reserve_mb,
+            default_job_mb=config.get('TRAIN_DEFAULT_MEM_MB') or 0))
+    _recover_jobs(store, config)
+    scheduler.start()
 
 
 # ============ 路由定义 ============
@@ -247,25 +749,126 @@ def get_models():
 def check_status(owner, task_name):
     task_key = f"{owner}/{task_name}"
     # 检查是否有正在运行的 PID 或 队列中
-    current_stream_id = active_tasks_map.get(task_key)
+    current_stream_id = active_tasks_map().get(task_key)
 
     if current_stream_id:
         # 确认一下是否真的还在内存里 (防止意外重启后 active_tasks_map 不准)
         if current_stream_id in training_streams:
-            return jsonify({'status': 'running', 'stream_id': current_stream_id})
+            position = scheduler.position(current_stream_id)
+            return jsonify({'status': 'running', 'stream_id': current_stream_id,
+                            'state': 'queued' if position is not None else 'running',
+                            'queue_position': position})
 
     return jsonify({'status': 'idle'})
 
 
+# ---------- 调度队列管理 ----------
+
+def _can_manage_job(stream_id):
+    job = scheduler.get_job(stream_id)
+    if job is None:
+        return None, (jsonify({'status': 'error', 'message': '任务不存在或已结束'}), 404)
+    if not current_user.is_admin and job.get('user') != current_user.username:
+        return None, (jsonify({'status': 'error', 'message': 'Permission Denied'}), 403)
+    return job, None
+
+
+@train_bp.route('/api/train_queue')
+@login_required
+def train_queue():
+    """返回槽位、运行中和排队中的任务 (排队任务带 position，0 表示下一个启动)，以及预热进程池的状态。"""
+    snapshot = scheduler.snapshot()
+    snapshot['warm_trainers'] = warm_pool.stats()
+    return jsonify(snapshot)
+
+
+@train_bp.route('/api/train_queue/<stream_id>/move', methods=['POST'])
+@login_required
+def move_queued_job(stream_id):
+    """调整排队顺序：管理员可移动到队列的任意位置，普通用户只能在自己的排队任务之间调整先后 (position 为其中的位置)。"""
+    job, err = _can_manage_job(stream_id)
+    if err: return err
+    data = request.get_json(silent=True) or {}
+    try:
+        position = int(data.get('position', 0))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'position 必须是整数'}), 400
+    if not scheduler.move(stream_id, position, owner=None if current_user.is_admin else current_user.username):
+        return jsonify({'status': 'error', 'message': '只能调整排队中的任务'}), 400
+    return jsonify({'status': 'ok', 'queue_position': scheduler.position(stream_id)})
+
+
+@train_bp.route('/api/train_queue/<stream_id>/priority', methods=['POST'])
+@login_required
+def set_job_priority(stream_id):
+    # 优先级会影响所有用户的排队，只允许管理员修改
+    if not current_user.is_admin:
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        priority = int(data.get('priority', 0))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'priority 必须是整数'}), 400
+    if not scheduler.set_priority(stream_id, priority):
+        return jsonify({'status': 'error', 'message': '只能调整排队中的任务'}), 400
+    return jsonify({'status': 'ok', 'queue_position': scheduler.position(stream_id)})
+
+
 # 【新增】手动停止训练接口
 @train_bp.route('/api/stop_train/<stream_id>', methods=['POST'])
 @login_required
 def stop_train(stream_id):
-    # 稍微做点权限校验，实际场景建议校验 stream_id 是否属于当前用户
+    # 队列由所有用户共享：只有任务的提交者和管理员可以取消 / 停止
+    job, err = _can_manage_job(stream_id)
+    if err: return err
     kill_task(stream_id)
     return jsonify({'status': 'ok', 'message': '正在发送停止信号...'})
 
 
+def _write_split_manifest(run_path, split):
+    """记录本次训练使用的数据划分，断点续训时据此还原 TrainData。"""
+    if not split:
+        return
+    os.makedirs(run_path, exist_ok=True)
+    with open(os.path.join(run_path, 'split.json'), 'w', encoding='utf-8') as f:
+        json.dump(split, f, ensure_ascii=False)
+
+
+def _enqueue_train_job(task_path, task_key, params, yaml_path, prep_message, priority=0, mem_mb=0, split=None,
+                       **extra):
+    """创建日志流并把一个训练任务提交给调度器 (普通训练和超参搜索的子任务共用)。"""
+    stream_id = str(uuid.uuid4())
+    runs_dir = os.path.join(task_path, 'runs')
+    os.makedirs(runs_dir, exist_ok=True)
+    base_name = f"train_{int(time.time())}_{stream_id[:8]}"
+    model_path = os.path.join(current_app.config['MODELS_FOLDER'], params['model'])
+
+    _write_split_manifest(os.path.join(runs_dir, base_name), split)
+    _open_stream(stream_id, os.path.join(runs_dir, base_name))
+    training_streams[stream_id].append(prep_message)
+    training_streams[stream_id].append(f"__QUEUED__")
+    training_streams[stream_id].append("任务已加入队列，后台准备中...")
+
+    job = {
+        'stream_id': stream_id,
+        'kind': 'train',
+        'task_key': task_key,
+        'user': current_user.username,
+        # 普通用户不能插队，只有管理员可以提交高优先级任务
+        'priority': priority,
+        'mem_mb': mem_mb,
+        'device': params['device'],
+        'params': params,
+        'model_path': model_path,
+        'yaml_path': yaml_path,
+        'runs_dir': runs_dir,
+        'base_name': base_name,
+        'export_params': {'formats': parse_formats(params['export_format']), 'opset': params['export_opset']},
+    }
+    job.update(extra)
+    return scheduler.submit(job)
+
+
 @train_bp.route('/api/start_train/<owner>/<task_name>', methods=['POST'])
 @login_required
 def start_train(owner, task_name):
@@ -274,7 +877,7 @@ def start_train(owner, task_name):
 
     # 检查是否已有任务在运行
     task_key = f"{owner}/{task_name}"
-    if task_key in active_tasks_map:
+    if task_key in active_tasks_map():
         return jsonify({'status': 'error', 'message': '该任务已在后台运行中，请刷新页面查看进度'}), 400
 
     try:
@@ -295,82 +898,223 @@ def start_train(owner, task_name):
             'device': request.form.get('device', '0'),
             'train_ratio': float(request.form.get('train_ratio', 0.8)),
             'export_format': request.form.get('export_format', 'onnx'),
-            'export_opset': int(request.form.get('export_opset', 17))
+            'export_opset': int(request.form.get('export_opset', 17)),
+            # 可选：按 imgsz 预缩放图片并使用共享缓存，大图训练时可显著降低 dataloader 的解码开销
+            'resize_cache': request.form.get('resize_cache', 'false').lower() in ('1', 'true', 'on')
         }
-
-        prep = prepare_dataset_for_training(task_path, params['train_ratio'])
+        try:
+            # 导出格式可填多个，用逗号分隔，例如 "onnx,openvino"
+            parse_formats(params['export_format'])
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        cache_dir = current_app.config.get('IMAGE_CACHE_DIR') if params['resize_cache'] else None
+        prep = prepare_dataset_for_training(task_path, params['train_ratio'], imgsz=params['imgsz'],
+                                            cache_dir=cache_dir)
         if not prep['success']: return jsonify({'status': 'error', 'message': prep['message']}), 500
 
-        stream_id = str(uuid.uuid4())
-        runs_dir = os.path.join(task_path, 'runs')
-        os.makedirs(runs_dir, exist_ok=True)
-        base_name = f"train_{int(time.time())}_{stream_id[:8]}"
-        model_path = os.path.join(current_app.config['MODELS_FOLDER'], params['model'])
+        priority = int(request.form.get('priority', 0)) if current_user.is_admin else 0
+        job = _enqueue_train_job(task_path, task_key, params, prep['yaml_path'], prep['message'],
+                                 priority=priority, mem_mb=int(request.form.get('mem_mb', 0)), split=prep['split'])
 
-        safe_model_path = model_path.replace('\\', '/')
-        safe_yaml_path = prep['yaml_path'].replace('\\', '/')
-        safe_runs_dir = runs_dir.replace('\\', '/')
+        return jsonify({'status': 'ok', 'message': 'Started', 'stream_id': job['stream_id'],
+                        'queue_position': scheduler.position(job['stream_id'])})
 
-        # 构造训练脚本 (加入 stdout flush 保证日志实时)
-        train_script = f"""
-from ultralytics import YOLO
-import sys
-import signal
+    except Exception as e:
+        import traceback
+        return jsonify({'status': 'error', 'message': traceback.format_exc()}), 500
 
-# 简单的信号处理，防止 Python 内部忽略信号
-def signal_handler(sig, frame):
-    print("Python script received signal, exiting...")
-    sys.exit(0)
-signal.signal(signal.SIGTERM, signal_handler)
 
-if __name__ == '__main__':
+@train_bp.route('/api/resume_train/<owner>/<task_name>/<run_name>', methods=['POST'])
+@login_required
+def resume_train(owner, task_name, run_name):
+    """从某次运行的 weights/last.pt 断点续训 (沿用原来的数据划分和训练参数，日志续写到同一运行目录)。"""
+    if not check_perm(owner, task_name):
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+    if not re.fullmatch(r'[\w.-]+', run_name):
+        return jsonify({'status': 'error', 'message': '非法的运行名称'}), 400
+
+    task_key = f"{owner}/{task_name}"
+    if task_key in active_tasks_map():
+        return jsonify({'status': 'error', 'message': '该任务已在后台运行中，请刷新页面查看进度'}), 400
+
+    old_job = scheduler.store.find_run(task_key, run_name) if scheduler.store else None
+    if old_job is None:
+        return jsonify({'status': 'error', 'message': '没有找到该运行的任务记录，无法续训'}), 404
+    if _attached_run_succeeded(old_job, os.path.join(old_job['runs_dir'], run_name)):
+        return jsonify({'status': 'error', 'message': '该运行已跑完全部 epoch，无需续训'}), 400
+
     try:
-        print("Initializing model...")
-        model = YOLO(r'{safe_model_path}')
-        print("Starting training loop...")
+        job = _enqueue_resume_job(old_job, current_user.username, current_app.config.get('IMAGE_CACHE_DIR'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
 
-        # 训练
-        model.train(
-            data=r'{safe_yaml_path}',
-            epochs={params["epochs"]},
-            imgsz={params["imgsz"]},
-            batch={params["batch"]},
-            device='{params["device"]}',
-            project=r'{safe_runs_dir}',
-            name='{base_name}'
-        )
-    except Exception as e:
-        print(f"Training Error: {{e}}")
-        sys.exit(1)
-"""
-        cmd = [sys.executable, '-u', '-c', train_script]
-        env = os.environ.copy()
-        env["PYTHONUTF8"] = "1"
-
-        training_streams[stream_id] = []
-        training_streams[stream_id].append(prep['message'])
-        training_streams[stream_id].append(f"__QUEUED__")
-        training_streams[stream_id].append("任务已加入队列，后台准备中...")
-
-        # 注册活跃任务
-        active_tasks_map[task_key] = stream_id
-
-        task_data = {
-            'stream_id': stream_id,
-            'task_key': task_key,
-            'cmd': cmd,
-            'runs_dir': runs_dir,
-            'base_name': base_name,
-            'export_params': {'format': params['export_format'], 'opset': params['export_opset']},
-            'env': env
+    return jsonify({'status': 'ok', 'message': 'Resumed', 'stream_id': job['stream_id'],
+                    'queue_position': scheduler.position(job['stream_id'])})
+
+
+# ---------- 超参搜索 (sweep) ----------
+
+# 训练基础参数的取值范围 (超参搜索空间中的值同样要经过校验，它们会被写入生成的训练脚本)
+_TRAIN_INT_RANGES = {'epochs': (1, 10000), 'imgsz': (32, 8192), 'batch': (-1, 1024)}
+
+
+def _validate_train_params(params):
+    """把 epochs / imgsz / batch 转为范围内的整数，并确认 model 是 MODELS_FOLDER 下已有的文件。返回错误信息或 None。"""
+    for key, (low, high) in _TRAIN_INT_RANGES.items():
+        value = params.get(key)
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            return f"参数 {key} 必须是整数"
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            return f"参数 {key} 必须是整数"
+        if number != float(value):
+            return f"参数 {key} 必须是整数"
+        if not low <= number <= high or (key == 'batch' and number == 0):
+            return f"参数 {key} 超出范围 ({low} ~ {high})"
+        params[key] = number
+    model = params.get('model')
+    if not isinstance(model, str) or not model or os.path.basename(model) != model \
+            or not os.path.isfile(os.path.join(current_app.config['MODELS_FOLDER'], model)):
+        return f"模型不存在: {model}"
+    return None
+
+
+@train_bp.route('/api/start_sweep/<owner>/<task_name>', methods=['POST'])
+@login_required
+def start_sweep(owner, task_name):
+    """
+    超参搜索：数据集只划分一次，按网格或随机采样生成多个子训练任务，共享同一份划分。
+    JSON 参数:
+      model / epochs / imgsz / batch / device / train_ratio / export_format / export_opset / resize_cache: 基础参数
+      space: 搜索空间，例如 {"lr0": {"min": 1e-4, "max": 1e-2, "log": true}, "imgsz": [480, 640]}
+      search: "grid" | "random"；n_trials: 试验数量；seed: 随机种子
+      metric: 比较用的指标 (默认 map50_95)；halving: {"min_epochs": 5, "eta": 3}，为 null 时不早停
+    """
+    if not check_perm(owner, task_name):
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+
+    task_key = f"{owner}/{task_name}"
+    if task_key in active_tasks_map():
+        return jsonify({'status': 'error', 'message': '该任务已在后台运行中，请刷新页面查看进度'}), 400
+
+    data = request.get_json(silent=True) or {}
+    task_path = os.path.join(current_app.config['DATA_DIR'], owner, task_name)
+    if not os.path.isdir(task_path): return jsonify({'status': 'error', 'message': '项目不存在'}), 404
+    if not data.get('model') and 'model' not in data.get('space', {}):
+        return jsonify({'status': 'error', 'message': '未选择模型 (Model is required)'}), 400
+
+    try:
+        trials = expand_trials(data.get('space', {}), data.get('search', 'grid'), data.get('n_trials'),
+                               data.get('seed'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    if not trials:
+        return jsonify({'status': 'error', 'message': '搜索空间为空'}), 400
+
+    try:
+        base = {
+            'model': data.get('model'),
+            'epochs': data.get('epochs', 50),
+            'imgsz': data.get('imgsz', 640),
+            'batch': data.get('batch', 16),
+            'device': str(data.get('device', '0')),
+            'train_ratio': float(data.get('train_ratio', 0.8)),
+            'export_format': data.get('export_format', 'onnx'),
+            'export_opset': int(data.get('export_opset', 17)),
+            'resize_cache': bool(data.get('resize_cache', False)),
         }
-        task_queue.put(task_data)
+        parse_formats(base['export_format'])
+    except (TypeError, ValueError) as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    # 每个试验的参数在写入训练脚本前都要校验 (搜索空间中的值来自请求)
+    trial_params = []
+    for trial in trials:
+        params = dict(base)
+        params.update({k: v for k, v in trial.items() if k in TRAIN_BASE_ARGS})
+        error = _validate_train_params(params)
+        if error:
+            return jsonify({'status': 'error', 'message': f"试验 {trial}: {error}"}), 400
+        params['extra_args'] = {k: v for k, v in trial.items() if k in TRAIN_EXTRA_ARGS}
+        trial_params.append(params)
+
+    # 数据集只准备一次；预缩放按所有试验中最大的 imgsz 进行，保证每个试验都不会被放大
+    max_imgsz = max(params['imgsz'] for params in trial_params)
+    cache_dir = current_app.config.get('IMAGE_CACHE_DIR') if base['resize_cache'] else None
+    prep = prepare_dataset_for_training(task_path, base['train_ratio'], imgsz=max_imgsz, cache_dir=cache_dir)
+    if not prep['success']: return jsonify({'status': 'error', 'message': prep['message']}), 500
+
+    sweep_id = f"sweep_{uuid.uuid4().hex[:8]}"
+    config = {'space': data.get('space', {}), 'search': data.get('search', 'grid'), 'base': base,
+              'metric': data.get('metric', 'map50_95'), 'mode': data.get('mode', 'max'),
+              'halving': data.get('halving', {'min_epochs': 5, 'eta': 3})}
+    if scheduler.store:
+        scheduler.store.save_sweep(sweep_id, task_key, current_user.username, config)
+    if config['halving']:
+        sweep_policies[sweep_id] = HalvingPolicy(config['metric'], config['halving'].get('min_epochs', 5),
+                                                 config['halving'].get('eta', 3), config['mode'])
+
+    stream_ids = []
+    for i, (trial, params) in enumerate(zip(trials, trial_params)):
+        message = f"{prep['message']}\n[超参搜索 {sweep_id}] 试验 {i + 1}/{len(trials)}: {trial}"
+        job = _enqueue_train_job(task_path, task_key, params, prep['yaml_path'], message,
+                                 priority=int(data.get('priority', 0)) if current_user.is_admin else 0,
+                                 mem_mb=int(data.get('mem_mb', 0)), split=prep['split'], sweep_id=sweep_id, trial=i,
+                                 trial_params=trial)
+        stream_ids.append(job['stream_id'])
+
+    return jsonify({'status': 'ok', 'sweep_id': sweep_id, 'stream_ids': stream_ids, 'trials': trials})
+
+
+def _sweep_table(sweep, metric):
+    """汇总超参搜索各试验的结果，按指标排序 (没有结果的试验排在最后)。"""
+    rows = []
+    mode = sweep['config'].get('mode', 'max')
+    # 续训过的试验有多条任务记录 (同一运行目录)，只保留最新的一条
+    children = {c['base_name']: c for c in scheduler.store.jobs_for_sweep(sweep['sweep_id'])}
+    for child in children.values():
+        results = read_results(os.path.join(child['runs_dir'], child['base_name']))
+        values = [(e.get(metric), e['epoch']) for e in results['epochs'] if e.get(metric) is not None]
+        best = (max(values) if mode == 'max' else min(values)) if values else (None, None)
+        rows.append({
+            'stream_id': child['stream_id'], 'run_name': child['base_name'], 'trial': child.get('trial'),
+            'params': child.get('trial_params'), 'state': child['state'], 'last_epoch': results['last_epoch'],
+            'best_epoch': best[1], metric: best[0],
+        })
+    sign = -1 if mode == 'max' else 1
+    rows.sort(key=lambda r: (r[metric] is None, sign * (r[metric] or 0)))
+    return rows
+
+
+@train_bp.route('/api/sweep/<sweep_id>')
+@login_required
+def sweep_results(sweep_id):
+    """超参搜索的对比表，?metric= 可切换排序指标 (默认使用创建时指定的指标)。"""
+    sweep = scheduler.store.get_sweep(sweep_id) if scheduler.store else None
+    if sweep is None: return jsonify({'error': 'Not found'}), 404
+    owner, task_name = sweep['task_key'].split('/', 1)
+    if not check_perm(owner, task_name): return jsonify({'error': 'Permission Denied'}), 403
+    metric = request.args.get('metric') or sweep['config'].get('metric', 'map50_95')
+    return jsonify({'sweep_id': sweep_id, 'metric': metric, 'config': sweep['config'],
+                    'trials': _sweep_table(sweep, metric)})
+
+
+@train_bp.route('/api/sweeps/<owner>/<task_name>')
+@login_required
+def list_sweeps(owner, task_name):
+    if not check_perm(owner, task_name): return jsonify([])
+    if not scheduler.store: return jsonify([])
+    return jsonify([{'sweep_id': sw['sweep_id'], 'user': sw['user'], 'created_at': sw['created_at'],
+                     'metric': sw['config'].get('metric'), 'search': sw['config'].get('search')}
+                    for sw in scheduler.store.list_sweeps(f"{owner}/{task_name}")])
 
-        return jsonify({'status': 'ok', 'message': 'Started', 'stream_id': stream_id})
 
-    except Exception as e:
-        import traceback
-        return jsonify({'status': 'error', 'message': traceback.format_exc()}), 500
+def _sse_event(seq, line):
+    # 多行内容 (例如导出输出) 需要拆成多个 data: 字段，否则浏览器只会收到第一行
+    data = "\n".join(f"data: {part}" for part in str(line).split("\n"))
+    return f"id: {seq}\n{data}\n\n"
 
 
 @train_bp.route('/stream/<stream_id>')
@@ -379,31 +1123,51 @@ def stream(stream_id):
     """
     SSE 推送日志。
     【核心修复】: 去除了 GeneratorExit 时杀死进程的逻辑。
+    每条消息带 id (日志序号)，浏览器断线重连时会带上 Last-Event-ID，从断点继续推送，不丢不重。
     """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    # ?resources=1 时穿插推送资源采样 (event: resources，不带 id，不影响断点续传)
+    with_resources = request.args.get('resources') in ('1', 'true') and monitor.available
+    try:
+        last_seq = int(last_event_id)
+    except ValueError:
+        last_seq = 0
 
     def event_stream():
+        nonlocal last_seq
         if stream_id not in training_streams:
             yield "data: __ERROR__:日志流不存在或已过期\n\n"
-            yield "data: __END_OF_STREAM__\n\n"
+            yield f"data: {END_MARKER}\n\n"
             return
 
-        last = 0
+        buffer = training_streams[stream_id]
+        last_resource_ts = 0
         try:
             while True:
                 # 即使任务完成，也保留一段时间日志以便查看
                 if stream_id not in training_streams:
                     break
 
-                current_len = len(training_streams[stream_id])
-                if last < current_len:
-                    for i in range(last, current_len):
-                        line = training_streams[stream_id][i]
-                        yield f"data: {line}\n\n"
-                        if "__END_OF_STREAM__" in line:
-                            return
-                    last = current_len
-
-                time.sleep(1.0)  # 稍微增加间隔，减轻服务器压力
+                if with_resources:
+                    sample = monitor.latest(stream_id)
+                    if sample and sample['ts'] > last_resource_ts:
+                        last_resource_ts = sample['ts']
+                        yield f"event: resources\ndata: {json.dumps(sample)}\n\n"
+                entries, dropped = buffer.read_since(last_seq, timeout=monitor.interval if with_resources else 15.0)
+                if dropped:
+                    yield f"data: ...(已省略 {dropped} 行较早的日志)\n\n"
+                if not entries:
+                    if buffer.closed:
+                        return
+                    if not with_resources:
+                        # 空闲时发送注释行保活，防止代理断开长连接
+                        yield ": keepalive\n\n"
+                    continue
+                for seq, line in entries:
+                    yield _sse_event(seq, line)
+                    last_seq = seq
+                    if END_MARKER in line:
+                        return
 
         except GeneratorExit:
             # 【修复点】 客户端断开连接（关闭页面/刷新）
@@ -415,26 +1179,375 @@ def stream(stream_id):
             print(f"Stream Error: {e}")
             yield f"data: __ERROR__:{str(e)}\n\n"
 
-    return Response(event_stream(), mimetype='text/event-stream')
+    return Response(event_stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@train_bp.route('/api/train_resources/<stream_id>')
+@login_required
+def train_resources(stream_id):
+    """任务进程树的资源时间序列 (?since=<ts> 只取增量) 以及峰值。"""
+    job = scheduler.get_job(stream_id) or (scheduler.store.get(stream_id) if scheduler.store else None)
+    if job is None:
+        return jsonify({'error': 'Not found'}), 404
+    if not check_perm(*job['task_key'].split('/', 1)):
+        return jsonify({'error': 'Permission Denied'}), 403
+    since = request.args.get('since', type=float)
+    return jsonify({'samples': monitor.history(stream_id, since), 'peak_rss_mb': monitor.peak(stream_id),
+                    'peak_cpu_percent': monitor.peak(stream_id, 'cpu_percent'), 'interval': monitor.interval})
+
+
+@train_bp.route('/api/system_resources')
+@login_required
+def system_resources():
+    """整机内存 / CPU 以及每个运行中任务的最新采样。"""
+    jobs = {}
+    for job in scheduler.running_jobs():
+        if check_perm(*job['task_key'].split('/', 1)):
+            jobs[job['stream_id']] = {'task_key': job['task_key'], 'mem_mb': job.get('mem_mb'),
+                                      'latest': monitor.latest(job['stream_id'])}
+    return jsonify({'available': monitor.available, 'system': monitor.system(), 'jobs': jobs})
 
 
 # List runs 和 Download 路由保持不变...
+def _run_query_args():
+    """
+    list_runs / search_runs 共用的查询参数：sort / order / state / model / min_<指标> / limit / offset。
+    返回 (参数, 错误响应)，数值参数无法解析时错误响应为 400。
+    """
+    try:
+        min_metric = {k[4:]: float(v) for k, v in request.args.items() if k.startswith('min_') and k[4:] in SORT_COLUMNS}
+        limit = int(request.args.get('limit', 200))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return None, (jsonify({'status': 'error', 'message': 'limit / offset / min_<指标> 参数必须是数字'}), 400)
+    return {
+        'state': request.args.get('state'),
+        'base_model': request.args.get('model'),
+        'min_metric': min_metric,
+        'sort': request.args.get('sort', 'created_at'),
+        'order': request.args.get('order', 'desc'),
+        'limit': max(0, min(limit, 1000)),
+        'offset': max(0, offset),
+    }, None
+
+
+def _run_summary(run):
+    run['name'] = run['run_name']
+    run['mtime'] = int(run['created_at'] or 0)
+    return run
+
+
 @train_bp.route('/api/list_runs/<owner>/<task_name>')
 @login_required
 def list_runs(owner, task_name):
-    # (同你之前的代码)
+    """
+    任务的运行列表 (来自运行注册表)，附带最佳指标、权重信息和导出产物，支持按指标过滤 / 排序。
+    注册表里还没有该任务的记录时 (启动时的后台补登记尚未扫到) 先同步补登记这个任务的 runs 目录。
+    """
     if not check_perm(owner, task_name): return jsonify([])
+    if registry is None: return jsonify([])
+    args, err = _run_query_args()
+    if err: return err
+    task_key = f"{owner}/{task_name}"
+    if not registry.has_task(task_key):
+        registry.backfill_task(task_key, os.path.join(current_app.config['DATA_DIR'], owner, task_name, 'runs'))
+    return jsonify([_run_summary(r) for r in registry.query(task_keys=[task_key], **args)])
+
+
+@train_bp.route('/api/runs/search')
+@login_required
+def search_runs():
+    """跨任务检索当前用户可访问的运行，例如 ?sort=map50_95&min_map50_95=0.5&model=yolov8n.pt"""
+    if registry is None: return jsonify([])
+    args, err = _run_query_args()
+    if err: return err
+    task_keys = None if current_user.is_admin else \
+        [k for k in registry.task_keys() if check_perm(*k.split('/', 1))]
+    return jsonify([_run_summary(r) for r in registry.query(task_keys=task_keys, **args)])
+
+
+@train_bp.route('/api/runs/compare')
+@login_required
+def compare_runs():
+    """
+    跨任务对比多个运行：?ids=owner/task/run_a,owner2/task2/run_b
+    只读注册表，不访问文件系统；无权访问或不存在的运行被忽略。
+    """
+    if registry is None: return jsonify({'runs': [], 'metrics': []})
+    run_ids = [i for i in request.args.get('ids', '').split(',') if i.count('/') == 2]
+    runs = [r for r in registry.get_many(run_ids) if check_perm(*r['task_key'].split('/', 1))]
+    metric_keys = sorted({k for r in runs for k, v in r['metrics'].items() if isinstance(v, (int, float))})
+    return jsonify({'runs': [_run_summary(r) for r in runs], 'metrics': metric_keys})
+
+
+@train_bp.route('/api/train_metrics/<stream_id>')
+@login_required
+def train_metrics(stream_id):
+    """
+    运行中任务的结构化指标 (由 results.csv 和 stdout 解析)。
+    ?since_epoch=N 只返回 epoch > N 的记录，前端轮询时只拉增量。
+    """
+    job = scheduler.get_job(stream_id) or (scheduler.store.get(stream_id) if scheduler.store else None)
+    if job is None:
+        return jsonify({'error': 'Not found'}), 404
+    if not check_perm(*job['task_key'].split('/', 1)):
+        return jsonify({'error': 'Permission Denied'}), 403
+    collector = training_metrics.get(stream_id)
+    if collector is None:
+        return jsonify({'epochs': [], 'progress': {}, 'last_epoch': None})
+    since_epoch = request.args.get('since_epoch', type=int)
+    collector.poll()
+    return jsonify(collector.snapshot(since_epoch))
+
+
+@train_bp.route('/api/run_metrics/<owner>/<task_name>/<run_name>')
+@login_required
+def run_metrics(owner, task_name, run_name):
+    """已结束训练的逐 epoch 指标，参数同 /api/train_metrics。"""
+    if not check_perm(owner, task_name): return jsonify({'error': 'Permission Denied'}), 403
+    if not re.match(r'^[\w\-\.]+$', run_name): return jsonify({'error': 'Invalid Name'}), 400
+    run_path = os.path.join(current_app.config['DATA_DIR'], owner, task_name, 'runs', run_name)
+    if not os.path.isdir(run_path): return jsonify({'error': 'Not found'}), 404
+    return jsonify(read_results(run_path, request.args.get('since_epoch', type=int)))
+
+
+@train_bp.route('/api/train_log/<owner>/<task_name>/<run_name>')
+@login_required
+def train_log(owner, task_name, run_name):
+    """
+    读取某次训练的完整日志 (磁盘持久化，任务结束或服务重启后依然可查)。
+    参数: ?tail=N 读取最后 N 行；或 ?start=&end= 读取 [start, end) 行 (行号从 0 开始)。单次最多 5000 行。
+    """
+    if not check_perm(owner, task_name): return jsonify({'error': 'Permission Denied'}), 403
+    if not re.match(r'^[\w\-\.]+$', run_name): return jsonify({'error': 'Invalid Name'}), 400
     DATA_DIR = current_app.config['DATA_DIR']
-    base = os.path.join(DATA_DIR, owner, task_name, 'runs')
-    runs = []
-    if os.path.isdir(base):
-        for d in os.listdir(base):
-            try:
-                runs.append({'name': d, 'mtime': int(os.path.getmtime(os.path.join(base, d)))})
-            except:
-                pass
-    runs.sort(key=lambda x: x['mtime'], reverse=True)
-    return jsonify(runs)
+    log_dir = os.path.join(DATA_DIR, owner, task_name, 'runs', run_name, 'logs')
+    segments = read_log_index(log_dir)
+    if not segments: return jsonify({'error': '该训练没有日志记录'}), 404
+
+    # 进行中的任务，最后一个分段的行数以文件实际内容为准
+    last = segments[-1]
+    if not last['compressed']:
+        with open(os.path.join(log_dir, last['file']), 'r', encoding='utf-8', errors='replace') as f:
+            last['count'] = sum(1 for _ in f)
+    total = last['first'] + last['count']
+
+    bounds = {name: request.args.get(name, type=int) for name in ('start', 'end', 'tail')}
+    invalid = [name for name, value in bounds.items() if value is None and request.args.get(name) is not None]
+    if invalid: return jsonify({'error': f"参数 {', '.join(invalid)} 必须是整数"}), 400
+
+    max_lines = 5000
+    if bounds['start'] is not None:
+        start = max(0, bounds['start'])
+        end = min(total, bounds['end'] if bounds['end'] is not None else start + 1000, start + max_lines)
+    else:
+        tail = max(0, min(bounds['tail'] if bounds['tail'] is not None else 200, max_lines))
+        start, end = max(0, total - tail), total
+
+    lines = read_segments(log_dir, segments, start, end) if end > start else []
+    return jsonify({'total': total, 'start': start, 'end': start + len(lines), 'lines': lines})
+
+
+@train_bp.route('/api/preannotate/<owner>/<task_name>/<run_name>', methods=['POST'])
+@login_required
+def preannotate(owner, task_name, run_name):
+    """
+    用某次运行的模型批量预标注任务中的图片 (后台任务，进度通过 /stream/<stream_id> 推送)。
+    JSON 参数: conf / iou / imgsz / batch / workers / overwrite (覆盖已有标注，默认 false) /
+              ann_type (rect / polygon / obb，默认按模型类型) / prefer_onnx (默认 true) / images (只处理指定图片)
+    """
+    if not check_perm(owner, task_name):
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+    if not re.match(r'^[\w\-\.]+$', run_name): return jsonify({'status': 'error', 'message': 'Invalid Name'}), 400
+
+    task_key = f"{owner}/{task_name}"
+    if task_key in active_tasks_map():
+        return jsonify({'status': 'error', 'message': '该任务已有后台任务在运行中'}), 400
+    task_path = os.path.join(current_app.config['DATA_DIR'], owner, task_name)
+    best_pt = find_best_weights(os.path.join(task_path, 'runs', run_name))
+    if not best_pt:
+        return jsonify({'status': 'error', 'message': '该运行没有可用的权重文件'}), 404
+    if not os.path.exists(os.path.join(task_path, 'labels.json')):
+        return jsonify({'status': 'error', 'message': '任务缺少 labels.json'}), 400
+
+    data = request.get_json(silent=True) or {}
+    try:
+        conf, iou = float(data.get('conf', 0.25)), float(data.get('iou', 0.7))
+        imgsz, batch = int(data.get('imgsz', 640)), int(data.get('batch', 8))
+        workers = int(data['workers']) if data.get('workers') is not None else None
+        mem_mb = int(data.get('mem_mb', 0))
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'conf / iou 必须是数字，imgsz / batch / workers / mem_mb 必须是整数'}), 400
+    if not (0 <= conf <= 1 and 0 <= iou <= 1) or imgsz < 32 or batch < 1 or (workers is not None and workers < 1) \
+            or mem_mb < 0:
+        return jsonify({'status': 'error', 'message': '参数超出范围 (conf / iou 为 0~1，imgsz >= 32，batch / workers >= 1)'}), 400
+    spec = {
+        'task_path': task_path,
+        'weights': best_pt,
+        'prefer_onnx': bool(data.get('prefer_onnx', True)),
+        'conf': conf,
+        'iou': iou,
+        'imgsz': imgsz,
+        'batch': batch,
+        'workers': workers,
+        'overwrite': bool(data.get('overwrite', False)),
+        'ann_type': data.get('ann_type'),
+        'images': data.get('images'),
+    }
+    if spec['ann_type'] not in (None, 'rect', 'polygon', 'obb'):
+        return jsonify({'status': 'error', 'message': '不支持的标注类型'}), 400
+
+    stream_id = str(uuid.uuid4())
+    runs_dir = os.path.join(task_path, 'infer_jobs')
+    base_name = f"infer_{int(time.time())}_{stream_id[:8]}"
+    _open_stream(stream_id, os.path.join(runs_dir, base_name))
+    _push(stream_id, "__QUEUED__")
+    _push(stream_id, f"预标注任务已加入队列 (模型 {run_name})...")
+    job = scheduler.submit({
+        'stream_id': stream_id, 'kind': 'infer', 'task_key': task_key, 'user': current_user.username,
+        'device': 'cpu', 'mem_mb': mem_mb, 'runs_dir': runs_dir, 'base_name': base_name,
+        'run_name': run_name, 'spec': spec,
+    })
+    return jsonify({'status': 'ok', 'stream_id': stream_id, 'queue_position': scheduler.position(job['stream_id'])})
+
+
+@train_bp.route('/api/simplify_labels/<owner>/<task_name>', methods=['POST'])
+@login_required
+def simplify_labels(owner, task_name):
+    """
+    批量简化任务中已保存的多边形标注 (后台任务，进度通过 /stream/<stream_id> 推送)。
+    JSON 参数: tolerance (像素容差，默认 1.0) / max_vertices (每个多边形的顶点上限，默认不限制)
+    """
+    if not check_perm(owner, task_name):
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+    task_key = f"{owner}/{task_name}"
+    if task_key in active_tasks_map():
+        return jsonify({'status': 'error', 'message': '该任务已有后台任务在运行中'}), 400
+    task_path = os.path.join(current_app.config['DATA_DIR'], owner, task_name)
+    if not os.path.isdir(task_path):
+        return jsonify({'status': 'error', 'message': '任务不存在'}), 404
+
+    data = request.get_json(silent=True) or {}
+    max_vertices = data.get('max_vertices')
+    spec = {'task_path': task_path, 'tolerance': float(data.get('tolerance', 1.0)),
+            'max_vertices': int(max_vertices) if max_vertices else None}
+    stream_id = str(uuid.uuid4())
+    runs_dir = os.path.join(task_path, 'infer_jobs')
+    base_name = f"simplify_{int(time.time())}_{stream_id[:8]}"
+    _open_stream(stream_id, os.path.join(runs_dir, base_name))
+    _push(stream_id, "__QUEUED__")
+    _push(stream_id, "多边形简化任务已加入队列...")
+    job = scheduler.submit({
+        'stream_id': stream_id, 'kind': 'simplify', 'task_key': task_key, 'user': current_user.username,
+        'device': 'cpu', 'mem_mb': 0, 'runs_dir': runs_dir, 'base_name': base_name, 'spec': spec,
+    })
+    return jsonify({'status': 'ok', 'stream_id': stream_id, 'queue_position': scheduler.position(job['stream_id'])})
+
+
+@train_bp.route('/api/evaluate/<owner>/<task_name>/<run_name>', methods=['POST'])
+@login_required
+def evaluate_run(owner, task_name, run_name):
+    """
+    用某次运行的模型评估任意任务的当前标注 (默认为本任务)，后台任务，进度通过 /stream/<stream_id> 推送，
+    结果通过 /api/evaluation/<stream_id> 获取。预测按权重和图片内容缓存，修改标注后重新评估只需重新打分。
+    JSON 参数: target_owner / target_task (被评估的任务) / imgsz / iou (NMS) / batch / workers / prefer_onnx /
+              matrix_conf / matrix_iou (混淆矩阵的置信度和 IoU 阈值)
+    """
+    data = request.get_json(silent=True) or {}
+    target_owner = data.get('target_owner') or owner
+    target_task = data.get('target_task') or task_name
+    if not check_perm(owner, task_name) or not check_perm(target_owner, target_task):
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+    if not re.match(r'^[\w\-\.]+$', run_name): return jsonify({'status': 'error', 'message': 'Invalid Name'}), 400
+
+    data_dir = current_app.config['DATA_DIR']
+    best_pt = find_best_weights(os.path.join(data_dir, owner, task_name, 'runs', run_name))
+    if not best_pt:
+        return jsonify({'status': 'error', 'message': '该运行没有可用的权重文件'}), 404
+    target_path = os.path.join(data_dir, target_owner, target_task)
+    if not os.path.exists(os.path.join(target_path, 'labels.json')):
+        return jsonify({'status': 'error', 'message': '被评估的任务缺少 labels.json'}), 400
+
+    stream_id = str(uuid.uuid4())
+    runs_dir = os.path.join(target_path, 'eval_jobs')
+    base_name = f"eval_{int(time.time())}_{stream_id[:8]}"
+    spec = {
+        'task_path': target_path,
+        'weights': best_pt,
+        'cache_dir': current_app.config['EVAL_CACHE_DIR'],
+        'report_path': os.path.join(runs_dir, base_name, 'report.json'),
+        'prefer_onnx': bool(data.get('prefer_onnx', True)),
+        'imgsz': int(data.get('imgsz', 640)),
+        'iou': float(data.get('iou', 0.7)),
+        'batch': int(data.get('batch', 8)),
+        'workers': data.get('workers'),
+        'matrix_conf': float(data.get('matrix_conf', 0.25)),
+        'matrix_iou': float(data.get('matrix_iou', 0.45)),
+    }
+    _open_stream(stream_id, os.path.join(runs_dir, base_name))
+    _push(stream_id, "__QUEUED__")
+    _push(stream_id, f"评估任务已加入队列 (模型 {owner}/{task_name}/{run_name})...")
+    job = scheduler.submit({
+        'stream_id': stream_id, 'kind': 'eval', 'task_key': f"{target_owner}/{target_task}",
+        'user': current_user.username, 'device': 'cpu', 'mem_mb': int(data.get('mem_mb', 0)), 'runs_dir': runs_dir,
+        'base_name': base_name, 'run_name': run_name, 'model_task_key': f"{owner}/{task_name}", 'spec': spec,
+    })
+    return jsonify({'status': 'ok', 'stream_id': stream_id, 'queue_position': scheduler.position(job['stream_id'])})
+
+
+@train_bp.route('/api/evaluation/<stream_id>')
+@login_required
+def evaluation_report(stream_id):
+    """评估结果：总体 P / R / mAP、每类指标和 PR 曲线 (IoU=0.5)、混淆矩阵。"""
+    job = scheduler.store.get(stream_id) if scheduler.store else None
+    if not job or job.get('kind') != 'eval':
+        return jsonify({'status': 'error', 'message': '评估任务不存在'}), 404
+    # 报告同时包含被评估任务的数据和模型所在运行的指标：两个任务都需要有权限 (与 evaluate_run 提交时一致)
+    if not check_perm(*job['task_key'].split('/', 1)) or not check_perm(*job['model_task_key'].split('/', 1)):
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+    report_path = job['spec']['report_path']
+    if not os.path.exists(report_path):
+        return jsonify({'status': 'pending', 'state': job['state']})
+    with open(report_path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    return jsonify({'status': 'ok', 'state': job['state'], 'model': f"{job['model_task_key']}/{job['run_name']}",
+                    'report': report})
+
+
+@train_bp.route('/api/export/<owner>/<task_name>/<run_name>', methods=['POST'])
+@login_required
+def export_run(owner, task_name, run_name):
+    """
+    重新导出已有运行的模型 (无需重新训练)。
+    参数 (JSON 或表单): formats 格式列表或逗号分隔字符串；opset / imgsz / batch / workspace (整数) 和
+    half / dynamic / simplify / int8 / optimize (true / false) 等可选导出参数，取值无效时返回 400。
+    """
+    if not check_perm(owner, task_name):
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+    if not re.match(r'^[\w\-\.]+$', run_name): return jsonify({'status': 'error', 'message': 'Invalid Name'}), 400
+
+    data = request.get_json(silent=True) or request.form.to_dict()
+    run_path = os.path.join(current_app.config['DATA_DIR'], owner, task_name, 'runs', run_name)
+    best_pt = find_best_weights(run_path)
+    if not best_pt:
+        return jsonify({'status': 'error', 'message': '该运行没有可导出的权重文件'}), 404
+    try:
+        formats = parse_formats(data.get('formats') or data.get('format') or 'onnx')
+        options = parse_export_options(data)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    exports = exporter.submit(best_pt, formats, options, task_key=f"{owner}/{task_name}", run_name=run_name)
+    return jsonify({'status': 'ok', 'exports': exports})
+
+
+@train_bp.route('/api/exports/<owner>/<task_name>/<run_name>')
+@login_required
+def list_exports(owner, task_name, run_name):
+    """某次运行的全部导出记录：格式、状态、产物路径、大小和耗时。"""
+    if not check_perm(owner, task_name):
+        return jsonify({'status': 'error', 'message': 'Permission Denied'}), 403
+    return jsonify(exporter.list_exports(f"{owner}/{task_name}", run_name))
 
 
 @train_bp.route('/api/download_results/<owner>/<task_name>/<run_name>')
@@ -1,9 +1,39 @@
 # --- START OF FILE extensions.py ---
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from sqlalchemy import event
 
 db = SQLAlchemy()
 login_manager = LoginManager()
 login_manager.login_view = 'auth.login'
 login_manager.login_message = "请先登录以访问此页面。"
-login_manager.login_message_category = "warning"
\ No newline at end of file
+login_manager.login_message_category = "warning"
+
+
+# --- SQLite 调优 ---
+# 默认设置下 SQLite 使用回滚日志：写事务进行时所有读请求都会被阻塞，并发时直接报 "database is locked"。
+# WAL 模式下读写互不阻塞；busy_timeout 让写写冲突时等待而不是立即失败；
+# WAL 下 synchronous=NORMAL 只在检查点时 fsync，掉电最多丢失最近的事务，但不会损坏数据库。
+
+def sqlite_engine_options(busy_timeout_ms=5000, pool_size=10, max_overflow=20):
+    """SQLALCHEMY_ENGINE_OPTIONS：多线程服务下共用的连接池 (连接可跨线程归还)。"""
+    return {
+        'connect_args': {'check_same_thread': False, 'timeout': busy_timeout_ms / 1000},
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': 30,
+    }
+
+
+def install_sqlite_pragmas(engine, busy_timeout_ms=5000, synchronous='NORMAL'):
+    """每个新建的连接上执行 PRAGMA (journal_mode=WAL 会写入数据库文件，其余为连接级设置)。"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.close()
\ No newline at end of file
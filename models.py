@@ -14,10 +14,17 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+PERMISSION_INDEX = 'ix_task_permission_user_task'
+
+
 class TaskPermission(db.Model):
     """
     仅用于控制 'public' 文件夹下的任务对哪些普通用户可见。
+    读写请经过 permissions 模块 (带缓存)，不要直接查询 / 修改本表。
     """
+    # 权限检查按 (user_id, owner_name, task_name) 查找，同时保证同一授权不会重复插入
+    __table_args__ = (db.Index(PERMISSION_INDEX, 'user_id', 'owner_name', 'task_name', unique=True),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     # owner_name 这里通常固定为 'public'，保留字段是为了以后扩展
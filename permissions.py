@@ -0,0 +1,130 @@
+# --- START OF FILE permissions.py ---
+"""
+任务访问权限：管理员可访问一切，用户可访问自己目录下的任务，其它任务 (通常是 public 下的) 需要 TaskPermission 授权。
+
+每个用户被授权的任务集合缓存在进程内，授权 / 撤销都经过本模块 (grant / revoke / revoke_task)，写库后立即使缓存失效；
+同一请求内对同一任务的重复检查再由 flask.g 记住结果，翻图、批量过滤运行记录等操作不再每次都查询 SQLite。
+"""
+import threading
+
+from flask import g, has_request_context
+from flask_login import current_user
+from sqlalchemy import text, insert
+
+from extensions import db
+from models import TaskPermission, PERMISSION_INDEX
+
+_granted = {}  # user_id -> frozenset((owner_name, task_name))
+_generation = 0  # 每次失效加一：查询期间发生过失效时，查到的结果可能已过期，不放入缓存
+_lock = threading.Lock()
+
+
+def granted_tasks(user_id):
+    """用户被授权的 (owner_name, task_name) 集合 (缓存)。"""
+    with _lock:
+        tasks = _granted.get(user_id)
+        generation = _generation
+    if tasks is None:
+        rows = db.session.query(TaskPermission.owner_name, TaskPermission.task_name).filter_by(user_id=user_id).all()
+        tasks = frozenset((owner, task) for owner, task in rows)
+        with _lock:
+            if generation == _generation:
+                _granted[user_id] = tasks
+    return tasks
+
+
+def invalidate(user_id=None):
+    """使某个用户 (None 为所有用户) 的授权缓存失效，下次检查时重新查询。"""
+    global _generation
+    with _lock:
+        _generation += 1
+        if user_id is None:
+            _granted.clear()
+        else:
+            _granted.pop(user_id, None)
+
+
+def check_perm(owner, task_name):
+    """当前登录用户能否访问 owner/task_name。"""
+    if current_user.is_admin: return True
+    if owner == current_user.username: return True
+    key = (owner, task_name)
+    memo = None
+    if has_request_context():
+        memo = g.setdefault('_perm_memo', {})
+        if key in memo:
+            return memo[key]
+    allowed = key in granted_tasks(current_user.id)
+    if memo is not None:
+        memo[key] = allowed
+    return allowed
+
+
+def grant(user_id, owner, task_name):
+    """授权 (已存在时不重复插入)，返回是否新增了记录。"""
+    exists = TaskPermission.query.filter_by(user_id=user_id, owner_name=owner, task_name=task_name).first()
+    if not exists:
+        db.session.add(TaskPermission(user_id=user_id, owner_name=owner, task_name=task_name))
+        db.session.commit()
+    invalidate(user_id)
+    return not exists
+
+
+def revoke(perm_id):
+    """按记录 id 撤销授权，返回是否删除了记录。"""
+    perm = db.session.get(TaskPermission, perm_id)
+    if perm is None:
+        return False
+    user_id = perm.user_id
+    db.session.delete(perm)
+    db.session.commit()
+    invalidate(user_id)
+    return True
+
+
+def grant_many(user_ids, owner, task_names):
+    """批量授权 user_ids × task_names (一个事务，已存在的授权由唯一索引忽略)，返回新增的记录数。"""
+    rows = [{'user_id': u, 'owner_name': owner, 'task_name': t} for u in set(user_ids) for t in set(task_names)]
+    if not rows:
+        return 0
+    result = db.session.connection().execute(insert(TaskPermission.__table__).prefix_with('OR IGNORE'), rows)
+    db.session.commit()
+    for user_id in set(user_ids):
+        invalidate(user_id)
+    return max(result.rowcount, 0)
+
+
+def revoke_many(user_ids, owner, task_names):
+    """批量撤销 user_ids × task_names 的授权 (一个事务)，返回删除的记录数。"""
+    user_ids, task_names = set(user_ids), set(task_names)
+    if not user_ids or not task_names:
+        return 0
+    deleted = TaskPermission.query.filter(TaskPermission.user_id.in_(user_ids), TaskPermission.owner_name == owner,
+                                          TaskPermission.task_name.in_(task_names)).delete(synchronize_session=False)
+    db.session.commit()
+    for user_id in user_ids:
+        invalidate(user_id)
+    return deleted
+
+
+def revoke_task(owner, task_name):
+    """删除任务时清理该任务的所有授权记录。"""
+    TaskPermission.query.filter_by(owner_name=owner, task_name=task_name).delete()
+    db.session.commit()
+    invalidate()
+
+
+def ensure_permission_index():
+    """
+    旧数据库的 task_permission 表建于唯一索引加入之前 (db.create_all 不会修改已有的表)：
+    先去掉重复的授权记录，再补建 (user_id, owner_name, task_name) 唯一索引。需在应用上下文中调用。
+    """
+    with db.engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"),
+                        {'name': PERMISSION_INDEX}).first():
+            return
+        conn.execute(text("DELETE FROM task_permission WHERE id NOT IN "
+                          "(SELECT MIN(id) FROM task_permission GROUP BY user_id, owner_name, task_name)"))
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {PERMISSION_INDEX} "
+                          "ON task_permission (user_id, owner_name, task_name)"))
+    invalidate()
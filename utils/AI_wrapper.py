@@ -1,5 +1,10 @@
 import threading
 import logging
+from concurrent.futures import Future
+
+from utils.microbatch import MicroBatcher, QueueFull
+from utils.sam_backend import DisabledSamBackend, EmbeddingCache
+from utils.sam_prefetch import EmbeddingPrefetcher
 
 # 本文件已不具备功能，该文件用于自动标注实现，如果您感兴趣，请联系作者
 
@@ -22,7 +27,10 @@ class Sam3Processor:
 
 class SAM3Engine:
     """
-    SAM3 引擎的虚设实现。
+    SAM3 引擎：编码 / 解码由可替换的后端 (utils.sam_backend) 完成，图片编码结果缓存在 EmbeddingCache 中。
+    所有模型调用经过一个推理队列 (MicroBatcher)：短时间窗口内到达的多个请求 (可能来自不同标注员、不同图片)
+    合并为一次批量调用，代替原来逐个请求串行的 inference_lock。
+    开源版默认使用 DisabledSamBackend，所有请求返回空结果。
     """
     _instance = None
     _init_lock = threading.Lock()
@@ -35,22 +43,137 @@ class SAM3Engine:
                     cls._instance = SAM3Engine()
         return cls._instance
 
-    def __init__(self):
-        self.inference_lock = threading.Lock()
+    def __init__(self, backend=None, cache_bytes=1024 * 1024 * 1024):
         self.sam3_model = None
         self.sam2_model = None
-        print(">>> [AI Engine] Open Source Version: SAM Engine is disabled.")
+        self.backend = backend or DisabledSamBackend()
+        self.embeddings = EmbeddingCache(cache_bytes)
+        self.request_timeout = 30
+        # 队列只有一个工作线程，模型调用天然串行，不再需要 inference_lock
+        self.queue = MicroBatcher(self._run_batch, max_batch=8, max_wait_ms=10, max_queue=256, name='sam-inference')
+        self.prefetcher = EmbeddingPrefetcher(self)
+        if isinstance(self.backend, DisabledSamBackend):
+            print(">>> [AI Engine] Open Source Version: SAM Engine is disabled.")
+
+    def configure(self, backend=None, cache_bytes=None, max_batch=None, max_wait_ms=None, max_queue=None,
+                  request_timeout=None, prefetch_depth=None):
+        """切换后端 (旧后端的编码结果因 model_id 不同不会再命中，直接清空)、调整缓存上限和推理队列参数。"""
+        if backend is not None and backend is not self.backend:
+            self.backend = backend
+            self.embeddings.clear()
+        if cache_bytes is not None:
+            self.embeddings.max_bytes = cache_bytes
+        self.queue.configure(max_batch=max_batch, max_wait_ms=max_wait_ms, max_queue=max_queue)
+        if request_timeout:
+            self.request_timeout = request_timeout
+        if prefetch_depth is not None:
+            self.prefetcher.depth = prefetch_depth
+
+    def _run_batch(self, op, items):
+        """推理队列的 handler：同类操作的一批请求交给后端的批量接口。"""
+        if op == 'encode':
+            return self.backend.encode_many(items)
+        if op == 'decode':
+            return self.backend.decode_requests(items)
+        if op == 'text':
+            return self.backend.decode_text_requests(items)
+        raise ValueError(f"未知的推理操作: {op}")
+
+    def _encode(self, image_path):
+        return self.queue.submit('encode', image_path, timeout=self.request_timeout)
+
+    def get_image_state(self, image_path):
+        """
+        返回图片的编码结果 (命中缓存时不调用模型)。
+        这张图片的预取编码还在后台队列中排队时先把它提升为普通请求：下面的 get 会等待预取持有的单飞锁，
+        不提升的话要等到队列空闲才轮到它。
+        """
+        self.queue.promote('encode', image_path)
+        return self.embeddings.get(image_path, self.backend, encode=self._encode)
+
+    def prefetch_after(self, task_path, image_name):
+        """图片被打开时调用：后台编码按自然排序紧随其后的几张图片 (禁用的后端不做预取)。"""
+        if not isinstance(self.backend, DisabledSamBackend):
+            # 触发预取的请求本身可能紧接着要推理 (sam_predict)，先让它排在预取之前
+            self.queue.touch()
+            self.prefetcher.image_opened(task_path, image_name)
 
-    def predict_mixed(self, *args, **kwargs):
-        # 始终返回空结果，让前端不显示任何标注
-        return []
+    def prefetch_image(self, image_path):
+        """
+        以低优先级编码一张图片放入缓存；已缓存时返回 False。
+        编码经过缓存的单飞锁：预取进行中时打开这张图片的交互请求直接等待预取结果，不会重复编码。
+        """
+        if self.embeddings.peek(image_path, self.backend) is not None:
+            return False
+        self.embeddings.get(image_path, self.backend,
+                            encode=lambda path: self.queue.submit('encode', path, timeout=self.request_timeout,
+                                                                  background=True))
+        return True
 
-    def predict_text(self, *args, **kwargs):
-        # 始终返回空结果
-        return []
+    def predict_mixed(self, image_path, bboxes=None, bbox_labels=None, points=None, point_labels=None,
+                      text_prompt=None, conf_thres=0.25, sam_mode='semantic'):
+        return self.predict_mixed_batch(image_path, [{
+            'bboxes': bboxes, 'bbox_labels': bbox_labels, 'points': points, 'point_labels': point_labels,
+            'text_prompt': text_prompt,
+        }], conf_thres=conf_thres, sam_mode=sam_mode)[0]
+
+    def predict_mixed_batch(self, image_path, prompt_sets, conf_thres=0.25, sam_mode='semantic'):
+        """
+        同一张图上的多组提示 (每组为 predict_mixed 的 bboxes / bbox_labels / points / point_labels / text_prompt
+        组成的 dict) 共享一次图片编码，并在一次后端调用中批量解码。返回与 prompt_sets 顺序一致的结果列表。
+        """
+        if not prompt_sets:
+            return []
+        state = self.get_image_state(image_path)
+        prompts = [{'boxes': p.get('bboxes') or [], 'box_labels': p.get('bbox_labels') or [],
+                    'points': p.get('points') or [], 'point_labels': p.get('point_labels') or [],
+                    'text': p.get('text_prompt')} for p in prompt_sets]
+        return self.queue.submit('decode', {'state': state, 'prompt_sets': prompts, 'conf_thres': conf_thres,
+                                            'sam_mode': sam_mode}, timeout=self.request_timeout)
+
+    def predict_text(self, image_path, texts, conf_thres=0.25):
+        state = self.get_image_state(image_path)
+        return self.queue.submit('text', {'state': state, 'texts': texts, 'conf_thres': conf_thres},
+                                 timeout=self.request_timeout)
+
+    def predict_text_many(self, image_paths, texts, conf_thres=0.25):
+        """
+        整任务批量标注用：多张图片的编码和文本解码一次性提交到推理队列，由队列合并成批量调用。
+        已缓存的编码直接复用；新编码的结果不放进缓存，避免整任务扫描把标注员正在使用的编码挤出去。
+        返回与 image_paths 顺序一致的列表，每项为结果列表，或该图片失败时的异常对象。
+        """
+        results = [None] * len(image_paths)
+        states, encodes = {}, {}
+        for i, path in enumerate(image_paths):
+            try:
+                states[i] = self.embeddings.peek(path, self.backend) or self.queue.submit_async('encode', path)
+            except QueueFull as e:
+                results[i] = e
+        decodes = {}
+        for i, state in states.items():
+            try:
+                if isinstance(state, Future):
+                    encodes[i] = state
+                    state = state.result(self.request_timeout)
+                decodes[i] = self.queue.submit_async('text', {'state': state, 'texts': texts,
+                                                              'conf_thres': conf_thres})
+            except Exception as e:
+                results[i] = e
+        for i, future in decodes.items():
+            try:
+                results[i] = future.result(self.request_timeout)
+            except Exception as e:
+                results[i] = e
+        for future in list(encodes.values()) + list(decodes.values()):
+            future.cancel()  # 超时未执行的请求不再进入批次
+        return results
+
+    def stats(self):
+        return {'queue': self.queue.metrics(), 'embeddings': self.embeddings.stats(),
+                'prefetch': self.prefetcher.stats(), 'backend': self.backend.model_id}
 
     def warmup(self):
         pass
 
     def _clear_memory(self, state):
-        pass
\ No newline at end of file
+        pass
@@ -0,0 +1,178 @@
+# batch_infer.py
+"""
+批量预标注：用训练好的模型对任务中的图片做推理，写出 YOLO txt 预标注。
+作为独立子进程运行 (python -u batch_infer.py <spec.json>)，由调度器以 kind='infer' 的任务启动，
+停止 / 重启接管等行为与训练任务一致。进度以 "__PROGRESS__ {json}" 行输出，由服务端转发到 SSE。
+"""
+import importlib.util
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == '__main__':
+    # 作为脚本运行时把项目根目录加入 sys.path，才能导入 utils.*
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+from utils.label_io import natural_sort_key, annotations_to_yolo_lines, write_label_file, TASK_IMAGE_EXTS
+
+PROGRESS_PREFIX = "__PROGRESS__ "
+
+
+def _np(x):
+    return np.asarray(x.cpu() if hasattr(x, 'cpu') else x)
+
+
+def result_to_annotations(result, ann_type=None):
+    """
+    Ultralytics Results -> 前端标注格式 (与 sam_predict 返回的 annotations 一致，另附 confidence)。
+    ann_type 为 None 时按模型类型决定：旋转框 -> obb，分割 -> polygon，检测 -> rect。
+    """
+    names = result.names
+    annotations = []
+    if getattr(result, 'obb', None) is not None and len(result.obb):
+        for (cx, cy, w, h, r), c, conf in zip(_np(result.obb.xywhr), _np(result.obb.cls), _np(result.obb.conf)):
+            annotations.append({'type': 'obb', 'label': names[int(c)], 'confidence': round(float(conf), 4),
+                                'points': {'x': float(cx), 'y': float(cy), 'w': float(w), 'h': float(h),
+                                           'rotation': float(r)}})
+        return annotations
+    boxes = result.boxes
+    if boxes is None or not len(boxes):
+        return annotations
+    classes, confs = _np(boxes.cls), _np(boxes.conf)
+    if result.masks is not None and ann_type in (None, 'polygon'):
+        for poly, c, conf in zip(result.masks.xy, classes, confs):
+            if len(poly) < 3:
+                continue
+            annotations.append({'type': 'polygon', 'label': names[int(c)], 'confidence': round(float(conf), 4),
+                                'points': [[float(x), float(y)] for x, y in poly]})
+        return annotations
+    for (x1, y1, x2, y2), c, conf in zip(_np(boxes.xyxy), classes, confs):
+        annotations.append({'type': 'rect', 'label': names[int(c)], 'confidence': round(float(conf), 4),
+                            'points': {'x': float(x1), 'y': float(y1), 'w': float(x2 - x1), 'h': float(y2 - y1)}})
+    return annotations
+
+
+def find_best_weights(run_path):
+    best_pt = os.path.join(run_path, 'weights', 'metal2.pt')  # 注意：你的代码里写死为metal2.pt，请确认是否正确，通常是best.pt
+    if not os.path.exists(best_pt):
+        best_pt = os.path.join(run_path, 'weights', 'best.pt')
+    return best_pt if os.path.exists(best_pt) else None
+
+
+def pick_weights(weights, prefer_onnx=True):
+    """给定 best.pt 时，若同目录下已有导出的 ONNX 且安装了 onnxruntime，改用 ONNX Runtime 在 CPU 上推理。"""
+    if weights.endswith('.pt') and prefer_onnx and importlib.util.find_spec('onnxruntime') is not None:
+        onnx_path = os.path.splitext(weights)[0] + '.onnx'
+        if os.path.exists(onnx_path):
+            return onnx_path
+    return weights
+
+
+def onnx_batch_size(onnx_path, requested):
+    """静态 batch 的 ONNX 模型只能逐张推理；动态 batch (导出时 dynamic=True) 才按 requested 批量推理。"""
+    import onnxruntime
+    session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+    dim = session.get_inputs()[0].shape[0]
+    return requested if not isinstance(dim, int) else dim
+
+
+def decode_image(path):
+    """在线程池中解码图片为 BGR ndarray (与 cv2.imread 一致，可直接喂给 Ultralytics)。"""
+    try:
+        with Image.open(path) as img:
+            rgb = np.asarray(img.convert('RGB'))
+        return np.ascontiguousarray(rgb[:, :, ::-1])
+    except Exception as e:
+        print(f"无法读取图片 {os.path.basename(path)}: {e}")
+        return None
+
+
+def list_targets(task_path, overwrite=False, images=None):
+    """
+    待预标注的图片 (自然排序)；不覆盖时跳过已有 txt 的图片 (空 txt 表示已标注为无目标，同样跳过)。
+    images 来自请求参数：只接受任务目录下的图片文件名，带路径或非图片扩展名的条目被忽略。
+    """
+    names = images or os.listdir(task_path)
+    names = sorted((n for n in names if isinstance(n, str) and os.path.basename(n) == n
+                    and os.path.splitext(n)[1].lower() in TASK_IMAGE_EXTS
+                    and os.path.isfile(os.path.join(task_path, n))),
+                   key=natural_sort_key)
+    if overwrite:
+        return names
+    return [n for n in names if not os.path.exists(os.path.join(task_path, os.path.splitext(n)[0] + '.txt'))]
+
+
+def _progress(**fields):
+    print(PROGRESS_PREFIX + json.dumps(fields), flush=True)
+
+
+def run(spec):
+    from ultralytics import YOLO
+
+    task_path = spec['task_path']
+    weights = pick_weights(spec['weights'], spec.get('prefer_onnx', True))
+    batch = max(1, int(spec.get('batch', 8)))
+    if weights.endswith('.onnx'):
+        batch = onnx_batch_size(weights, batch)
+    print(f"模型: {weights} (batch={batch}, {'ONNX Runtime' if weights.endswith('.onnx') else 'PyTorch'} / CPU)")
+    model = YOLO(weights)
+
+    with open(os.path.join(task_path, 'labels.json'), 'r', encoding='utf-8') as f:
+        labels = json.load(f)
+    label_to_index = {label['name']: i for i, label in enumerate(labels)}
+
+    targets = list_targets(task_path, spec.get('overwrite', False), spec.get('images'))
+    total = len(targets)
+    print(f"共 {total} 张图片需要预标注" + ("" if spec.get('overwrite') else " (已有标注的图片已跳过)"))
+    _progress(done=0, total=total, written=0, failed=0, ips=0.0)
+    if not total:
+        return 0
+
+    batches = [targets[i:i + batch] for i in range(0, total, batch)]
+    done = written = failed = 0
+    unknown = set()
+    start = time.perf_counter()
+    prefetch = max(2, int(spec.get('prefetch_batches', 2)))
+    with ThreadPoolExecutor(max_workers=int(spec.get('workers') or min(8, os.cpu_count() or 2))) as pool:
+        # 解码线程池始终领先推理 prefetch 个批次，推理时下一批图片已在内存中
+        pending = deque()
+        next_batch = 0
+        while next_batch < len(batches) or pending:
+            while next_batch < len(batches) and len(pending) < prefetch:
+                names = batches[next_batch]
+                pending.append((names, [pool.submit(decode_image, os.path.join(task_path, n)) for n in names]))
+                next_batch += 1
+            names, futures = pending.popleft()
+            decoded = [(n, f.result()) for n, f in zip(names, futures)]
+            valid = [(n, img) for n, img in decoded if img is not None]
+            failed += len(decoded) - len(valid)
+            if valid:
+                results = model.predict([img for _, img in valid], imgsz=spec.get('imgsz', 640),
+                                        conf=spec.get('conf', 0.25), iou=spec.get('iou', 0.7), device='cpu',
+                                        verbose=False)
+                for (name, img), result in zip(valid, results):
+                    annotations = result_to_annotations(result, spec.get('ann_type'))
+                    unknown.update(a['label'] for a in annotations if a['label'] not in label_to_index)
+                    lines = annotations_to_yolo_lines(annotations, label_to_index, img.shape[1], img.shape[0])
+                    write_label_file(os.path.join(task_path, os.path.splitext(name)[0] + '.txt'), lines)
+                    written += 1
+            done += len(decoded)
+            elapsed = time.perf_counter() - start
+            _progress(done=done, total=total, written=written, failed=failed,
+                      ips=round(done / elapsed, 2) if elapsed else 0.0)
+
+    if unknown:
+        print(f"以下类别不在 labels.json 中，已忽略: {', '.join(sorted(unknown))}")
+    print(f"预标注完成: 写入 {written} 张，失败 {failed} 张，用时 {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        sys.exit(run(json.load(f)))
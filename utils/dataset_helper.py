@@ -2,11 +2,94 @@
 import os
 import shutil
 import random
+import hashlib
 import yaml
 import json
+from concurrent.futures import ProcessPoolExecutor
 
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.bmp')
 
-def prepare_dataset_for_training(task_path: str, train_ratio: float) -> dict:
+
+def _file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _resize_into_cache(args):
+    """
+    (进程池工作函数) 将单张图片按长边缩放到 imgsz 并写入内容寻址缓存。
+    缓存路径: <cache_dir>/<imgsz>/<sha1前两位>/<sha1><ext>，相同内容的图片在不同任务、不同训练之间共享。
+    :return: 缓存文件路径；图片本身不大于 imgsz 时返回 None，表示直接使用原图。
+    """
+    src_path, cache_dir, imgsz = args
+    try:
+        return _build_cached_copy(src_path, cache_dir, imgsz)
+    except Exception as e:
+        print(f"预缩放失败 {src_path}: {e}")
+        return None
+
+
+def _build_cached_copy(src_path: str, cache_dir: str, imgsz: int):
+    from PIL import Image
+
+    digest = _file_digest(src_path)
+    ext = os.path.splitext(src_path)[1].lower()
+    dst_path = os.path.join(cache_dir, str(imgsz), digest[:2], digest + ext)
+    if os.path.exists(dst_path):
+        return dst_path
+
+    with Image.open(src_path) as img:
+        w, h = img.size
+        if max(w, h) <= imgsz:
+            return None
+        scale = imgsz / max(w, h)
+        new_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        # JPEG 可以在解码阶段直接按 1/2、1/4、1/8 缩小，4K 图能省掉大部分解码时间
+        img.draft(img.mode, new_size)
+        exif = img.info.get('exif')
+        resized = img.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        # 先写临时文件再替换，避免多个任务同时构建同一张图时读到半个文件
+        tmp_path = f"{dst_path}.{os.getpid()}.tmp"
+        save_kwargs = {'quality': 95} if ext in ('.jpg', '.jpeg') else {}
+        if exif:
+            save_kwargs['exif'] = exif
+        resized.save(tmp_path, format=img.format, **save_kwargs)
+        os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def build_resized_cache(image_paths, cache_dir: str, imgsz: int, workers=None) -> dict:
+    """
+    使用进程池为一批图片构建缩放缓存。
+    :return: {原图路径: 缓存路径}，不需要缩放或处理失败的图片不在结果中。
+    """
+    mapping = {}
+    if not image_paths:
+        return mapping
+    jobs = [(p, cache_dir, imgsz) for p in image_paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for src, dst in zip(image_paths, pool.map(_resize_into_cache, jobs, chunksize=8)):
+            if dst:
+                mapping[src] = dst
+    return mapping
+
+
+def _place_file(src: str, dst_dir: str, name: str):
+    """优先使用硬链接放入划分目录 (不占额外空间)，跨盘等失败时回退为复制。"""
+    dst = os.path.join(dst_dir, name)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+def prepare_dataset_for_training(task_path: str, train_ratio: float, imgsz: int = None, cache_dir: str = None,
+                                 workers: int = None, split: dict = None) -> dict:
     """
     为指定任务准备训练数据集。
     1. 查找所有图片和对应的标签。
@@ -14,9 +97,16 @@ def prepare_dataset_for_training(task_path: str, train_ratio: float) -> dict:
     3. 创建YOLOv5/v8所需的目录结构 (在 TrainData/ 子目录下)。
     4. 生成 data.yaml 文件。
 
+    可选：同时传入 imgsz 和 cache_dir 时，先把图片按长边缩放到 imgsz 写入共享缓存，
+    划分目录中的图片指向缩放后的副本。标签是归一化坐标，无需修改。
+
     :param task_path: 任务的根目录路径。
     :param train_ratio: 训练集所占的比例 (0.0 to 1.0)。
-    :return: 一个包含成功状态、消息和yaml文件路径的字典。
+    :param imgsz: 训练输入尺寸，用于预缩放缓存。
+    :param cache_dir: 预缩放缓存根目录，为 None 时不启用缓存。
+    :param workers: 构建缓存的进程数，默认为 CPU 核数。
+    :param split: 指定划分 {'train': [...], 'val': [...]} (图片文件名)，用于断点续训时还原原来的划分。
+    :return: 一个包含成功状态、消息、yaml文件路径和本次划分 (split) 的字典。
     """
     try:
         # --- 1. 定义路径和查找文件 ---
@@ -34,20 +124,39 @@ def prepare_dataset_for_training(task_path: str, train_ratio: float) -> dict:
             os.makedirs(p, exist_ok=True)
 
         all_files = os.listdir(task_path)
-        images = [f for f in all_files if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))]
+        images = [f for f in all_files if f.lower().endswith(IMAGE_EXTS)]
 
         if not images:
             return {"success": False, "message": "错误：项目文件夹中没有找到任何图片。"}
 
         # --- 2. 划分数据集 ---
-        random.shuffle(images)
-        train_count = int(len(images) * train_ratio)
-        train_images = images[:train_count]
-        val_images = images[train_count:]
+        if split:
+            # 还原指定的划分 (已被删除的图片自动跳过)
+            existing = set(images)
+            train_images = [f for f in split.get('train', []) if f in existing]
+            val_images = [f for f in split.get('val', []) if f in existing]
+            images = train_images + val_images
+        else:
+            random.shuffle(images)
+            train_count = int(len(images) * train_ratio)
+            train_images = images[:train_count]
+            val_images = images[train_count:]
 
         log_messages = [f"共发现 {len(images)} 张图片。划分为 {len(train_images)} 训练集和 {len(val_images)} 验证集。"]
 
-        # --- 3. 复制文件到新目录 ---
+        # --- 3. (可选) 构建预缩放缓存 ---
+        resized = {}
+        if imgsz and cache_dir:
+            labelled = [os.path.join(task_path, f) for f in images
+                        if os.path.exists(os.path.join(task_path, os.path.splitext(f)[0] + ".txt"))]
+            try:
+                resized = build_resized_cache(labelled, cache_dir, imgsz, workers)
+                log_messages.append(f"预缩放缓存 (imgsz={imgsz}): {len(resized)} 张图片使用缩放副本。")
+            except Exception as e:
+                log_messages.append(f"预缩放缓存构建失败，改用原图: {e}")
+                resized = {}
+
+        # --- 4. 复制文件到新目录 ---
         def copy_files(image_list, dest_type):
             copied_count = 0
             for img_file in image_list:
@@ -58,7 +167,10 @@ def prepare_dataset_for_training(task_path: str, train_ratio: float) -> dict:
                 src_txt_path = os.path.join(task_path, txt_file)
 
                 if os.path.exists(src_txt_path):
-                    shutil.copy(src_img_path, paths[f"{dest_type}_images"])
+                    if src_img_path in resized:
+                        _place_file(resized[src_img_path], paths[f"{dest_type}_images"], img_file)
+                    else:
+                        shutil.copy(src_img_path, paths[f"{dest_type}_images"])
                     shutil.copy(src_txt_path, paths[f"{dest_type}_labels"])
                     copied_count += 1
             return copied_count
@@ -72,7 +184,7 @@ def prepare_dataset_for_training(task_path: str, train_ratio: float) -> dict:
         if train_copied == 0 and val_copied == 0:
             return {"success": False, "message": "错误：所有图片都没有对应的.txt标签文件，无法进行训练。"}
 
-        # --- 4. 生成 data.yaml ---
+        # --- 5. 生成 data.yaml ---
         labels_json_path = os.path.join(task_path, 'labels.json')
         if not os.path.exists(labels_json_path):
             return {"success": False, "message": "错误: 未找到 labels.json 文件，无法确定类别。"}
@@ -100,7 +212,8 @@ def prepare_dataset_for_training(task_path: str, train_ratio: float) -> dict:
         return {
             "success": True,
             "message": "\n".join(log_messages),
-            "yaml_path": yaml_path
+            "yaml_path": yaml_path,
+            "split": {"train": train_images, "val": val_images}
         }
 
     except Exception as e:
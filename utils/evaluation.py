@@ -0,0 +1,343 @@
+# evaluation.py
+"""
+模型评估：用某次运行的权重评估任意任务 (当前磁盘上的标注)，输出 mAP、每类 PR 曲线和混淆矩阵。
+作为独立子进程运行 (python -u evaluation.py <spec.json>)，由调度器以 kind='eval' 的任务启动。
+
+原始预测按 (权重哈希, 推理参数, 图片内容哈希) 缓存在磁盘上 (低置信度阈值下的全部检测框)，
+标注修改后重新评估只需重新打分，不再推理；只有新增 / 修改过的图片才会重新推理。
+旋转框和多边形标注按其外接矩形参与 IoU 匹配。
+"""
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from utils.batch_infer import PROGRESS_PREFIX, pick_weights, onnx_batch_size, decode_image, list_targets
+from utils.label_io import atomic_write_text
+from utils.run_registry import file_sha256
+
+# 缓存的预测使用的置信度阈值 (与 Ultralytics val 一致)，打分时再按需过滤
+CACHE_CONF = 0.001
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+PR_POINTS = 101
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz  # numpy 2.0 起 trapz 更名为 trapezoid
+
+
+# ============ 预测缓存 ============
+
+def cache_dir_for(cache_root, weights_sha, imgsz, iou):
+    return os.path.join(cache_root, weights_sha, f"{imgsz}_{iou:g}")
+
+
+def _cache_path(cache_dir, image_sha):
+    return os.path.join(cache_dir, image_sha[:2], image_sha + '.npz')
+
+
+def load_prediction(cache_dir, image_sha):
+    path = _cache_path(cache_dir, image_sha)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            return {k: data[k] for k in data.files}
+    except Exception:
+        return None  # 损坏的缓存文件按未命中处理，重新推理后覆盖
+
+
+def save_prediction(cache_dir, image_sha, result, width, height):
+    """Ultralytics Results -> {xyxy, conf, names, size}，先写临时文件再替换。"""
+    source = result.obb if getattr(result, 'obb', None) is not None else result.boxes
+    if source is not None and len(source):
+        xyxy = np.asarray(source.xyxy.cpu() if hasattr(source.xyxy, 'cpu') else source.xyxy, dtype=np.float32)
+        conf = np.asarray(source.conf.cpu() if hasattr(source.conf, 'cpu') else source.conf, dtype=np.float32)
+        cls = np.asarray(source.cls.cpu() if hasattr(source.cls, 'cpu') else source.cls).astype(int)
+        names = np.array([result.names[int(c)] for c in cls], dtype=str)
+    else:
+        xyxy, conf, names = np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.array([], dtype=str)
+    path = _cache_path(cache_dir, image_sha)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp, xyxy=xyxy, conf=conf, names=names, size=np.array([width, height]))
+    os.replace(tmp, path)
+    return {'xyxy': xyxy, 'conf': conf, 'names': names, 'size': np.array([width, height])}
+
+
+# ============ 标注读取 ============
+
+def read_ground_truth(txt_path, width, height):
+    """YOLO txt -> (类别索引数组, 像素坐标 xyxy 数组)。矩形为 cx cy w h，旋转框 / 多边形取顶点的外接矩形。"""
+    classes, boxes = [], []
+    with open(txt_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            values = [float(v) for v in parts[1:]]
+            if len(values) == 4:
+                cx, cy, w, h = values
+                box = [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2]
+            else:
+                xs, ys = values[0::2], values[1::2]
+                box = [min(xs), min(ys), max(xs), max(ys)]
+            classes.append(int(parts[0]))
+            boxes.append(box)
+    boxes = np.array(boxes, dtype=np.float32).reshape(-1, 4) * np.array([width, height, width, height], np.float32)
+    return np.array(classes, dtype=int), boxes
+
+
+# ============ 打分 (向量化) ============
+
+def box_iou(a, b):
+    """(N, 4) x (M, 4) -> (N, M) IoU 矩阵。"""
+    lt = np.maximum(a[:, None, :2], b[None, :, :2])
+    rb = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.clip(rb - lt, 0, None).prod(axis=2)
+    area_a = (a[:, 2:] - a[:, :2]).clip(0).prod(axis=1)
+    area_b = (b[:, 2:] - b[:, :2]).clip(0).prod(axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def _greedy_matches(iou, threshold):
+    """IoU >= threshold 的 (gt, pred) 对，按 IoU 从高到低一对一匹配。"""
+    gt_idx, pred_idx = np.nonzero(iou >= threshold)
+    if not len(gt_idx):
+        return gt_idx, pred_idx
+    order = np.argsort(-iou[gt_idx, pred_idx], kind='stable')
+    gt_idx, pred_idx = gt_idx[order], pred_idx[order]
+    _, first = np.unique(pred_idx, return_index=True)
+    gt_idx, pred_idx = gt_idx[np.sort(first)], pred_idx[np.sort(first)]
+    _, first = np.unique(gt_idx, return_index=True)
+    keep = np.sort(first)
+    return gt_idx[keep], pred_idx[keep]
+
+
+def match_predictions(gt_cls, pred_cls, iou):
+    """每个预测在 10 个 IoU 阈值下是否为 TP -> (P, 10) bool。只有同类别的框才能匹配。"""
+    correct = np.zeros((len(pred_cls), len(IOU_THRESHOLDS)), dtype=bool)
+    if not len(gt_cls) or not len(pred_cls):
+        return correct
+    iou = iou * (gt_cls[:, None] == pred_cls[None, :])
+    for i, threshold in enumerate(IOU_THRESHOLDS):
+        _, pred_idx = _greedy_matches(iou, threshold)
+        correct[pred_idx, i] = True
+    return correct
+
+
+def _compute_ap(recall, precision):
+    """101 点插值 AP (COCO)，同时返回该阈值下的 PR 曲线 (precision 包络在 101 个 recall 点上的取值)。"""
+    mrec = np.concatenate(([0.0], recall, [1.0]))
+    mpre = np.concatenate(([1.0], precision, [0.0]))
+    mpre = np.flip(np.maximum.accumulate(np.flip(mpre)))
+    x = np.linspace(0, 1, PR_POINTS)
+    curve = np.interp(x, mrec, mpre)
+    return float(_trapezoid(curve, x)), curve
+
+
+def ap_per_class(tp, conf, pred_cls, gt_cls, num_classes):
+    """
+    :param tp: (P, 10) 所有图片的预测 TP 标记
+    :return: 每类的 AP (10 个阈值)、PR 曲线 (IoU=0.5)、最佳 F1 置信度下的 precision / recall
+    """
+    order = np.argsort(-conf, kind='stable')
+    tp, conf, pred_cls = tp[order], conf[order], pred_cls[order]
+    px = np.linspace(0, 1, 1000)
+    ap = np.zeros((num_classes, len(IOU_THRESHOLDS)))
+    curves = np.zeros((num_classes, PR_POINTS))
+    p_curve, r_curve = np.zeros((num_classes, len(px))), np.zeros((num_classes, len(px)))
+    n_gt = np.bincount(gt_cls, minlength=num_classes) if len(gt_cls) else np.zeros(num_classes, int)
+    for c in range(num_classes):
+        mask = pred_cls == c
+        if not mask.any() or not n_gt[c]:
+            continue
+        tpc = tp[mask].cumsum(0)
+        fpc = (1 - tp[mask]).cumsum(0)
+        recall = tpc / (n_gt[c] + 1e-16)
+        precision = tpc / (tpc + fpc)
+        # 置信度从高到低，np.interp 需要递增的横坐标，因此取负
+        r_curve[c] = np.interp(-px, -conf[mask], recall[:, 0], left=0)
+        p_curve[c] = np.interp(-px, -conf[mask], precision[:, 0], left=1)
+        for j in range(len(IOU_THRESHOLDS)):
+            ap[c, j], curve = _compute_ap(recall[:, j], precision[:, j])
+            if j == 0:
+                curves[c] = curve
+    f1 = 2 * p_curve * r_curve / (p_curve + r_curve + 1e-16)
+    present = n_gt > 0
+    best = int(f1[present].mean(0).argmax()) if present.any() else 0
+    return {'ap': ap, 'pr_curves': curves, 'precision': p_curve[:, best], 'recall': r_curve[:, best],
+            'best_conf': float(px[best]), 'n_gt': n_gt}
+
+
+def confusion_matrix(gt_cls, gt_boxes, pred_cls, pred_boxes, num_classes, iou_threshold=0.45):
+    """
+    单张图片的混淆矩阵 (num_classes + 1) x (num_classes + 1)，行为真实类别、列为预测类别，最后一行 / 列为背景。
+    与 Ultralytics 一致：不区分类别地按 IoU 匹配，未匹配的真实框记为漏检 (预测为背景)，未匹配的预测框记为误检。
+    """
+    matrix = np.zeros((num_classes + 1, num_classes + 1), dtype=np.int64)
+    bg = num_classes
+    if not len(pred_cls):
+        np.add.at(matrix, (gt_cls, bg), 1)
+        return matrix
+    if not len(gt_cls):
+        np.add.at(matrix, (bg, pred_cls), 1)
+        return matrix
+    gt_idx, pred_idx = _greedy_matches(box_iou(gt_boxes, pred_boxes), iou_threshold)
+    np.add.at(matrix, (gt_cls[gt_idx], pred_cls[pred_idx]), 1)
+    np.add.at(matrix, (np.delete(gt_cls, gt_idx), bg), 1)
+    np.add.at(matrix, (bg, np.delete(pred_cls, pred_idx)), 1)
+    return matrix
+
+
+def score(task_path, images, predictions, label_names, matrix_conf=0.25, matrix_iou=0.45):
+    """
+    按任务当前的标注为缓存的预测打分 (纯 numpy，不需要模型)。
+    :param images: 图片文件名列表；predictions: {文件名: load_prediction() 的结果}
+    """
+    index = {name: i for i, name in enumerate(label_names)}
+    nc = len(label_names)
+    all_tp, all_conf, all_cls, all_gt = [], [], [], []
+    matrix = np.zeros((nc + 1, nc + 1), dtype=np.int64)
+    unknown = set()
+    for name in images:
+        pred = predictions.get(name)
+        if pred is None:
+            continue
+        width, height = (int(v) for v in pred['size'])
+        gt_cls, gt_boxes = read_ground_truth(os.path.join(task_path, os.path.splitext(name)[0] + '.txt'),
+                                             width, height)
+        keep = gt_cls < nc
+        gt_cls, gt_boxes = gt_cls[keep], gt_boxes[keep]
+        names = pred['names'].astype(str)
+        known = np.array([n in index for n in names], dtype=bool)
+        unknown.update(names[~known].tolist())
+        pred_cls = np.array([index[n] for n in names[known]], dtype=int)
+        pred_boxes, conf = pred['xyxy'][known], pred['conf'][known]
+
+        all_tp.append(match_predictions(gt_cls, pred_cls, box_iou(gt_boxes, pred_boxes)))
+        all_conf.append(conf)
+        all_cls.append(pred_cls)
+        all_gt.append(gt_cls)
+        confident = conf >= matrix_conf
+        matrix += confusion_matrix(gt_cls, gt_boxes, pred_cls[confident], pred_boxes[confident], nc, matrix_iou)
+
+    if not all_tp:
+        return None
+    stats = ap_per_class(np.concatenate(all_tp), np.concatenate(all_conf), np.concatenate(all_cls),
+                         np.concatenate(all_gt), nc)
+    present = stats['n_gt'] > 0
+    per_class = [{
+        'name': label_names[c], 'instances': int(stats['n_gt'][c]),
+        'precision': round(float(stats['precision'][c]), 4), 'recall': round(float(stats['recall'][c]), 4),
+        'map50': round(float(stats['ap'][c, 0]), 4), 'map50_95': round(float(stats['ap'][c].mean()), 4),
+        'pr_curve': [round(float(v), 4) for v in stats['pr_curves'][c]],
+    } for c in range(nc)]
+    return {
+        'images': len(all_tp),
+        'instances': int(stats['n_gt'].sum()),
+        'precision': round(float(stats['precision'][present].mean()), 4) if present.any() else 0.0,
+        'recall': round(float(stats['recall'][present].mean()), 4) if present.any() else 0.0,
+        'map50': round(float(stats['ap'][present, 0].mean()), 4) if present.any() else 0.0,
+        'map50_95': round(float(stats['ap'][present].mean()), 4) if present.any() else 0.0,
+        'best_conf': round(stats['best_conf'], 3),
+        'classes': per_class,
+        'pr_recall_points': PR_POINTS,
+        'confusion_matrix': {'labels': list(label_names) + ['background'], 'conf': matrix_conf,
+                             'iou': matrix_iou, 'matrix': matrix.tolist()},
+        'unknown_pred_labels': sorted(unknown),
+    }
+
+
+# ============ 评估任务 ============
+
+def _progress(**fields):
+    print(PROGRESS_PREFIX + json.dumps(fields), flush=True)
+
+
+def _predict_missing(model, batch, task_path, missing, cache_dir, spec, pool, on_batch):
+    """只为缓存未命中的图片推理；解码在线程池中与推理并行。"""
+    batches = [missing[i:i + batch] for i in range(0, len(missing), batch)]
+    decoded_next = [pool.submit(decode_image, os.path.join(task_path, n)) for n, _ in batches[0]] if batches else []
+    predictions = {}
+    for i, items in enumerate(batches):
+        images = [f.result() for f in decoded_next]
+        if i + 1 < len(batches):
+            decoded_next = [pool.submit(decode_image, os.path.join(task_path, n)) for n, _ in batches[i + 1]]
+        valid = [(item, img) for item, img in zip(items, images) if img is not None]
+        if valid:
+            results = model.predict([img for _, img in valid], imgsz=spec.get('imgsz', 640), conf=CACHE_CONF,
+                                    iou=spec.get('iou', 0.7), device='cpu', verbose=False)
+            for ((name, sha), img), result in zip(valid, results):
+                predictions[name] = save_prediction(cache_dir, sha, result, img.shape[1], img.shape[0])
+        on_batch(len(items))
+    return predictions
+
+
+def run(spec):
+    task_path = spec['task_path']
+    weights = pick_weights(spec['weights'], spec.get('prefer_onnx', True))
+    weights_sha = file_sha256(weights)
+    cache_dir = cache_dir_for(spec['cache_dir'], weights_sha, int(spec.get('imgsz', 640)), float(spec.get('iou', 0.7)))
+    with open(os.path.join(task_path, 'labels.json'), 'r', encoding='utf-8') as f:
+        label_names = [label['name'] for label in json.load(f)]
+
+    # 只评估已有标注文件的图片 (空 txt 表示无目标，同样参与评估)
+    images = [n for n in list_targets(task_path, overwrite=True)
+              if os.path.exists(os.path.join(task_path, os.path.splitext(n)[0] + '.txt'))]
+    total = len(images)
+    print(f"模型: {weights} ({weights_sha[:12]})，评估图片 {total} 张")
+    start = time.perf_counter()
+    workers = int(spec.get('workers') or min(8, os.cpu_count() or 2))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        hashes = dict(zip(images, pool.map(lambda n: file_sha256(os.path.join(task_path, n)), images)))
+        predictions = {}
+        missing = []
+        for name in images:
+            cached = load_prediction(cache_dir, hashes[name])
+            if cached is None:
+                missing.append((name, hashes[name]))
+            else:
+                predictions[name] = cached
+        print(f"预测缓存命中 {len(predictions)} 张，需要推理 {len(missing)} 张")
+        done = [len(predictions)]
+        _progress(phase='predict', done=done[0], total=total, cached=len(predictions))
+
+        if missing:
+            from ultralytics import YOLO
+            batch = max(1, int(spec.get('batch', 8)))
+            if weights.endswith('.onnx'):
+                batch = onnx_batch_size(weights, batch)
+            model = YOLO(weights)
+
+            def on_batch(n):
+                done[0] += n
+                elapsed = time.perf_counter() - start
+                _progress(phase='predict', done=done[0], total=total, cached=len(predictions),
+                          ips=round((done[0] - len(predictions)) / elapsed, 2) if elapsed else 0.0)
+
+            predictions.update(_predict_missing(model, batch, task_path, missing, cache_dir, spec, pool, on_batch))
+
+    scored_at = time.perf_counter()
+    report = score(task_path, images, predictions, label_names, float(spec.get('matrix_conf', 0.25)),
+                   float(spec.get('matrix_iou', 0.45)))
+    if report is None:
+        print("没有可评估的图片")
+        return 1
+    report.update({'weights': weights, 'weights_sha256': weights_sha, 'task_path': task_path,
+                   'inferred': len(missing), 'cached': total - len(missing),
+                   'score_seconds': round(time.perf_counter() - scored_at, 3),
+                   'seconds': round(time.perf_counter() - start, 2), 'created_at': time.time()})
+    atomic_write_text(spec['report_path'], json.dumps(report, ensure_ascii=False))
+    _progress(phase='done', done=total, total=total, cached=total - len(missing))
+    print(f"评估完成: mAP50 {report['map50']:.4f}，mAP50-95 {report['map50_95']:.4f}，"
+          f"P {report['precision']:.4f}，R {report['recall']:.4f} (打分用时 {report['score_seconds']}s)")
+    return 0
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        sys.exit(run(json.load(f)))
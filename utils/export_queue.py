@@ -0,0 +1,219 @@
+# export_queue.py
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Ultralytics model.export(format=...) 支持的格式
+EXPORT_FORMATS = (
+    'onnx', 'torchscript', 'openvino', 'engine', 'coreml', 'saved_model', 'pb', 'tflite', 'edgetpu', 'tfjs',
+    'paddle', 'mnn', 'ncnn', 'imx', 'rknn',
+)
+# 各格式额外接受的导出参数，其余参数不会传给该格式
+_FORMAT_OPTIONS = {
+    'onnx': ('opset', 'simplify', 'dynamic', 'half'),
+    'torchscript': ('optimize',),
+    'openvino': ('half', 'int8', 'dynamic'),
+    'engine': ('half', 'int8', 'dynamic', 'workspace'),
+    'ncnn': ('half',),
+}
+_COMMON_OPTIONS = ('imgsz', 'batch', 'device')
+_INT_OPTIONS = ('opset', 'imgsz', 'batch', 'workspace')
+_BOOL_OPTIONS = ('half', 'dynamic', 'simplify', 'int8', 'optimize')
+_TRUE, _FALSE = ('1', 'true', 'yes', 'on'), ('0', 'false', 'no', 'off')
+
+
+def parse_formats(value):
+    """'onnx, openvino' / ['onnx', 'ncnn'] -> 去重后的格式列表，遇到不支持的格式抛出 ValueError。"""
+    if isinstance(value, str):
+        value = value.split(',')
+    formats = []
+    for fmt in value or []:
+        fmt = str(fmt).strip().lower()
+        if not fmt or fmt in formats:
+            continue
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"不支持的导出格式: {fmt}")
+        formats.append(fmt)
+    return formats
+
+
+def parse_export_options(data):
+    """
+    从请求参数 (JSON 或表单，表单的值都是字符串) 中取出导出参数并转换类型：
+    opset / imgsz / batch / workspace 为正整数，half / dynamic / simplify / int8 / optimize 为布尔值
+    (表单中的 "false" 必须转成 False，否则作为非空字符串会被当成开启)。取值无效时抛出 ValueError。
+    """
+    options = {}
+    for key in _INT_OPTIONS:
+        value = data.get(key)
+        if value is None or value == '':
+            continue
+        if isinstance(value, bool):
+            raise ValueError(f"导出参数 {key} 必须是正整数")
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"导出参数 {key} 必须是正整数")
+        if number <= 0 or number != float(value):
+            raise ValueError(f"导出参数 {key} 必须是正整数")
+        options[key] = number
+    for key in _BOOL_OPTIONS:
+        value = data.get(key)
+        if value is None or value == '':
+            continue
+        if isinstance(value, bool):
+            options[key] = value
+        elif str(value).strip().lower() in _TRUE:
+            options[key] = True
+        elif str(value).strip().lower() in _FALSE:
+            options[key] = False
+        else:
+            raise ValueError(f"导出参数 {key} 必须是 true 或 false")
+    return options
+
+
+def _options_for(fmt, options):
+    allowed = _COMMON_OPTIONS + _FORMAT_OPTIONS.get(fmt, ())
+    return {k: v for k, v in (options or {}).items() if k in allowed and v is not None}
+
+
+def _path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+
+def _init_worker(threads):
+    """导出进程初始化：限制每个进程的计算线程数，多个导出并行时不互相抢核。"""
+    if threads:
+        os.environ['OMP_NUM_THREADS'] = str(threads)
+        os.environ['MKL_NUM_THREADS'] = str(threads)
+    os.environ['PYTHONUTF8'] = '1'
+
+
+def _export_one(weights, fmt, options):
+    """在常驻的导出进程中执行一次导出 (Ultralytics 只在该进程第一次导出时导入)。"""
+    from ultralytics import YOLO
+    start = time.perf_counter()
+    artifact = YOLO(weights).export(format=fmt, **options)
+    artifact = str(artifact)
+    return {'artifact': artifact, 'seconds': round(time.perf_counter() - start, 2),
+            'size_bytes': _path_size(artifact) if os.path.exists(artifact) else None}
+
+
+class ExportQueue:
+    """
+    模型导出队列：独立于训练调度器，训练结束后只把导出请求放入队列，不再占用训练槽位。
+    - 由常驻进程池执行 (spawn 方式启动)，不同格式并行导出，进程数和每个进程的线程数可配置。
+    - 每个 (权重, 格式) 一条记录，存入 JobStore 的 exports 表：产物路径、大小、耗时、失败原因。
+    - 同一权重的同一格式正在排队 / 导出时不会重复提交；服务重启后未完成的导出重新入队。
+    """
+
+    def __init__(self):
+        self.store = None
+        self.workers = max(1, (os.cpu_count() or 2) // 4)
+        self.threads_per_worker = None
+        self._executor = None
+        self._lock = threading.RLock()  # 已完成的 future 会在 add_done_callback 内同步回调
+        self._pending = {}  # (weights, format) -> export_id
+        self._futures = {}  # export_id -> Future
+
+    def configure(self, workers=None, threads_per_worker=None):
+        if workers:
+            self.workers = int(workers)
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.threads_per_worker = threads_per_worker
+
+    def set_store(self, store):
+        self.store = store
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker, initargs=(self.threads_per_worker,))
+        return self._executor
+
+    def submit(self, weights, formats, options=None, task_key=None, run_name=None):
+        """提交一个权重文件的多个格式导出，返回每个格式的导出记录。"""
+        exports = []
+        for fmt in formats:
+            with self._lock:
+                existing = self._pending.get((weights, fmt))
+                if existing:
+                    exports.append({'export_id': existing, 'format': fmt, 'state': 'queued', 'duplicate': True})
+                    continue
+                export = {
+                    'export_id': uuid.uuid4().hex[:12], 'task_key': task_key, 'run_name': run_name,
+                    'weights': weights, 'format': fmt, 'options': _options_for(fmt, options), 'state': 'queued',
+                    'created_at': time.time(),
+                }
+                if self.store:
+                    self.store.save_export(export)
+                self._dispatch(export)
+            exports.append(export)
+        return exports
+
+    def _dispatch(self, export):
+        """调用方需持有 self._lock。"""
+        try:
+            future = self._pool().submit(_export_one, export['weights'], export['format'], export['options'])
+        except BrokenProcessPool:
+            # 某个导出进程异常退出 (例如内存不足被杀) 后进程池不可再用，重建一个
+            self._executor = None
+            future = self._pool().submit(_export_one, export['weights'], export['format'], export['options'])
+        self._pending[(export['weights'], export['format'])] = export['export_id']
+        self._futures[export['export_id']] = future
+        future.add_done_callback(lambda f, e=export: self._on_done(e, f))
+
+    def _on_done(self, export, future):
+        with self._lock:
+            self._pending.pop((export['weights'], export['format']), None)
+            self._futures.pop(export['export_id'], None)
+        try:
+            result = future.result()
+            print(f"[导出] {export['format']} 完成 ({result['seconds']}s): {result['artifact']}")
+            if self.store:
+                self.store.set_export_state(export['export_id'], 'succeeded', **result)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                with self._lock:
+                    self._executor = None
+            print(f"[导出] {export['format']} 失败: {e}")
+            if self.store:
+                self.store.set_export_state(export['export_id'], 'failed', message=str(e))
+
+    def recover(self):
+        """服务启动时把上次未完成的导出重新放入进程池。"""
+        if not self.store:
+            return
+        for export in self.store.load_unfinished_exports():
+            with self._lock:
+                self._dispatch(export)
+
+    def state_of(self, export):
+        """数据库中的 queued 记录，若已被进程执行中则显示为 running。"""
+        future = self._futures.get(export['export_id'])
+        if future is not None and future.running():
+            return 'running'
+        return export['state']
+
+    def list_exports(self, task_key, run_name):
+        if not self.store:
+            return []
+        exports = self.store.exports_for_run(task_key, run_name)
+        for export in exports:
+            export['state'] = self.state_of(export)
+        return exports
@@ -0,0 +1,227 @@
+# job_store.py
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 未结束的状态：服务重启后需要恢复
+ACTIVE_STATES = ('queued', 'running')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    stream_id   TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    task_key    TEXT,
+    user        TEXT,
+    state       TEXT NOT NULL,
+    priority    INTEGER DEFAULT 0,
+    seq         REAL,
+    slot        TEXT,
+    pid         INTEGER,
+    pid_ctime   REAL,
+    log_offset  INTEGER DEFAULT 0,
+    payload     TEXT NOT NULL,
+    message     TEXT,
+    created_at  REAL,
+    updated_at  REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state);
+CREATE TABLE IF NOT EXISTS job_transitions (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    stream_id   TEXT NOT NULL,
+    state       TEXT NOT NULL,
+    message     TEXT,
+    ts          REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transitions_job ON job_transitions(stream_id);
+CREATE TABLE IF NOT EXISTS sweeps (
+    sweep_id    TEXT PRIMARY KEY,
+    task_key    TEXT,
+    user        TEXT,
+    config      TEXT NOT NULL,
+    created_at  REAL
+);
+CREATE TABLE IF NOT EXISTS exports (
+    export_id   TEXT PRIMARY KEY,
+    task_key    TEXT,
+    run_name    TEXT,
+    weights     TEXT NOT NULL,
+    format      TEXT NOT NULL,
+    options     TEXT,
+    state       TEXT NOT NULL,
+    artifact    TEXT,
+    size_bytes  INTEGER,
+    seconds     REAL,
+    message     TEXT,
+    created_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_exports_run ON exports(task_key, run_name);
+"""
+
+
+class JobStore:
+    """
+    训练任务的持久化存储 (独立的 SQLite 文件，调度线程里无需 Flask 应用上下文)。
+    记录任务参数、状态流转、子进程 PID 以及日志读取偏移，服务重启后据此恢复队列、重新接管运行中的进程。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def _payload(job):
+        return json.dumps(job, ensure_ascii=False, default=str)
+
+    def save(self, job, state):
+        """插入或覆盖一条任务记录，并记录一次状态流转。"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO jobs (stream_id, kind, task_key, user, state, priority, seq, payload, created_at,
+                                     updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(stream_id) DO UPDATE SET
+                       state=excluded.state, priority=excluded.priority, seq=excluded.seq,
+                       payload=excluded.payload, updated_at=excluded.updated_at""",
+                (job['stream_id'], job.get('kind', 'train'), job.get('task_key'), job.get('user'), state,
+                 job.get('priority', 0), job.get('submitted_at', now), self._payload(job), now, now))
+            self._conn.execute("INSERT INTO job_transitions (stream_id, state, ts) VALUES (?, ?, ?)",
+                               (job['stream_id'], state, now))
+
+    def set_state(self, stream_id, state, message=None, **fields):
+        """更新任务状态 (可同时更新 slot / pid / pid_ctime 等列)，并记录状态流转。"""
+        now = time.time()
+        columns = {'state': state, 'message': message, 'updated_at': now}
+        columns.update({k: v for k, v in fields.items() if k in ('slot', 'pid', 'pid_ctime', 'log_offset')})
+        assignments = ", ".join(f"{k}=?" for k in columns)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE stream_id=?", (*columns.values(), stream_id))
+            self._conn.execute("INSERT INTO job_transitions (stream_id, state, message, ts) VALUES (?, ?, ?, ?)",
+                               (stream_id, state, message, now))
+
+    def update(self, stream_id, **fields):
+        """更新运行时字段 (pid / pid_ctime / log_offset / priority / seq)，不产生状态流转记录。"""
+        columns = {k: v for k, v in fields.items() if k in ('pid', 'pid_ctime', 'log_offset', 'priority', 'seq')}
+        if not columns:
+            return
+        assignments = ", ".join(f"{k}=?" for k in columns)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE stream_id=?", (*columns.values(), stream_id))
+
+    def save_order(self, stream_ids):
+        """持久化排队顺序 (按列表顺序重新编号 seq)。"""
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE jobs SET seq=? WHERE stream_id=?",
+                                   [(i, sid) for i, sid in enumerate(stream_ids)])
+
+    def _row_to_job(self, row):
+        job = json.loads(row['payload'])
+        job.update({
+            'state': row['state'], 'priority': row['priority'], 'slot': row['slot'],
+            'pid': row['pid'], 'pid_ctime': row['pid_ctime'], 'log_offset': row['log_offset'] or 0,
+        })
+        return job
+
+    def get(self, stream_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE stream_id=?", (stream_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def load_unfinished(self):
+        """按排队顺序返回所有未结束 (queued / running) 的任务。"""
+        marks = ",".join("?" * len(ACTIVE_STATES))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT * FROM jobs WHERE state IN ({marks}) ORDER BY seq",
+                                      ACTIVE_STATES).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    # ---------- 超参搜索 ----------
+
+    def save_sweep(self, sweep_id, task_key, user, config):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sweeps (sweep_id, task_key, user, config, created_at) VALUES (?, ?, ?, ?, ?)",
+                (sweep_id, task_key, user, json.dumps(config, ensure_ascii=False), time.time()))
+
+    def get_sweep(self, sweep_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM sweeps WHERE sweep_id=?", (sweep_id,)).fetchone()
+        if not row:
+            return None
+        return {'sweep_id': row['sweep_id'], 'task_key': row['task_key'], 'user': row['user'],
+                'config': json.loads(row['config']), 'created_at': row['created_at']}
+
+    def list_sweeps(self, task_key):
+        with self._lock:
+            rows = self._conn.execute("SELECT sweep_id FROM sweeps WHERE task_key=? ORDER BY created_at DESC",
+                                      (task_key,)).fetchall()
+        return [self.get_sweep(r['sweep_id']) for r in rows]
+
+    def jobs_for_sweep(self, sweep_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE json_extract(payload, '$.sweep_id')=? ORDER BY seq", (sweep_id,)).fetchall()
+        return [self._row_to_job(r) for r in rows]
+
+    def find_run(self, task_key, base_name):
+        """按运行目录名查找产生它的任务 (断点续训后同一目录会有多条记录，返回最新的一条)。"""
+        with self._lock:
+            row = self._conn.execute(
+                """SELECT * FROM jobs WHERE task_key=? AND json_extract(payload, '$.base_name')=?
+                   ORDER BY created_at DESC LIMIT 1""", (task_key, base_name)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    # ---------- 模型导出 ----------
+
+    def save_export(self, export):
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT OR REPLACE INTO exports (export_id, task_key, run_name, weights, format, options, state,
+                                                   created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (export['export_id'], export.get('task_key'), export.get('run_name'), export['weights'],
+                 export['format'], json.dumps(export.get('options') or {}), export.get('state', 'queued'),
+                 export.get('created_at', time.time())))
+
+    def set_export_state(self, export_id, state, **fields):
+        """更新导出状态 (可同时更新 artifact / size_bytes / seconds / message)。"""
+        columns = {'state': state}
+        columns.update({k: v for k, v in fields.items() if k in ('artifact', 'size_bytes', 'seconds', 'message')})
+        if state not in ('queued', 'running'):
+            columns['finished_at'] = time.time()
+        assignments = ", ".join(f"{k}=?" for k in columns)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE exports SET {assignments} WHERE export_id=?", (*columns.values(), export_id))
+
+    @staticmethod
+    def _row_to_export(row):
+        export = dict(row)
+        export['options'] = json.loads(export['options'] or '{}')
+        return export
+
+    def exports_for_run(self, task_key, run_name):
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM exports WHERE task_key=? AND run_name=? ORDER BY created_at",
+                                      (task_key, run_name)).fetchall()
+        return [self._row_to_export(r) for r in rows]
+
+    def load_unfinished_exports(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM exports WHERE state IN ('queued', 'running') ORDER BY created_at").fetchall()
+        return [self._row_to_export(r) for r in rows]
+
+    def transitions(self, stream_id):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, message, ts FROM job_transitions WHERE stream_id=? ORDER BY id", (stream_id,)).fetchall()
+        return [dict(r) for r in rows]
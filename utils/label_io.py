@@ -0,0 +1,120 @@
+# label_io.py
+import math
+import os
+import re
+import stat
+import tempfile
+
+
+def natural_sort_key(s):
+    """
+    自然排序键值生成函数。
+    将字符串拆分为文本和数字列表，例如 'cam10.jpg' -> ['cam', 10, '.jpg']
+    这样比较时，数字部分会按数值大小比较，而不是按字符比较。
+    """
+    return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
+
+
+# 标注页面列出的图片类型
+TASK_IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.bmp', '.webp'}
+
+
+def list_task_images(task_path):
+    """任务目录下的图片文件名，按自然排序 (与标注页面的图片顺序一致)。"""
+    return sorted((f for f in os.listdir(task_path) if os.path.splitext(f)[1].lower() in TASK_IMAGE_EXTS),
+                  key=natural_sort_key)
+
+
+def normalize_points(points, width, height, type_str):
+    if width == 0 or height == 0: return []
+    normalized = []
+    try:
+        if type_str == 'rect':
+            cx, cy = (points['x'] + points['w'] / 2) / width, (points['y'] + points['h'] / 2) / height
+            nw, nh = points['w'] / width, points['h'] / height
+            normalized = [max(0, min(1, cx)), max(0, min(1, cy)), max(0, min(1, nw)), max(0, min(1, nh))]
+
+        elif type_str == 'obb':
+            # 【修复】保存为 YOLO OBB 标准的 4点坐标 (x1 y1 x2 y2 x3 y3 x4 y4)
+            # 这样可以兼容 ultralytics yolo11-obb 训练
+            cx, cy = points['x'], points['y']
+            w, h = points['w'], points['h']
+            rot = points['rotation']
+
+            # 计算四个角点
+            cos_a = math.cos(rot)
+            sin_a = math.sin(rot)
+
+            # 半宽和半高向量
+            wx, wy = (w / 2) * cos_a, (w / 2) * sin_a
+            hx, hy = - (h / 2) * sin_a, (h / 2) * cos_a
+
+            # p1: tl, p2: tr, p3: br, p4: bl (相对于旋转后的方向)
+            # 注意：这里计算出的是绝对像素坐标的偏移量
+            corners = [
+                (cx - wx - hx, cy - wy - hy),
+                (cx + wx - hx, cy + wy - hy),
+                (cx + wx + hx, cy + wy + hy),
+                (cx - wx + hx, cy - wy + hy)
+            ]
+
+            # 归一化并展平
+            for px, py in corners:
+                normalized.extend([
+                    max(0, min(1, px / width)),
+                    max(0, min(1, py / height))
+                ])
+
+        elif type_str == 'polygon':
+            for x, y in points:
+                normalized.extend([max(0, min(1, x / width)), max(0, min(1, y / height))])
+    except Exception as e:
+        print(f"Error normalizing points: {e}")
+        return []
+    return normalized
+
+
+def annotations_to_yolo_lines(annotations, label_to_index, width, height):
+    """前端格式的标注列表 -> YOLO txt 行 (未知标签、无法归一化的标注被跳过)。"""
+    yolo_strings = []
+    for ann in annotations:
+        if 'label' not in ann or ann['label'] not in label_to_index: continue
+        idx = label_to_index[ann['label']]
+
+        try:
+            pts = normalize_points(ann['points'], width, height, ann['type'])
+            if not pts: continue
+            # 格式化字符串，减少小数点位数节省空间
+            coord_str = " ".join([f"{p:.6f}" for p in pts])
+            yolo_strings.append(f"{idx} {coord_str}")
+        except Exception:
+            continue
+    return yolo_strings
+
+
+def atomic_write_text(path, text):
+    """
+    先写同目录下的临时文件再替换，写入中途崩溃 / 并发读取都不会看到半个文件。
+    mkstemp 创建的文件权限是 0600，替换前改成原文件的权限 (新文件为 0644)，避免标注文件变成只有属主可读。
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        mode = 0o644
+    fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def write_label_file(txt_path, yolo_lines):
+    atomic_write_text(txt_path, '\n'.join(yolo_lines))
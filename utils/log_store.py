@@ -0,0 +1,238 @@
+# log_store.py
+import json
+import os
+import shutil
+import threading
+from collections import deque
+from itertools import islice
+
+END_MARKER = "__END_OF_STREAM__"
+
+
+class LogBuffer:
+    """
+    单个任务的日志环形缓冲区。
+    - 每行日志带单调递增的序号 (seq 从 1 开始)，超出容量时自动丢弃最旧的行，已有行的序号不会变化。
+    - 读取方在条件变量上等待新日志，不需要轮询；断线重连时按上次收到的 seq 继续读取。
+    - 完整日志由 sink (SegmentedLog) 写入磁盘，内存中只保留最近的部分。
+    """
+
+    def __init__(self, maxlen=5000, sink=None):
+        self._entries = deque(maxlen=maxlen)  # (seq, line)
+        self._next_seq = 1
+        self._cond = threading.Condition()
+        self.closed = False
+        self.sink = sink  # 可选的 SegmentedLog，每行同时写入磁盘
+
+    def append(self, line, persist=True):
+        if persist and self.sink is not None:
+            try:
+                self.sink.append(line)
+            except Exception as e:
+                print(f"日志落盘失败: {e}")
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._entries.append((seq, line))
+            if END_MARKER in line:
+                self.closed = True
+            self._cond.notify_all()
+        return seq
+
+    @property
+    def last_seq(self):
+        with self._cond:
+            return self._next_seq - 1
+
+    def __len__(self):
+        with self._cond:
+            return len(self._entries)
+
+    def lines(self):
+        with self._cond:
+            return [line for _, line in self._entries]
+
+    def read_since(self, last_seq, timeout=None):
+        """
+        返回 seq 大于 last_seq 的日志 [(seq, line), ...]，没有新日志时最多等待 timeout 秒。
+        第二个返回值为被环形缓冲区丢弃、读取方已经无法拿到的行数 (正常情况下为 0)。
+        """
+        with self._cond:
+            if self._next_seq - 1 <= last_seq and not self.closed:
+                self._cond.wait_for(lambda: self._next_seq - 1 > last_seq or self.closed, timeout=timeout)
+            if not self._entries:
+                return [], 0
+            first_seq = self._entries[0][0]
+            dropped = max(0, first_seq - last_seq - 1)
+            start = max(0, last_seq + 1 - first_seq)
+            if start >= len(self._entries):
+                return [], dropped
+            entries = list(islice(self._entries, start, None))
+        return entries, dropped
+
+
+try:
+    import zstandard
+except ImportError:  # 未安装 zstandard 时使用标准库 gzip 压缩
+    zstandard = None
+
+
+def _open_compressed_read(path):
+    if path.endswith('.zst'):
+        import io
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True),
+                                encoding='utf-8', errors='replace')
+    import gzip
+    return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+
+
+def _compress_file(src):
+    """压缩一个已结束的分段，返回压缩后的文件名。"""
+    if zstandard is not None:
+        dst = src + '.zst'
+        with open(src, 'rb') as fin, open(dst + '.tmp', 'wb') as fout:
+            zstandard.ZstdCompressor(level=10).copy_stream(fin, fout)
+    else:
+        import gzip
+        dst = src + '.gz'
+        with open(src, 'rb') as fin, gzip.open(dst + '.tmp', 'wb', compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout, 1 << 20)
+    os.replace(dst + '.tmp', dst)
+    os.remove(src)
+    return os.path.basename(dst)
+
+
+class SegmentedLog:
+    """
+    任务日志的磁盘持久化 (追加写入、按行数分段轮转，已结束的分段压缩为 .zst / .gz)。
+    index.json 记录每个分段的起始行号和行数，按行号范围读取时只需解压涉及到的分段。
+
+    目录结构: <run_dir>/logs/index.json, segment_00000.log.zst, ..., segment_00012.log (当前分段)
+    """
+
+    def __init__(self, log_dir, segment_lines=20000):
+        self.log_dir = log_dir
+        self.segment_lines = segment_lines
+        self._lock = threading.Lock()
+        self._fp = None
+        os.makedirs(log_dir, exist_ok=True)
+        self._index_path = os.path.join(log_dir, 'index.json')
+        self._segments = self._load_index()
+        self._open_active()
+
+    # ---------- 索引 ----------
+
+    def _load_index(self):
+        if os.path.exists(self._index_path):
+            try:
+                with open(self._index_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception:
+                pass
+        return []
+
+    def _save_index(self):
+        tmp = self._index_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._segments, f)
+        os.replace(tmp, self._index_path)
+
+    def _open_active(self):
+        """打开 (或续写) 最后一个未压缩的分段，行数以文件实际内容为准。"""
+        if self._segments and not self._segments[-1]['compressed']:
+            seg = self._segments[-1]
+            path = os.path.join(self.log_dir, seg['file'])
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    seg['count'] = sum(1 for _ in f)
+            else:
+                seg['count'] = 0
+        else:
+            first = self._segments[-1]['first'] + self._segments[-1]['count'] if self._segments else 0
+            self._segments.append({'file': f"segment_{len(self._segments):05d}.log", 'first': first,
+                                   'count': 0, 'compressed': False})
+        self._fp = open(os.path.join(self.log_dir, self._segments[-1]['file']), 'a', encoding='utf-8',
+                        buffering=1)
+        self._save_index()
+
+    def _rotate(self, reopen=True):
+        seg = self._segments[-1]
+        self._fp.close()
+        self._fp = None
+        seg['file'] = _compress_file(os.path.join(self.log_dir, seg['file']))
+        seg['compressed'] = True
+        self._save_index()
+        if reopen:
+            self._open_active()
+
+    # ---------- 写入 ----------
+
+    @property
+    def total_lines(self):
+        with self._lock:
+            return self._segments[-1]['first'] + self._segments[-1]['count']
+
+    def append(self, line):
+        with self._lock:
+            if self._fp is None:
+                return
+            for part in str(line).split('\n'):
+                self._fp.write(part + '\n')
+                self._segments[-1]['count'] += 1
+                if self._segments[-1]['count'] >= self.segment_lines:
+                    self._rotate()
+
+    def close(self):
+        """任务结束：压缩最后一个分段，之后只读。"""
+        with self._lock:
+            if self._fp is None:
+                return
+            if self._segments[-1]['count']:
+                self._rotate(reopen=False)
+            else:
+                self._fp.close()
+                self._fp = None
+                os.remove(os.path.join(self.log_dir, self._segments[-1]['file']))
+                self._segments.pop()
+                self._save_index()
+
+    # ---------- 读取 ----------
+
+    def read_range(self, start, end):
+        """读取第 [start, end) 行 (从 0 开始)，只打开与范围有交集的分段。"""
+        with self._lock:
+            if self._fp is not None:
+                self._fp.flush()
+            segments = [dict(s) for s in self._segments]
+        return read_segments(self.log_dir, segments, start, end)
+
+    def tail(self, n):
+        total = self.total_lines
+        return self.read_range(max(0, total - n), total)
+
+
+def read_log_index(log_dir):
+    """读取一个 (可能已结束的) 任务日志目录的分段索引，不存在时返回空列表。"""
+    path = os.path.join(log_dir, 'index.json')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def read_segments(log_dir, segments, start, end):
+    lines = []
+    for seg in segments:
+        seg_start, seg_end = seg['first'], seg['first'] + seg['count']
+        if seg_end <= start or seg_start >= end:
+            continue
+        path = os.path.join(log_dir, seg['file'])
+        opener = _open_compressed_read if seg['compressed'] else (
+            lambda p: open(p, 'r', encoding='utf-8', errors='replace'))
+        with opener(path) as f:
+            for i, line in enumerate(f, seg_start):
+                if i >= end:
+                    break
+                if i >= start:
+                    lines.append(line.rstrip('\n'))
+    return lines
@@ -0,0 +1,187 @@
+# microbatch.py
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+
+class MicroBatcher:
+    """
+    把并发到达的单条请求合并成一批处理 (一次前向推理)。
+    submit(key, item) 阻塞到结果返回；只有 key 相同的请求才会被合并 (例如同一个模型、同样的推理参数)。
+    第一条请求到达后最多再等 max_wait_ms 收集同 key 的请求，凑满 max_batch 立即执行。
+    handler(key, items) 需返回与 items 等长、顺序一致的结果列表；抛出的异常会传给这一批的每个请求。
+    等待超时或被取消的请求不会再进入批次；排队数超过 max_queue 时新请求直接被拒绝 (QueueFull)。
+    background=True 的请求 (如预取) 只在没有普通请求排队、且距上一个普通请求到达超过 background_idle_ms 时执行，
+    每批只执行一个，这样普通请求最多等待一个后台请求的执行时间。
+    """
+
+    def __init__(self, handler, max_batch=8, max_wait_ms=5, max_queue=None, background_idle_ms=50,
+                 name='microbatch'):
+        self.handler = handler
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self.max_queue = max_queue
+        self._pending = []  # [(key, item, Future, 入队时间)]，按到达顺序
+        self._background = deque()  # 低优先级请求，格式同上
+        self.background_idle = background_idle_ms / 1000.0
+        self._last_interactive = 0.0
+        self._cond = threading.Condition()
+        self._stats = {'submitted': 0, 'batches': 0, 'items': 0, 'max_batch_seen': 0, 'timeouts': 0,
+                       'cancelled': 0, 'rejected': 0, 'errors': 0, 'background': 0, 'promoted': 0}
+        self._waits = deque(maxlen=1000)  # 最近请求的排队耗时 (ms)
+        self._latencies = deque(maxlen=1000)  # 最近请求从入队到完成的耗时 (ms)
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def configure(self, max_batch=None, max_wait_ms=None, max_queue=None):
+        if max_batch:
+            self.max_batch = max(1, int(max_batch))
+        if max_wait_ms is not None:
+            self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        if max_queue is not None:
+            self.max_queue = max_queue or None
+
+    def submit_async(self, key, item, background=False):
+        future = Future()
+        with self._cond:
+            queue = self._background if background else self._pending
+            if self.max_queue and len(queue) >= self.max_queue:
+                self._stats['rejected'] += 1
+                raise QueueFull(f"推理队列已满 ({len(queue)} 个请求排队中)")
+            queue.append((key, item, future, time.monotonic()))
+            if not background:
+                self._last_interactive = time.monotonic()
+            self._stats['submitted'] += 1
+            self._cond.notify()
+        return future
+
+    def touch(self):
+        """标记有交互操作正在进行 (即将提交普通请求)，推迟后台请求的执行。"""
+        with self._cond:
+            self._last_interactive = time.monotonic()
+
+    def promote(self, key, item):
+        """
+        把排队中的同 key、同 item 的后台请求转为普通请求 (保留原 Future，等待它的调用方照常拿到结果)，
+        用于交互请求需要的结果恰好正在后台排队的情况。返回是否找到了这样的请求。
+        """
+        with self._cond:
+            entries = [e for e in self._background if e[0] == key and e[1] == item and not e[2].cancelled()]
+            if not entries:
+                return False
+            for entry in entries:
+                self._background.remove(entry)
+                self._pending.append((key, item, entry[2], time.monotonic()))
+            self._last_interactive = time.monotonic()
+            self._stats['promoted'] += len(entries)
+            self._cond.notify()
+        return True
+
+    def submit(self, key, item, timeout=None, background=False):
+        """阻塞等待结果；超时后取消该请求 (还未执行时不会再进入批次) 并抛出 TimeoutError。"""
+        future = self.submit_async(key, item, background=background)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            future.cancel()  # 已在执行中的请求无法取消，结果被丢弃
+            with self._cond:
+                self._stats['timeouts'] += 1
+            raise TimeoutError(f"推理请求等待超过 {timeout} 秒")
+
+    def _take_batch(self):
+        """取出最早到达的请求及其后同 key 的请求 (调用时持有锁)。已取消的请求直接丢弃。"""
+        live = [e for e in self._pending if not e[2].cancelled()]
+        self._stats['cancelled'] += len(self._pending) - len(live)
+        key = live[0][0]
+        batch, rest = [], []
+        for entry in live:
+            if entry[0] == key and len(batch) < self.max_batch:
+                batch.append(entry)
+            else:
+                rest.append(entry)
+        self._pending = rest
+        return key, batch
+
+    def _next_background(self):
+        """
+        没有普通请求时取一个后台请求 (调用时持有锁)。
+        普通请求刚到达不久时先不取 (返回还需等待的秒数)：同一个交互操作往往紧接着还有后续请求 (先编码再解码)。
+        """
+        idle = time.monotonic() - self._last_interactive
+        if self._background and idle < self.background_idle:
+            return self.background_idle - idle
+        while self._background:
+            entry = self._background.popleft()
+            if not entry[2].cancelled():
+                self._stats['background'] += 1
+                return entry[0], [entry]
+            self._stats['cancelled'] += 1
+        return None
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not any(not e[2].cancelled() for e in self._pending):
+                    self._pending = []
+                    background = self._next_background()
+                    if isinstance(background, tuple):
+                        break
+                    self._cond.wait(background)
+                else:
+                    background = None
+                    # 以最早一条请求的到达时刻为起点等待凑批，凑满即走
+                    deadline = self._pending[0][3] + self.max_wait
+                    key = self._pending[0][0]
+                    while sum(1 for e in self._pending if e[0] == key) < self.max_batch:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                key, batch = background or self._take_batch()
+            batch = [e for e in batch if e[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.monotonic()
+            try:
+                results = self.handler(key, [item for _, item, _, _ in batch])
+                for (_, _, future, _), result in zip(batch, results):
+                    future.set_result(result)
+                failed = False
+            except BaseException as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                failed = True
+            finished = time.monotonic()
+            with self._cond:
+                self._stats['batches'] += 1
+                self._stats['items'] += len(batch)
+                self._stats['max_batch_seen'] = max(self._stats['max_batch_seen'], len(batch))
+                self._stats['errors'] += int(failed)
+                for _, _, _, enqueued in batch:
+                    self._waits.append((started - enqueued) * 1000)
+                    self._latencies.append((finished - enqueued) * 1000)
+
+    def metrics(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['queue_depth'] = sum(1 for e in self._pending if not e[2].cancelled())
+            stats['background_depth'] = len(self._background)
+            stats['avg_batch'] = round(stats['items'] / stats['batches'], 2) if stats['batches'] else None
+            waits, latencies = list(self._waits), list(self._latencies)
+        stats.update({'max_batch': self.max_batch, 'max_wait_ms': self.max_wait * 1000,
+                      'wait_ms_p50': _percentile(waits, 0.5), 'wait_ms_p95': _percentile(waits, 0.95),
+                      'latency_ms_p50': _percentile(latencies, 0.5), 'latency_ms_p95': _percentile(latencies, 0.95),
+                      'latency_ms_max': round(max(latencies), 1) if latencies else None})
+        return stats
@@ -0,0 +1,135 @@
+# model_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from utils.run_registry import file_sha256
+
+_MB = 1024 * 1024
+
+
+class ModelCache:
+    """
+    已加载推理模型的 LRU 缓存，按权重文件内容哈希寻址 (同一权重复制到多个运行目录也只加载一份)。
+    超过 max_models 个或估算内存超过 max_mem_mb 时淘汰最久未使用的模型；空闲超过 idle_seconds 的模型被释放。
+    模型内存按加载前后的进程 RSS 差估算，拿不到时按权重文件大小的 3 倍估算。
+    """
+
+    def __init__(self, loader, max_models=4, max_mem_mb=2048, idle_seconds=600):
+        self.loader = loader  # loader(weights_path) -> 任意模型对象
+        self.max_models = max_models
+        self.max_mem_mb = max_mem_mb
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()  # sha256 -> {'model', 'weights', 'mem_mb', 'last_used', 'hits'}
+        self._hashes = {}  # (path, size, mtime) -> sha256，避免每次请求都重新计算文件哈希
+        self._loading = {}  # sha256 -> Lock，同一个模型并发请求时只加载一次
+        self._lock = threading.Lock()
+        self._janitor = None
+
+    def configure(self, max_models=None, max_mem_mb=None, idle_seconds=None):
+        if max_models:
+            self.max_models = int(max_models)
+        if max_mem_mb is not None:
+            self.max_mem_mb = max_mem_mb
+        if idle_seconds is not None:
+            self.idle_seconds = idle_seconds
+
+    def start(self, interval=60):
+        """后台定期释放空闲模型。"""
+        if self._janitor is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.evict_idle()
+
+        self._janitor = threading.Thread(target=loop, daemon=True)
+        self._janitor.start()
+
+    def key_for(self, weights):
+        stat = os.stat(weights)
+        memo_key = (os.path.abspath(weights), stat.st_size, stat.st_mtime_ns)
+        sha = self._hashes.get(memo_key)
+        if sha is None:
+            sha = self._hashes[memo_key] = file_sha256(weights)
+        return sha
+
+    def get(self, weights):
+        """返回 (key, model)；未命中时在调用线程中加载。"""
+        key = self.key_for(weights)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry['last_used'] = time.time()
+                entry['hits'] += 1
+                self._entries.move_to_end(key)
+                return key, entry['model']
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                try:
+                    entry = self._load(key, weights)
+                except BaseException:
+                    with self._lock:
+                        self._loading.pop(key, None)
+                    raise
+            with self._lock:
+                self._loading.pop(key, None)
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                self._evict_over_budget()
+        return key, entry['model']
+
+    def _load(self, key, weights):
+        before = self._rss()
+        started = time.perf_counter()
+        model = self.loader(weights)
+        after = self._rss()
+        mem_mb = (after - before) / _MB if before and after and after > before else os.path.getsize(weights) * 3 / _MB
+        print(f"[模型缓存] 加载 {weights} ({key[:12]})，用时 {time.perf_counter() - started:.2f}s，约 {mem_mb:.0f} MB")
+        return {'model': model, 'weights': weights, 'mem_mb': round(mem_mb, 1), 'last_used': time.time(), 'hits': 0,
+                'loaded_at': time.time()}
+
+    @staticmethod
+    def _rss():
+        if psutil is None:
+            return None
+        try:
+            return psutil.Process().memory_info().rss
+        except Exception:
+            return None
+
+    def _evict_over_budget(self):
+        """调用时持有锁；最近加载的模型 (末尾) 总是保留。"""
+        while len(self._entries) > 1:
+            total_mb = sum(e['mem_mb'] for e in self._entries.values())
+            if len(self._entries) <= self.max_models and (not self.max_mem_mb or total_mb <= self.max_mem_mb):
+                break
+            key, entry = self._entries.popitem(last=False)
+            print(f"[模型缓存] 淘汰 {entry['weights']} ({key[:12]})")
+
+    def evict_idle(self):
+        if not self.idle_seconds:
+            return 0
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            idle = [k for k, e in self._entries.items() if e['last_used'] < cutoff]
+            for key in idle:
+                del self._entries[key]
+        if idle:
+            print(f"[模型缓存] 释放 {len(idle)} 个空闲模型")
+        return len(idle)
+
+    def stats(self):
+        with self._lock:
+            return [{'key': k[:12], 'weights': e['weights'], 'mem_mb': e['mem_mb'], 'hits': e['hits'],
+                     'idle_seconds': round(time.time() - e['last_used'], 1)} for k, e in self._entries.items()]
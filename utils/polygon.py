@@ -0,0 +1,187 @@
+# polygon.py
+"""
+多边形简化：Douglas-Peucker (按像素容差去掉近似共线的顶点) + Visvalingam (按顶点数上限去掉面积贡献最小的顶点)。
+用于压缩 SAM 输出的稠密多边形，也可作为后台任务批量简化任务中已保存的多边形标注
+(python -u polygon.py <spec.json>，由调度器以 kind='simplify' 的任务启动)。
+"""
+import heapq
+import json
+import os
+import sys
+import time
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from utils.batch_infer import PROGRESS_PREFIX
+
+# YOLO txt 中 4 个顶点 (8 个值) 的行会被读成旋转框 / 四边形，多边形简化后至少保留 5 个顶点
+MIN_POLYGON_VERTICES = 5
+
+
+def _segment_distances(points, start, end):
+    """points 中每个点到线段 start-end 的距离 (向量化)。"""
+    seg = end - start
+    length_sq = float(seg @ seg)
+    if length_sq == 0.0:
+        return np.hypot(*(points - start).T)
+    t = np.clip(((points - start) @ seg) / length_sq, 0.0, 1.0)
+    proj = start + t[:, None] * seg
+    return np.hypot(*(points - proj).T)
+
+
+def douglas_peucker(points, tolerance):
+    """开放折线的 Douglas-Peucker 简化 (显式栈，无递归)，返回保留顶点的布尔掩码。"""
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        dists = _segment_distances(points[first + 1:last], points[first], points[last])
+        index = int(dists.argmax())
+        if dists[index] > tolerance:
+            split = first + 1 + index
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+    return keep
+
+
+def visvalingam(points, max_vertices):
+    """闭合多边形的 Visvalingam-Whyatt 简化：反复去掉与相邻顶点组成三角形面积最小的顶点，直到不超过 max_vertices。"""
+    n = len(points)
+    if n <= max_vertices:
+        return points
+    prev_idx = np.roll(np.arange(n), 1)
+    next_idx = np.roll(np.arange(n), -1)
+    a, b, c = points[prev_idx], points, points[next_idx]
+    # 初始面积一次性向量化计算，之后只更新被删除顶点两侧的邻居
+    areas = np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])) / 2
+    prev_idx, next_idx = prev_idx.tolist(), next_idx.tolist()
+    heap = [(area, i) for i, area in enumerate(areas.tolist())]
+    heapq.heapify(heap)
+    current = areas.tolist()
+    removed = np.zeros(n, dtype=bool)
+    remaining = n
+
+    def area_of(i):
+        p, q, r = points[prev_idx[i]], points[i], points[next_idx[i]]
+        return abs((q[0] - p[0]) * (r[1] - p[1]) - (r[0] - p[0]) * (q[1] - p[1])) / 2
+
+    while remaining > max_vertices and heap:
+        area, i = heapq.heappop(heap)
+        if removed[i] or area != current[i]:
+            continue  # 过期的堆元素
+        removed[i] = True
+        remaining -= 1
+        p, r = prev_idx[i], next_idx[i]
+        next_idx[p], prev_idx[r] = r, p
+        for j in (p, r):
+            # 与 Visvalingam 原文一致：邻居的新面积不小于刚删除的面积，保证按重要性单调删除
+            current[j] = max(area_of(j), area)
+            heapq.heappush(heap, (current[j], j))
+    return points[~removed]
+
+
+def simplify_polygon(points, tolerance=1.0, max_vertices=None):
+    """
+    简化闭合多边形。points 为 [[x, y], ...] (像素坐标)；tolerance 为 Douglas-Peucker 的像素容差 (<= 0 时跳过)，
+    max_vertices 为顶点数上限 (None 不限制，小于 MIN_POLYGON_VERTICES 时按 MIN_POLYGON_VERTICES 处理)。
+    结果至少保留 MIN_POLYGON_VERTICES 个顶点；原多边形顶点数不超过它时原样返回。
+    """
+    pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(pts) <= MIN_POLYGON_VERTICES:
+        return pts.tolist()
+    if np.array_equal(pts[0], pts[-1]):
+        pts = pts[:-1]  # 去掉首尾重复的闭合点
+    if tolerance and tolerance > 0 and len(pts) > MIN_POLYGON_VERTICES:
+        # 闭合多边形以第一个点和离它最远的点为界拆成两段折线分别简化
+        far = int(np.hypot(*(pts - pts[0]).T).argmax())
+        if far > 0:
+            keep = np.zeros(len(pts), dtype=bool)
+            keep[:far + 1] = douglas_peucker(pts[:far + 1], tolerance)
+            tail = np.vstack([pts[far:], pts[:1]])
+            keep[far:] |= douglas_peucker(tail, tolerance)[:-1]
+            # 容差大到只剩不足 MIN_POLYGON_VERTICES 个点时，改为保留面积贡献最大的 MIN_POLYGON_VERTICES 个顶点，
+            # 保证容差越大简化程度不会反而越低
+            pts = pts[keep] if keep.sum() >= MIN_POLYGON_VERTICES else visvalingam(pts, MIN_POLYGON_VERTICES)
+    if max_vertices:
+        limit = max(MIN_POLYGON_VERTICES, int(max_vertices))
+        if len(pts) > limit:
+            pts = visvalingam(pts, limit)
+    return pts.tolist()
+
+
+# ============ 批量简化任务 ============
+
+def simplify_label_line(line, width, height, tolerance, max_vertices):
+    """
+    简化 YOLO txt 中的一行多边形标注 (归一化坐标，按图片像素尺寸换算容差)。
+    矩形 (4 个值) 和旋转框 / 四边形 (8 个值) 原样返回；简化结果不足 MIN_POLYGON_VERTICES 个顶点时也原样返回，
+    避免多边形被写成四边形。返回 (新行, 原顶点数, 新顶点数)。
+    """
+    parts = line.split()
+    values = parts[1:]
+    if len(values) <= 8 or len(values) % 2:
+        return line, 0, 0
+    coords = np.asarray(values, dtype=np.float64).reshape(-1, 2) * (width, height)
+    simplified = np.asarray(simplify_polygon(coords, tolerance, max_vertices)) / (width, height)
+    if len(simplified) < MIN_POLYGON_VERTICES:
+        return line, 0, 0
+    coord_str = " ".join(f"{v:.6f}" for v in np.clip(simplified, 0, 1).ravel())
+    return f"{parts[0]} {coord_str}", len(coords), len(simplified)
+
+
+def _progress(**fields):
+    print(PROGRESS_PREFIX + json.dumps(fields), flush=True)
+
+
+def run(spec):
+    from PIL import Image
+    from utils.label_io import list_task_images, atomic_write_text
+
+    task_path = spec['task_path']
+    tolerance = float(spec.get('tolerance', 1.0))
+    max_vertices = spec.get('max_vertices')
+    images = [n for n in list_task_images(task_path)
+              if os.path.exists(os.path.join(task_path, os.path.splitext(n)[0] + '.txt'))]
+    total = len(images)
+    print(f"共 {total} 个标注文件，容差 {tolerance}px，顶点上限 {max_vertices or '不限'}")
+    done = changed = before = after = 0
+    start = time.perf_counter()
+    _progress(done=0, total=total, changed=0, points_before=0, points_after=0)
+    for name in images:
+        txt_path = os.path.join(task_path, os.path.splitext(name)[0] + '.txt')
+        try:
+            with Image.open(os.path.join(task_path, name)) as img:
+                width, height = img.size
+            with open(txt_path, 'r', encoding='utf-8') as f:
+                lines = [line.strip() for line in f if line.strip()]
+            new_lines, file_before, file_after = [], 0, 0
+            for line in lines:
+                new_line, n_before, n_after = simplify_label_line(line, width, height, tolerance, max_vertices)
+                new_lines.append(new_line)
+                file_before += n_before
+                file_after += n_after
+            if file_after < file_before:
+                atomic_write_text(txt_path, '\n'.join(new_lines))
+                changed += 1
+            before += file_before
+            after += file_after
+        except Exception as e:
+            print(f"跳过 {name}: {e}")
+        done += 1
+        if done % 20 == 0 or done == total:
+            _progress(done=done, total=total, changed=changed, points_before=before, points_after=after)
+    print(f"简化完成: 修改 {changed} 个文件，多边形顶点 {before} -> {after}，用时 {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        sys.exit(run(json.load(f)))
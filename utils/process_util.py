@@ -0,0 +1,126 @@
+# process_util.py
+import os
+import re
+import subprocess
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+_LINE_SPLIT = re.compile(rb'\r\n|\r|\n')
+
+
+def popen_detached(cmd, stdout, env=None, cwd=None):
+    """
+    启动子进程并放入独立的进程组 / 会话。
+    这样 Web 服务重启 (包括 Ctrl+C) 时训练进程不会被一起带走，重启后可以重新接管。
+    """
+    kwargs = {}
+    if os.name == 'nt':
+        kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    return subprocess.Popen(cmd, stdout=stdout, stderr=subprocess.STDOUT, env=env, cwd=cwd, **kwargs)
+
+
+def process_create_time(pid):
+    if psutil is None or not pid:
+        return None
+    try:
+        return psutil.Process(pid).create_time()
+    except Exception:
+        return None
+
+
+def is_same_process_alive(pid, create_time):
+    """PID 存活且启动时间一致 (防止 PID 被系统复用后误接管其他进程)。"""
+    if psutil is None or not pid:
+        return False
+    try:
+        proc = psutil.Process(pid)
+        if create_time and abs(proc.create_time() - create_time) > 1.0:
+            return False
+        return proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE
+    except Exception:
+        return False
+
+
+class AttachedProcess:
+    """
+    重启后重新接管的训练进程 (不是本进程的子进程，拿不到管道和退出码)。
+    提供与 subprocess.Popen 一致的 pid / poll / wait / terminate / kill 接口，供 kill_task 等复用。
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.returncode = None
+        self._proc = psutil.Process(pid)
+
+    def poll(self):
+        if self.returncode is None and not self._proc.is_running():
+            self.returncode = -1
+        return self.returncode
+
+    def wait(self, timeout=None):
+        try:
+            self._proc.wait(timeout=timeout)
+        except psutil.TimeoutExpired:
+            raise subprocess.TimeoutExpired(str(self.pid), timeout)
+        except psutil.NoSuchProcess:
+            pass
+        self.returncode = -1
+        return self.returncode
+
+    def terminate(self):
+        try:
+            self._proc.terminate()
+        except psutil.NoSuchProcess:
+            pass
+
+    def kill(self):
+        try:
+            self._proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
+def follow_log(path, offset, is_running, on_offset=None, poll_interval=0.2):
+    """
+    持续读取子进程写入的日志文件，逐行产出 (以 \\r / \\n / \\r\\n 分行，与管道 universal_newlines 行为一致)。
+    只在完整的一行读到后才推进 offset，进程结束后读完剩余内容即返回。
+    :param offset: 起始字节偏移 (用于重启后断点续读)
+    :param is_running: 无参函数，子进程仍在运行时返回 True
+    :param on_offset: 每产出一行后回调当前已消费的字节偏移
+    """
+    pending = b''
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(65536)
+            if not chunk:
+                if not is_running():
+                    # 进程已退出，再读一次避免漏掉最后写入的内容
+                    chunk = f.read()
+                    if not chunk:
+                        if pending:
+                            yield pending.decode('utf-8', errors='replace')
+                            offset += len(pending)
+                            if on_offset: on_offset(offset)
+                        return
+                else:
+                    time.sleep(poll_interval)
+                    continue
+            pending += chunk
+            pos = 0
+            for m in _LINE_SPLIT.finditer(pending):
+                # 末尾单独的 \r 可能是 \r\n 的前半部分，等下一块数据再处理
+                if m.end() == len(pending) and m.group() == b'\r':
+                    break
+                line = pending[pos:m.start()]
+                pos = m.end()
+                offset += len(line) + len(m.group())
+                yield line.decode('utf-8', errors='replace')
+                if on_offset: on_offset(offset)
+            pending = pending[pos:]
@@ -0,0 +1,187 @@
+# resource_monitor.py
+import threading
+import time
+from collections import OrderedDict, deque
+
+try:
+    import psutil
+except ImportError:  # 没有 psutil 时监控不可用，调度器的内存准入检查也随之关闭
+    psutil = None
+
+_MB = 1024 * 1024
+
+
+class ResourceMonitor:
+    """
+    训练任务资源采样器。
+    按固定间隔采样每个运行中任务的整棵进程树 (训练进程及其 dataloader 子进程)：CPU%、RSS、线程数、磁盘读写，
+    每个任务保存一段定长的时间序列；同时记录整机的内存 / CPU 使用情况，供调度器判断内存余量。
+    """
+
+    def __init__(self, interval=2.0, history=1800, keep_finished=50):
+        self.interval = interval
+        self.history_len = history
+        self.keep_finished = keep_finished
+        self._series = OrderedDict()  # stream_id -> deque[sample]
+        self._procs = {}  # pid -> psutil.Process (保留对象，cpu_percent 才能计算两次采样间的增量)
+        self._io_last = {}  # stream_id -> (ts, read_bytes, write_bytes)
+        self._system = {}
+        self._lock = threading.Lock()
+        self._source = None
+        self._thread = None
+
+    @property
+    def available(self):
+        return psutil is not None
+
+    def configure(self, interval=None, history=None):
+        if interval:
+            self.interval = float(interval)
+        if history:
+            self.history_len = int(history)
+
+    def start(self, source):
+        """source: 无参函数，返回 {stream_id: pid}。"""
+        self._source = source
+        if psutil is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.sample_once()
+            except Exception as e:
+                print(f"[资源监控] 采样失败: {e}")
+            time.sleep(self.interval)
+
+    # ---------- 采样 ----------
+
+    def _proc(self, pid):
+        proc = self._procs.get(pid)
+        if proc is None:
+            proc = self._procs[pid] = psutil.Process(pid)
+            proc.cpu_percent(None)  # 第一次调用只建立基准
+        return proc
+
+    def _sample_tree(self, stream_id, pid, now):
+        try:
+            root = self._proc(pid)
+            tree = [root] + [self._proc(c.pid) for c in root.children(recursive=True)]
+        except psutil.NoSuchProcess:
+            return None
+        cpu = rss = threads = read_bytes = write_bytes = 0
+        alive = 0
+        for proc in tree:
+            try:
+                with proc.oneshot():
+                    cpu += proc.cpu_percent(None)
+                    rss += proc.memory_info().rss
+                    threads += proc.num_threads()
+                    try:
+                        io = proc.io_counters()
+                        read_bytes += io.read_bytes
+                        write_bytes += io.write_bytes
+                    except (AttributeError, psutil.AccessDenied):
+                        pass  # macOS 等平台没有进程级 IO 计数
+                alive += 1
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                continue
+        last = self._io_last.get(stream_id)
+        self._io_last[stream_id] = (now, read_bytes, write_bytes)
+        elapsed = now - last[0] if last else 0
+        return {
+            'ts': round(now, 2),
+            'cpu_percent': round(cpu, 1),
+            'rss_mb': round(rss / _MB, 1),
+            'threads': threads,
+            'processes': alive,
+            'read_mb': round(read_bytes / _MB, 1),
+            'write_mb': round(write_bytes / _MB, 1),
+            # 子进程退出会让累计值变小，速率按 0 处理
+            'read_mb_s': round(max(0, read_bytes - last[1]) / _MB / elapsed, 2) if elapsed else 0.0,
+            'write_mb_s': round(max(0, write_bytes - last[2]) / _MB / elapsed, 2) if elapsed else 0.0,
+        }
+
+    def sample_once(self):
+        if psutil is None:
+            return
+        now = time.time()
+        targets = dict(self._source() if self._source else {})
+        samples = {sid: self._sample_tree(sid, pid, now) for sid, pid in targets.items() if pid}
+        vm = psutil.virtual_memory()
+        system = {
+            'ts': round(now, 2),
+            'cpu_percent': psutil.cpu_percent(None),
+            'mem_total_mb': round(vm.total / _MB),
+            'mem_available_mb': round(vm.available / _MB),
+            'mem_percent': vm.percent,
+            'swap_used_mb': round(psutil.swap_memory().used / _MB),
+        }
+        live_pids = set()
+        with self._lock:
+            self._system = system
+            for sid, sample in samples.items():
+                if sample is None:
+                    continue
+                series = self._series.get(sid)
+                if series is None:
+                    series = self._series[sid] = deque(maxlen=self.history_len)
+                series.append(sample)
+                self._series.move_to_end(sid)
+            # 已结束任务的历史保留最近 keep_finished 个
+            finished = [sid for sid in self._series if sid not in targets]
+            for sid in finished[:max(0, len(finished) - self.keep_finished)]:
+                del self._series[sid]
+                self._io_last.pop(sid, None)
+        for pid, proc in list(self._procs.items()):
+            try:
+                if proc.is_running():
+                    live_pids.add(pid)
+            except psutil.NoSuchProcess:
+                pass
+        self._procs = {pid: p for pid, p in self._procs.items() if pid in live_pids}
+
+    # ---------- 查询 ----------
+
+    def history(self, stream_id, since=None):
+        with self._lock:
+            series = self._series.get(stream_id) or ()
+            return [s for s in series if since is None or s['ts'] > since]
+
+    def latest(self, stream_id):
+        with self._lock:
+            series = self._series.get(stream_id)
+            return dict(series[-1]) if series else None
+
+    def peak(self, stream_id, key='rss_mb'):
+        with self._lock:
+            series = self._series.get(stream_id) or ()
+            return max((s[key] for s in series), default=None)
+
+    def system(self):
+        with self._lock:
+            return dict(self._system)
+
+    def memory_admission(self, job, running, reserve_mb=1024, default_job_mb=0):
+        """
+        调度器准入检查：估算启动该任务后的剩余内存，低于 reserve_mb 时返回暂缓原因。
+        running: [(stream_id, 预计内存 mb)]，刚启动、内存还没涨上来的任务按 “预计 - 当前 RSS” 预留。
+        没有任何任务在运行时总是放行，避免因为其他程序占用内存而让队列永远卡住。
+        """
+        if psutil is None or not running:
+            return None
+        system = self.system()
+        available = system.get('mem_available_mb')
+        if available is None:
+            return None
+        pending = 0
+        for stream_id, expected_mb in running:
+            current = self.latest(stream_id)
+            pending += max(0, (expected_mb or 0) - (current['rss_mb'] if current else 0))
+        need = job.get('mem_mb') or default_job_mb
+        headroom = available - pending - need
+        if headroom < reserve_mb:
+            return f"内存余量不足 (可用 {available} MB，运行中任务预留 {int(pending)} MB，本任务需要 {need} MB)"
+        return None
@@ -0,0 +1,297 @@
+# run_registry.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import yaml
+
+from utils.train_metrics import read_results
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id      TEXT PRIMARY KEY,
+    task_key    TEXT NOT NULL,
+    run_name    TEXT NOT NULL,
+    stream_id   TEXT,
+    user        TEXT,
+    base_model  TEXT,
+    state       TEXT,
+    params      TEXT,
+    epochs      INTEGER,
+    epochs_done INTEGER,
+    best_epoch  INTEGER,
+    precision   REAL,
+    recall      REAL,
+    map50       REAL,
+    map50_95    REAL,
+    fitness     REAL,
+    metrics     TEXT,
+    weights     TEXT,
+    created_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_task ON runs(task_key, created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_map50_95 ON runs(map50_95);
+CREATE INDEX IF NOT EXISTS idx_runs_map50 ON runs(map50);
+CREATE INDEX IF NOT EXISTS idx_runs_fitness ON runs(fitness);
+CREATE INDEX IF NOT EXISTS idx_runs_model ON runs(base_model);
+"""
+
+# 允许排序 / 过滤的列 (防止把请求参数直接拼进 SQL)
+SORT_COLUMNS = ('created_at', 'finished_at', 'map50_95', 'map50', 'precision', 'recall', 'fitness', 'epochs_done')
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _fitness(row):
+    """与 Ultralytics 选择 best.pt 的方式一致：0.1 * mAP50 + 0.9 * mAP50-95。"""
+    if row.get('map50') is None or row.get('map50_95') is None:
+        return None
+    return 0.1 * row['map50'] + 0.9 * row['map50_95']
+
+
+def _read_run_args(run_path):
+    """Ultralytics 写在运行目录下的 args.yaml (没有任务记录的历史运行用它补全训练参数)。"""
+    path = os.path.join(run_path, 'args.yaml')
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            args = yaml.safe_load(f) or {}
+    except Exception:
+        return {}
+    params = {k: args[k] for k in ('epochs', 'imgsz', 'batch', 'device') if k in args}
+    if args.get('model'):
+        params['model'] = os.path.basename(str(args['model']))
+    return params
+
+
+def summarize_run(run_path):
+    """读取一个运行目录的 results.csv 和权重文件，汇总最佳 epoch 指标及权重哈希 / 大小。"""
+    if not os.path.isdir(run_path):
+        return {'epochs_done': 0, 'best_epoch': None, 'precision': None, 'recall': None, 'map50': None,
+                'map50_95': None, 'fitness': None, 'metrics': {}, 'weights': {}, 'args': {}}
+    epochs = read_results(run_path)['epochs']
+    best = max(epochs, key=lambda e: _fitness(e) if _fitness(e) is not None else float('-inf'), default=None)
+    weights = {}
+    for name in ('best.pt', 'last.pt'):
+        path = os.path.join(run_path, 'weights', name)
+        if os.path.exists(path):
+            weights[name] = {'path': path, 'size_bytes': os.path.getsize(path), 'sha256': file_sha256(path)}
+    return {
+        'epochs_done': len(epochs),
+        'best_epoch': best['epoch'] if best else None,
+        'precision': best.get('precision') if best else None,
+        'recall': best.get('recall') if best else None,
+        'map50': best.get('map50') if best else None,
+        'map50_95': best.get('map50_95') if best else None,
+        'fitness': _fitness(best) if best else None,
+        'metrics': best or {},
+        'weights': weights,
+        'args': _read_run_args(run_path),
+    }
+
+
+class RunRegistry:
+    """
+    训练运行的注册表 (与 JobStore 共用 jobs.db)。
+    任务结束时写入一条记录：基础模型、训练参数、最佳 epoch 指标、权重哈希和大小；导出产物来自 exports 表。
+    列表、按指标过滤排序、跨任务对比都是索引查询，不再遍历 runs 目录。
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    @staticmethod
+    def run_id(task_key, run_name):
+        return f"{task_key}/{run_name}"
+
+    # ---------- 写入 ----------
+
+    def record_start(self, job):
+        """任务开始运行时登记 (续训时沿用同一条记录)。"""
+        run_id = self.run_id(job['task_key'], job['base_name'])
+        params = job.get('params', {})
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO runs (run_id, task_key, run_name, stream_id, user, base_model, state, params, epochs,
+                                     created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, 'running', ?, ?, ?)
+                   ON CONFLICT(run_id) DO UPDATE SET
+                       stream_id=excluded.stream_id, state='running', finished_at=NULL""",
+                (run_id, job['task_key'], job['base_name'], job['stream_id'], job.get('user'), params.get('model'),
+                 json.dumps(params, ensure_ascii=False, default=str), params.get('epochs'), time.time()))
+
+    def record_finish(self, task_key, run_name, run_path, state, job=None):
+        """任务结束 (成功 / 失败 / 取消 / 早停) 时汇总指标和权重，写入注册表。"""
+        summary = summarize_run(run_path)
+        params = (job or {}).get('params') or summary['args']
+        created_at = os.path.getmtime(run_path) if os.path.isdir(run_path) else time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """INSERT INTO runs (run_id, task_key, run_name, stream_id, user, base_model, state, params, epochs,
+                                     epochs_done, best_epoch, precision, recall, map50, map50_95, fitness, metrics,
+                                     weights, created_at, finished_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(run_id) DO UPDATE SET
+                       state=excluded.state, epochs_done=excluded.epochs_done, best_epoch=excluded.best_epoch,
+                       precision=excluded.precision, recall=excluded.recall, map50=excluded.map50,
+                       map50_95=excluded.map50_95, fitness=excluded.fitness, metrics=excluded.metrics,
+                       weights=excluded.weights, finished_at=excluded.finished_at""",
+                (self.run_id(task_key, run_name), task_key, run_name, (job or {}).get('stream_id'),
+                 (job or {}).get('user'), params.get('model'), state,
+                 json.dumps(params, ensure_ascii=False, default=str), params.get('epochs'),
+                 summary['epochs_done'], summary['best_epoch'], summary['precision'], summary['recall'],
+                 summary['map50'], summary['map50_95'], summary['fitness'],
+                 json.dumps(summary['metrics']), json.dumps(summary['weights']), created_at, time.time()))
+
+    def backfill(self, data_dir):
+        """
+        与磁盘同步一次 (服务启动时在后台执行)：补登记注册表建立之前就存在的运行目录，
+        并删除运行目录已被删除的记录。
+        """
+        with self._lock:
+            known = {r['run_id']: r['state'] for r in self._conn.execute("SELECT run_id, state FROM runs")}
+        seen, count = set(), 0
+        for owner in os.listdir(data_dir) if os.path.isdir(data_dir) else []:
+            owner_dir = os.path.join(data_dir, owner)
+            if not os.path.isdir(owner_dir):
+                continue
+            for task_name in os.listdir(owner_dir):
+                runs_dir = os.path.join(owner_dir, task_name, 'runs')
+                if os.path.isdir(runs_dir):
+                    count += self._import_runs(f"{owner}/{task_name}", runs_dir, known, seen)
+        gone = [run_id for run_id, state in known.items() if run_id not in seen and state != 'running']
+        if gone:
+            with self._lock, self._conn:
+                self._conn.executemany("DELETE FROM runs WHERE run_id=?", [(run_id,) for run_id in gone])
+        if count or gone:
+            print(f"[注册表] 补登记 {count} 个历史运行，移除 {len(gone)} 个已删除的运行")
+        return count
+
+    def backfill_task(self, task_key, runs_dir):
+        """
+        同步补登记一个任务的运行目录：启动时的后台 backfill 还没扫到该任务时，由运行列表接口调用，
+        避免列表在补登记完成前显示为空。返回新登记的运行数。
+        """
+        if not os.path.isdir(runs_dir):
+            return 0
+        with self._lock:
+            known = {self.run_id(task_key, r['run_name'])
+                     for r in self._conn.execute("SELECT run_name FROM runs WHERE task_key=?", (task_key,))}
+        return self._import_runs(task_key, runs_dir, known, set())
+
+    def _import_runs(self, task_key, runs_dir, known, seen):
+        """登记 runs_dir 下不在 known 中的运行目录 (state='imported')，目录对应的 run_id 加入 seen。返回登记数。"""
+        count = 0
+        for run_name in os.listdir(runs_dir):
+            run_path = os.path.join(runs_dir, run_name)
+            if not os.path.isdir(run_path):
+                continue
+            run_id = self.run_id(task_key, run_name)
+            seen.add(run_id)
+            if run_id in known:
+                continue
+            try:
+                self.record_finish(task_key, run_name, run_path, 'imported')
+                count += 1
+            except Exception as e:
+                print(f"[注册表] 登记 {run_id} 失败: {e}")
+        return count
+
+    # ---------- 查询 ----------
+
+    def _row_to_run(self, row):
+        run = dict(row)
+        for key in ('params', 'metrics', 'weights'):
+            run[key] = json.loads(run[key]) if run.get(key) else {}
+        return run
+
+    def _attach_exports(self, runs):
+        """一次查询带出所有运行的导出产物 (exports 表由 JobStore 维护，可能还不存在)。"""
+        if not runs:
+            return runs
+        keys = {(r['task_key'], r['run_name']) for r in runs}
+        marks = " OR ".join("(task_key=? AND run_name=?)" for _ in keys)
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"""SELECT task_key, run_name, format, state, artifact, size_bytes, seconds FROM exports
+                        WHERE {marks} ORDER BY created_at""", [v for k in keys for v in k]).fetchall()
+        except sqlite3.OperationalError:
+            rows = []
+        grouped = {}
+        for row in rows:
+            grouped.setdefault((row['task_key'], row['run_name']), []).append(
+                {k: row[k] for k in ('format', 'state', 'artifact', 'size_bytes', 'seconds')})
+        for run in runs:
+            run['exports'] = grouped.get((run['task_key'], run['run_name']), [])
+        return runs
+
+    def query(self, task_keys=None, state=None, base_model=None, min_metric=None, sort='created_at', order='desc',
+              limit=100, offset=0):
+        """
+        按条件查询运行记录。
+        :param task_keys: 限定任务 (列表)，None 表示不限
+        :param min_metric: {'map50_95': 0.5} 形式的指标下限
+        :param sort: SORT_COLUMNS 中的列名；为空值 (NULL) 的记录总是排在最后
+        """
+        where, args = [], []
+        if task_keys is not None:
+            if not task_keys:
+                return []
+            where.append(f"task_key IN ({','.join('?' * len(task_keys))})")
+            args.extend(task_keys)
+        if state:
+            where.append("state=?")
+            args.append(state)
+        if base_model:
+            where.append("base_model=?")
+            args.append(base_model)
+        for column, value in (min_metric or {}).items():
+            if column in SORT_COLUMNS:
+                where.append(f"{column}>=?")
+                args.append(value)
+        sort = sort if sort in SORT_COLUMNS else 'created_at'
+        direction = 'ASC' if str(order).lower() == 'asc' else 'DESC'
+        sql = "SELECT * FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {sort} IS NULL, {sort} {direction} LIMIT ? OFFSET ?"
+        with self._lock:
+            rows = self._conn.execute(sql, (*args, int(limit), int(offset))).fetchall()
+        return self._attach_exports([self._row_to_run(r) for r in rows])
+
+    def get_many(self, run_ids):
+        if not run_ids:
+            return []
+        with self._lock:
+            rows = self._conn.execute(f"SELECT * FROM runs WHERE run_id IN ({','.join('?' * len(run_ids))})",
+                                      list(run_ids)).fetchall()
+        by_id = {r['run_id']: self._row_to_run(r) for r in rows}
+        return self._attach_exports([by_id[i] for i in run_ids if i in by_id])
+
+    def has_task(self, task_key):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM runs WHERE task_key=? LIMIT 1", (task_key,)).fetchone() is not None
+
+    def task_keys(self):
+        with self._lock:
+            return [r['task_key'] for r in self._conn.execute("SELECT DISTINCT task_key FROM runs").fetchall()]
+
@@ -0,0 +1,103 @@
+# sam_annotate.py
+"""
+整任务的 SAM 文本提示自动标注：对任务中的每张图片 (或指定的部分图片) 运行 predict_text，结果写成 YOLO 多边形标注。
+与逐张调用 /api/sam/auto_annotate 相比，图片按批提交到推理队列，由队列合并成批量编码 / 解码。
+SAM 引擎常驻 Web 进程，因此该任务在调度器线程中运行，而不是像 batch_infer.py 那样启动子进程。
+"""
+import json
+import os
+import time
+
+from PIL import Image
+
+from utils.batch_infer import list_targets
+from utils.label_io import annotations_to_yolo_lines, write_label_file, atomic_write_text
+from utils.polygon import simplify_polygon
+
+
+def ensure_labels(task_path, prompt_config):
+    """把提示配置中 labels.json 还没有的标签追加进去 (保持已有标签的顺序，即类别编号不变)，返回 标签名 -> 类别编号。"""
+    labels_path = os.path.join(task_path, 'labels.json')
+    labels = []
+    if os.path.exists(labels_path):
+        with open(labels_path, 'r', encoding='utf-8') as f:
+            labels = json.load(f)
+    known = {label['name'] for label in labels}
+    added = False
+    for cfg in prompt_config:
+        if cfg['label'] not in known:
+            labels.append({'name': cfg['label'], 'color': cfg.get('color')})
+            known.add(cfg['label'])
+            added = True
+    if added:
+        atomic_write_text(labels_path, json.dumps(labels, ensure_ascii=False, indent=2))
+    return {label['name']: i for i, label in enumerate(labels)}
+
+
+def results_to_annotations(results, prompt_by_text, tolerance=0, max_vertices=None):
+    """predict_text 的结果 -> 前端格式的多边形标注 (按提示文本查表得到标签和颜色，未知文本忽略)。"""
+    annotations = []
+    for res in results:
+        cfg = prompt_by_text.get(res['label_text'])
+        if cfg:
+            annotations.append({'type': 'polygon', 'label': cfg['label'], 'color': cfg.get('color'),
+                                'points': simplify_polygon(res['points'], tolerance, max_vertices)})
+    return annotations
+
+
+def run(engine, spec, report=print, progress=None, should_stop=None):
+    """
+    spec: task_path / prompt_config ([{text, label, color}]) / conf / overwrite / images / batch /
+          tolerance / max_vertices / write_empty (没有检测到目标的图片也写入空标注文件，默认跳过，不覆盖已有标注)。
+    report(line) 输出日志，progress(dict) 上报进度，should_stop() 返回 True 时在当前批次结束后停止。
+    返回 (是否处理完全部图片, 最后一次进度)。
+    """
+    task_path = spec['task_path']
+    prompt_config = spec['prompt_config']
+    prompt_by_text = {cfg['text']: cfg for cfg in prompt_config}
+    texts = list(prompt_by_text)
+    label_to_index = ensure_labels(task_path, prompt_config)
+    batch = max(1, int(spec.get('batch', 8)))
+    conf = float(spec.get('conf', 0.25))
+
+    targets = list_targets(task_path, spec.get('overwrite', False), spec.get('images'))
+    total = len(targets)
+    report(f"共 {total} 张图片需要自动标注" + ("" if spec.get('overwrite') else " (已有标注的图片已跳过)")
+           + f"，提示词: {', '.join(texts)}")
+    state = {'done': 0, 'total': total, 'written': 0, 'empty': 0, 'failed': 0, 'objects': 0, 'ips': 0.0}
+    progress = progress or (lambda fields: None)
+    progress(dict(state))
+    start = time.perf_counter()
+
+    for offset in range(0, total, batch):
+        if should_stop and should_stop():
+            return False, state
+        names = targets[offset:offset + batch]
+        paths = [os.path.join(task_path, name) for name in names]
+        for name, path, results in zip(names, paths, engine.predict_text_many(paths, texts, conf_thres=conf)):
+            try:
+                if isinstance(results, Exception):
+                    raise results
+                with Image.open(path) as img:
+                    width, height = img.size
+                annotations = results_to_annotations(results, prompt_by_text, spec.get('tolerance') or 0,
+                                                     spec.get('max_vertices'))
+                lines = annotations_to_yolo_lines(annotations, label_to_index, width, height)
+                if not lines and not spec.get('write_empty'):
+                    state['empty'] += 1
+                    continue
+                write_label_file(os.path.join(task_path, os.path.splitext(name)[0] + '.txt'), lines)
+                state['written'] += 1
+                state['objects'] += len(lines)
+            except Exception as e:
+                state['failed'] += 1
+                report(f"跳过 {name}: {e}")
+        state['done'] += len(names)
+        elapsed = time.perf_counter() - start
+        state['ips'] = round(state['done'] / elapsed, 2) if elapsed else 0.0
+        progress(dict(state))
+
+    report(f"自动标注完成: 写入 {state['written']} 张 ({state['objects']} 个目标)，"
+           f"未检测到目标 {state['empty']} 张，失败 {state['failed']} 张，"
+           f"用时 {time.perf_counter() - start:.1f}s")
+    return True, state
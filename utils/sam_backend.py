@@ -0,0 +1,267 @@
+# sam_backend.py
+"""
+SAM 推理后端接口：把“图片编码”(重，每张图一次) 和“提示解码”(轻，每次点击 / 修改提示一次) 分开。
+SAM3Engine 把编码结果 (ImageState) 放进按字节数限制的 LRU 缓存，同一张图上的反复点击只付出解码的开销。
+
+后端需要实现:
+    encode(image_path) -> ImageState
+    decode(state, prompts, conf_thres, sam_mode) -> [{'points': [[x, y], ...], 'score': float}]
+    decode_text(state, texts, conf_thres) -> [{'label_text': str, 'points': [...], 'score': float}]
+可选实现 (默认实现逐个调用上面的方法，支持批量推理的后端应覆盖):
+    decode_batch(state, prompt_sets, ...)  一次前向解码同一张图上的多组提示 (例如每个标签一组)
+    encode_many(image_paths)               跨请求批量编码多张图片
+    decode_requests(requests)              跨请求批量解码，每个请求为 {state, prompt_sets, conf_thres, sam_mode}
+    decode_text_requests(requests)         跨请求批量文本解码，每个请求为 {state, texts, conf_thres}
+prompts 为 dict: boxes / box_labels / points / point_labels / text (与 predict_mixed 的参数一致)。
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class ImageState:
+    """一张图片的编码结果。payload 由后端自行解释；nbytes 用于缓存按字节数淘汰。"""
+
+    def __init__(self, image_path, width, height, payload, nbytes=None):
+        self.image_path = image_path
+        self.width = width
+        self.height = height
+        self.payload = payload
+        self.nbytes = nbytes if nbytes is not None else _estimate_nbytes(payload)
+
+
+def _estimate_nbytes(obj):
+    """递归估算 payload 占用 (numpy / torch 张量按实际字节数，其它对象忽略不计)。"""
+    if obj is None:
+        return 0
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if hasattr(obj, 'element_size') and hasattr(obj, 'nelement'):  # torch.Tensor
+        return obj.element_size() * obj.nelement()
+    if isinstance(obj, dict):
+        return sum(_estimate_nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_estimate_nbytes(v) for v in obj)
+    return 0
+
+
+def _box_xyxy(box):
+    """前端的框提示可能是 {x, y, w, h} 或 [x1, y1, x2, y2]。"""
+    if isinstance(box, dict):
+        return [box['x'], box['y'], box['x'] + box['w'], box['y'] + box['h']]
+    return [float(v) for v in box[:4]]
+
+
+def _point_xy(point):
+    if isinstance(point, dict):
+        return [point['x'], point['y']]
+    return [float(v) for v in point[:2]]
+
+
+class SamBackend:
+    """后端基类。model_id 参与缓存键：换模型后旧的编码结果不会被误用。"""
+    model_id = 'base'
+
+    def encode(self, image_path):
+        raise NotImplementedError
+
+    def decode(self, state, prompts, conf_thres=0.25, sam_mode='semantic'):
+        raise NotImplementedError
+
+    def decode_batch(self, state, prompt_sets, conf_thres=0.25, sam_mode='semantic'):
+        """返回与 prompt_sets 等长、顺序一致的结果列表。支持批量解码的后端应覆盖此方法。"""
+        return [self.decode(state, prompts, conf_thres=conf_thres, sam_mode=sam_mode) for prompts in prompt_sets]
+
+    def decode_text(self, state, texts, conf_thres=0.25):
+        raise NotImplementedError
+
+    def encode_many(self, image_paths):
+        return [self.encode(path) for path in image_paths]
+
+    def decode_requests(self, requests):
+        return [self.decode_batch(r['state'], r['prompt_sets'], conf_thres=r['conf_thres'], sam_mode=r['sam_mode'])
+                for r in requests]
+
+    def decode_text_requests(self, requests):
+        return [self.decode_text(r['state'], r['texts'], conf_thres=r['conf_thres']) for r in requests]
+
+
+class DisabledSamBackend(SamBackend):
+    """开源版默认后端：不加载任何模型，所有请求返回空结果 (与原 SAM3Engine 的行为一致)。"""
+    model_id = 'disabled'
+
+    def encode(self, image_path):
+        return ImageState(image_path, 0, 0, None, nbytes=0)
+
+    def decode(self, state, prompts, conf_thres=0.25, sam_mode='semantic'):
+        return []
+
+    def decode_batch(self, state, prompt_sets, conf_thres=0.25, sam_mode='semantic'):
+        return [[] for _ in prompt_sets]
+
+    def decode_text(self, state, texts, conf_thres=0.25):
+        return []
+
+
+class FakeSamBackend(SamBackend):
+    """
+    测试用后端：编码为图片的灰度缩略图 (模拟真实的 embedding 占用)，解码把每个正向框提示原样作为多边形返回，
+    正向点提示返回以该点为中心的小方块；文本提示对每个文本返回整图中央的一个多边形。
+    encode_delay / decode_delay 用于模拟模型耗时，encode_calls / decode_calls 记录调用次数。
+    """
+    model_id = 'fake'
+
+    def __init__(self, embed_size=64, encode_delay=0.0, decode_delay=0.0):
+        self.embed_size = embed_size
+        self.encode_delay = encode_delay
+        self.decode_delay = decode_delay
+        self.encode_calls = 0
+        self.decode_calls = 0
+
+    def encode(self, image_path):
+        return self.encode_many([image_path])[0]
+
+    def encode_many(self, image_paths):
+        from PIL import Image
+        self.encode_calls += 1
+        time.sleep(self.encode_delay)
+        states = []
+        for image_path in image_paths:
+            with Image.open(image_path) as img:
+                width, height = img.size
+                thumb = np.asarray(img.convert('L').resize((self.embed_size, self.embed_size)), dtype=np.float32)
+            states.append(ImageState(image_path, width, height, {'embedding': thumb}))
+        return states
+
+    def decode(self, state, prompts, conf_thres=0.25, sam_mode='semantic'):
+        self.decode_calls += 1
+        time.sleep(self.decode_delay)
+        return self._fake_masks(prompts, conf_thres)
+
+    def decode_batch(self, state, prompt_sets, conf_thres=0.25, sam_mode='semantic'):
+        # 模拟批量解码：整批只付出一次解码耗时
+        self.decode_calls += 1
+        time.sleep(self.decode_delay)
+        return [self._fake_masks(prompts, conf_thres) for prompts in prompt_sets]
+
+    def decode_requests(self, requests):
+        self.decode_calls += 1
+        time.sleep(self.decode_delay)
+        return [[self._fake_masks(prompts, r['conf_thres']) for prompts in r['prompt_sets']] for r in requests]
+
+    @staticmethod
+    def _fake_masks(prompts, conf_thres):
+        results = []
+        for box, label in zip(prompts.get('boxes') or [], prompts.get('box_labels') or []):
+            if label:
+                x1, y1, x2, y2 = _box_xyxy(box)
+                results.append({'points': [[x1, y1], [x2, y1], [x2, y2], [x1, y2]], 'score': 0.9})
+        for point, label in zip(prompts.get('points') or [], prompts.get('point_labels') or []):
+            if label:
+                x, y = _point_xy(point)
+                results.append({'points': [[x - 5, y - 5], [x + 5, y - 5], [x + 5, y + 5], [x - 5, y + 5]],
+                                'score': 0.8})
+        return [r for r in results if r['score'] >= conf_thres]
+
+    def decode_text(self, state, texts, conf_thres=0.25):
+        self.decode_calls += 1
+        time.sleep(self.decode_delay)
+        w, h = state.width, state.height
+        return [{'label_text': text, 'score': 0.7,
+                 'points': [[w * 0.25, h * 0.25], [w * 0.75, h * 0.25], [w * 0.75, h * 0.75], [w * 0.25, h * 0.75]]}
+                for text in texts if conf_thres <= 0.7]
+
+
+BACKENDS = {
+    'disabled': DisabledSamBackend,
+    'fake': FakeSamBackend,
+}
+
+
+def create_backend(name, **kwargs):
+    if name not in BACKENDS:
+        raise ValueError(f"未知的 SAM 后端: {name} (可选 {', '.join(BACKENDS)})")
+    return BACKENDS[name](**kwargs)
+
+
+class EmbeddingCache:
+    """
+    图片编码结果的 LRU 缓存，键为 (图片路径, 修改时间, 模型)，总字节数不超过 max_bytes。
+    同一张图的并发请求只编码一次；单个超过上限的编码结果不缓存 (直接返回给调用方)。
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> ImageState
+        self._bytes = 0
+        self._loading = {}  # key -> Lock
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key_for(image_path, backend):
+        return os.path.abspath(image_path), os.stat(image_path).st_mtime_ns, backend.model_id
+
+    def peek(self, image_path, backend):
+        try:
+            key = self.key_for(image_path, backend)
+        except OSError:
+            return None
+        with self._lock:
+            return self._entries.get(key)
+
+    def get(self, image_path, backend, encode=None):
+        """
+        返回图片的 ImageState，未命中时调用 encode(image_path) (默认 backend.encode) 编码并缓存。
+        """
+        key = self.key_for(image_path, backend)
+        with self._lock:
+            state = self._entries.get(key)
+            if state is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return state
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                state = self._entries.get(key)
+                if state is not None:
+                    self.hits += 1
+                    return state
+                self.misses += 1
+            try:
+                state = (encode or backend.encode)(image_path)
+            except BaseException:
+                with self._lock:
+                    self._loading.pop(key, None)
+                raise
+            with self._lock:
+                self._loading.pop(key, None)
+                self._put(key, state)
+        return state
+
+    def _put(self, key, state):
+        """调用时持有锁。同一路径的旧版本 (图片被修改过) 一并移除。"""
+        for old in [k for k in self._entries if k[0] == key[0] and k[2] == key[2]]:
+            self._bytes -= self._entries.pop(old).nbytes
+        if self.max_bytes and state.nbytes > self.max_bytes:
+            return
+        self._entries[key] = state
+        self._bytes += state.nbytes
+        while self.max_bytes and self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
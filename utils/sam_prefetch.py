@@ -0,0 +1,68 @@
+# sam_prefetch.py
+import os
+import threading
+from collections import deque
+
+from utils.label_io import list_task_images
+
+
+class EmbeddingPrefetcher:
+    """
+    标注员按自然排序逐张处理图片：打开第 N 张时，在后台依次编码第 N+1 ~ N+depth 张放进编码缓存。
+    编码请求以 background 方式提交到推理队列，只在没有交互请求时执行，交互请求始终优先。
+    只保留最近一次打开所对应的预取目标 (标注员跳转后，旧的目标不再有意义)。
+    """
+
+    def __init__(self, engine, depth=3):
+        self.engine = engine
+        self.depth = depth
+        self._targets = deque()
+        self._listings = {}  # task_path -> (目录 mtime, 图片列表)，目录未变化时不重新列目录排序
+        self._cond = threading.Condition()
+        self._thread = None
+        self.prefetched = 0
+        self.skipped = 0
+
+    def _images(self, task_path):
+        mtime = os.stat(task_path).st_mtime_ns
+        cached = self._listings.get(task_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        images = list_task_images(task_path)
+        self._listings[task_path] = (mtime, images)
+        return images
+
+    def image_opened(self, task_path, image_name):
+        if not self.depth:
+            return
+        try:
+            images = self._images(task_path)
+            index = images.index(image_name)
+        except (OSError, ValueError):
+            return
+        targets = [os.path.join(task_path, name) for name in images[index + 1:index + 1 + self.depth]]
+        with self._cond:
+            self._targets = deque(targets)
+            self._cond.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='sam-prefetch', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._targets:
+                    self._cond.wait()
+                image_path = self._targets.popleft()
+            try:
+                if self.engine.prefetch_image(image_path):
+                    self.prefetched += 1
+                else:
+                    self.skipped += 1
+            except Exception as e:
+                print(f"[SAM 预取] {os.path.basename(image_path)} 编码失败: {e}")
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._targets)
+        return {'depth': self.depth, 'pending': pending, 'prefetched': self.prefetched, 'skipped': self.skipped}
@@ -0,0 +1,148 @@
+# startup.py
+"""
+服务启动耗时统计与后台预热。
+
+Web 服务本身 (登录、标注、任务管理) 不需要 torch / ultralytics / SAM，这些重量级模块在第一次使用时才导入；
+WARMUP_ON_START 开启时由 warmup 在后台线程中提前导入，/api/system/ready 返回各预热步骤的状态。
+
+导入耗时报告 (与 python -X importtime 相同的数据，按累计耗时排序):
+    python utils/startup.py [--top 30]
+"""
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    """记录 create_app 各阶段的耗时 (导入蓝图、初始化数据库等)。"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.steps = []  # [(名称, 秒)]
+        self.finished = None
+
+    @contextmanager
+    def timed(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - start))
+
+    def finish(self):
+        self.finished = time.perf_counter() - self.started
+
+    def as_dict(self):
+        return {'total_ms': round(self.finished * 1000, 1) if self.finished is not None else None,
+                'steps': [{'name': name, 'ms': round(seconds * 1000, 1)} for name, seconds in self.steps]}
+
+    def lines(self):
+        lines = [f"{name:<28}{seconds * 1000:>9.1f} ms" for name, seconds in self.steps]
+        if self.finished is not None:
+            lines.append(f"{'total':<28}{self.finished * 1000:>9.1f} ms")
+        return lines
+
+
+class Warmup:
+    """
+    后台预热：依次执行注册的步骤 (例如 import torch)，记录每一步的状态 (pending / running / done / failed)、
+    耗时和结果说明。步骤失败不影响后续步骤，也不影响 Web 服务 (对应功能在使用时会再报错)。
+    """
+
+    def __init__(self):
+        self._steps = []  # [(名称, 函数)]
+        self._status = {}  # 名称 -> {'state', 'ms', 'detail'}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, name, fn):
+        with self._lock:
+            if name not in self._status:
+                self._steps.append((name, fn))
+                self._status[name] = {'state': 'pending', 'ms': None, 'detail': None}
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+        self._thread.start()
+
+    def _set(self, name, **fields):
+        with self._lock:
+            self._status[name].update(fields)
+
+    def _run(self):
+        for name, fn in list(self._steps):
+            self._set(name, state='running')
+            start = time.perf_counter()
+            try:
+                detail = fn()
+                state = 'done'
+            except Exception as e:
+                detail, state = f"{type(e).__name__}: {e}", 'failed'
+            ms = round((time.perf_counter() - start) * 1000, 1)
+            self._set(name, state=state, ms=ms, detail=detail)
+            print(f">>> [Warmup] {name}: {state} ({ms:.0f} ms){f' - {detail}' if detail else ''}")
+
+    def status(self):
+        with self._lock:
+            steps = {name: dict(status) for name, status in self._status.items()}
+        finished = all(s['state'] in ('done', 'failed') for s in steps.values())
+        return {'ready': finished, 'ok': finished and all(s['state'] == 'done' for s in steps.values()),
+                'steps': steps}
+
+
+def import_module_step(module_name):
+    """预热步骤：导入一个模块 (已导入时直接返回)。"""
+    def step():
+        __import__(module_name)
+    return step
+
+
+def torch_device_step():
+    import torch
+    return 'CUDA' if torch.cuda.is_available() else 'CPU'
+
+
+warmup = Warmup()
+
+
+# ============ 导入耗时报告 ============
+
+_IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def importtime_report(code="import app; app.create_app()", top=30, cwd=None):
+    """
+    在子进程中以 -X importtime 执行 code，返回 (总耗时 ms, [(累计 ms, 自身 ms, 层级, 模块名)]，按累计耗时降序)。
+    """
+    cwd = cwd or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=cwd, capture_output=True,
+                          text=True, encoding='utf-8', errors='replace')
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_RE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(cumulative_us) / 1000, int(self_us) / 1000, (len(indent) - 1) // 2, name))
+    total = sum(row[0] for row in rows if row[2] == 0)
+    return total, sorted(rows, reverse=True)[:top]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='服务启动的模块导入耗时 (python -X importtime)')
+    parser.add_argument('--top', type=int, default=30)
+    parser.add_argument('--code', default="import app; app.create_app()")
+    args = parser.parse_args()
+    total_ms, rows = importtime_report(args.code, args.top)
+    print(f"导入总耗时 {total_ms:.1f} ms (顶层模块累计)")
+    print(f"{'累计 ms':>10}{'自身 ms':>10}  模块")
+    for cumulative, own, depth, name in rows:
+        print(f"{cumulative:>10.1f}{own:>10.1f}  {'  ' * depth}{name}")
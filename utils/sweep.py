@@ -0,0 +1,105 @@
+# sweep.py
+import itertools
+import math
+import random
+import threading
+
+# 允许通过超参搜索 / 训练参数透传给 model.train() 的额外参数
+TRAIN_EXTRA_ARGS = {
+    'lr0', 'lrf', 'momentum', 'weight_decay', 'warmup_epochs', 'optimizer', 'cos_lr', 'patience', 'dropout',
+    'mosaic', 'mixup', 'degrees', 'translate', 'scale', 'fliplr', 'hsv_h', 'hsv_s', 'hsv_v', 'close_mosaic',
+}
+# 搜索空间中直接对应 start_train 参数的字段
+TRAIN_BASE_ARGS = {'model', 'epochs', 'imgsz', 'batch'}
+
+
+def _sample(spec, rng):
+    """列表 -> 随机取一个；{'min', 'max', 'log'} -> 区间内均匀 / 对数均匀采样 (两端都是整数时取整)。"""
+    if isinstance(spec, (list, tuple)):
+        return rng.choice(list(spec))
+    if isinstance(spec, dict) and 'min' in spec and 'max' in spec:
+        lo, hi = spec['min'], spec['max']
+        if spec.get('log'):
+            value = math.exp(rng.uniform(math.log(lo), math.log(hi)))
+        else:
+            value = rng.uniform(lo, hi)
+        if isinstance(lo, int) and isinstance(hi, int):
+            return int(round(value))
+        return value
+    return spec
+
+
+def expand_trials(space, mode='grid', n_trials=None, seed=None):
+    """
+    把搜索空间展开为一组试验参数。
+    - grid: 每个字段必须是列表，返回所有组合 (n_trials 可截断)。
+    - random: 每个字段为列表或区间，随机采样 n_trials 组。
+    """
+    unknown = set(space) - TRAIN_EXTRA_ARGS - TRAIN_BASE_ARGS
+    if unknown:
+        raise ValueError(f"不支持的搜索参数: {', '.join(sorted(unknown))}")
+    keys = sorted(space)
+    if mode == 'grid':
+        for k in keys:
+            if not isinstance(space[k], (list, tuple)):
+                raise ValueError(f"网格搜索的参数 {k} 必须是列表")
+        trials = [dict(zip(keys, combo)) for combo in itertools.product(*(space[k] for k in keys))]
+        return trials[:n_trials] if n_trials else trials
+    if mode == 'random':
+        rng = random.Random(seed)
+        return [{k: _sample(space[k], rng) for k in keys} for _ in range(int(n_trials or 10))]
+    raise ValueError(f"未知的搜索模式: {mode}")
+
+
+class HalvingPolicy:
+    """
+    异步逐次减半 (ASHA) 早停策略。
+    里程碑 epoch 为 min_epochs * eta^k；试验到达里程碑时，与所有已到达该里程碑的试验比较，
+    不在前 1/eta 的试验被提前终止，CPU 时间留给更有希望的配置。
+    每次汇报都会复查已通过的里程碑，避免先到达的试验因为当时对手不足而一直被保留。
+    """
+
+    def __init__(self, metric='map50_95', min_epochs=5, eta=3, mode='max'):
+        self.metric = metric
+        self.min_epochs = max(1, int(min_epochs))
+        self.eta = max(2, int(eta))
+        self.mode = mode
+        self._rungs = {}  # rung epoch -> {trial_id: value}
+        self._best = {}  # trial_id -> 至今为止的最佳指标
+        self._lock = threading.Lock()
+
+    def _better(self, a, b):
+        return a > b if self.mode == 'max' else a < b
+
+    def rung_epochs(self, max_epochs):
+        rungs, r = [], self.min_epochs
+        while r < max_epochs:
+            rungs.append(r)
+            r *= self.eta
+        return rungs
+
+    def report(self, trial_id, epoch, value, max_epochs):
+        """
+        记录试验在某个 epoch 的指标，返回 False 表示该试验应被早停。
+        """
+        if value is None:
+            return True
+        with self._lock:
+            best = self._best.get(trial_id)
+            if best is None or self._better(value, best):
+                self._best[trial_id] = best = value
+            rungs = self.rung_epochs(max_epochs)
+            if epoch in rungs:
+                self._rungs.setdefault(epoch, {})[trial_id] = best
+            # 除当前里程碑外，也复查之前已通过的里程碑：先到达的试验当时对手不足，之后人数够了要重新比较
+            for r in rungs:
+                if r > epoch:
+                    break
+                rung = self._rungs.get(r, {})
+                if trial_id not in rung or len(rung) < self.eta:
+                    continue
+                ranked = sorted(rung.values(), reverse=(self.mode == 'max'))
+                cutoff = ranked[max(1, len(ranked) // self.eta) - 1]
+                if self._better(cutoff, rung[trial_id]):
+                    return False
+            return True
@@ -0,0 +1,148 @@
+# task_catalog.py
+import json
+import os
+import threading
+
+from utils.label_io import TASK_IMAGE_EXTS
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _disk_usage(path):
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        else:
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def _latest_run(runs_dir):
+    """runs 目录下最近修改的运行 (mtime, 名称)；没有运行时返回 None。"""
+    try:
+        runs = [(entry.stat().st_mtime, entry.name) for entry in os.scandir(runs_dir) if entry.is_dir()]
+    except OSError:
+        return None
+    return max(runs) if runs else None
+
+
+def summarize_task(task_path):
+    """扫描一个任务目录：图片数、已标注数 (有同名 txt)、类别数、磁盘占用和最近一次训练运行。"""
+    images, stems_with_txt = [], set()
+    with os.scandir(task_path) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            ext = ext.lower()
+            if ext in TASK_IMAGE_EXTS:
+                images.append(stem)
+            elif ext == '.txt':
+                stems_with_txt.add(stem)
+
+    classes = 0
+    try:
+        with open(os.path.join(task_path, 'labels.json'), 'r', encoding='utf-8') as f:
+            classes = len(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+    last_run = None
+    latest = _latest_run(os.path.join(task_path, 'runs'))
+    if latest:
+        modified, name = latest
+        last_run = {'name': name, 'modified': modified}
+
+    return {
+        'images': len(images),
+        'labelled': sum(1 for stem in images if stem in stems_with_txt),
+        'classes': classes,
+        'disk_bytes': _disk_usage(task_path),
+        'last_run': last_run,
+    }
+
+
+class TaskCatalog:
+    """
+    数据目录的任务目录缓存：每个 owner 下的任务列表按 owner 目录的 mtime 失效，
+    每个任务的摘要 (summarize_task) 按 任务目录 / labels.json / runs 目录的 mtime 失效。
+    标注保存使用原子替换 (新建临时文件再 rename)，会更新任务目录的 mtime，所以标注进度的变化能及时反映。
+    训练中的文件增长不会改变上述目录的 mtime，因此签名还包含最近一次运行的目录、results.csv、weights 目录和
+    weights/last.pt 的 mtime (每个 epoch 都会更新)，磁盘占用随训练进度刷新。
+    """
+
+    def __init__(self):
+        self._listings = {}  # 目录 -> (mtime, [子目录名])
+        self._summaries = {}  # 任务目录 -> (签名, 摘要)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def subdirs(self, path):
+        """path 下的子目录名 (已排序)；目录不存在时返回空列表。"""
+        mtime = _mtime(path)
+        if mtime is None:
+            return []
+        with self._lock:
+            cached = self._listings.get(path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        try:
+            names = sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+        except OSError:
+            return []
+        with self._lock:
+            self._listings[path] = (mtime, names)
+        return names
+
+    @staticmethod
+    def _signature(task_path):
+        runs_dir = os.path.join(task_path, 'runs')
+        signature = (_mtime(task_path), _mtime(os.path.join(task_path, 'labels.json')), _mtime(runs_dir))
+        latest = _latest_run(runs_dir) if signature[2] is not None else None
+        if latest:
+            run_path = os.path.join(runs_dir, latest[1])
+            signature += (latest[1], _mtime(run_path), _mtime(os.path.join(run_path, 'results.csv')),
+                          _mtime(os.path.join(run_path, 'weights')), _mtime(os.path.join(run_path, 'weights', 'last.pt')))
+        return signature
+
+    def summary(self, task_path):
+        signature = self._signature(task_path)
+        if signature[0] is None:
+            with self._lock:
+                self._summaries.pop(task_path, None)  # 任务已被删除
+            return None
+        with self._lock:
+            cached = self._summaries.get(task_path)
+            if cached and cached[0] == signature:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        try:
+            summary = summarize_task(task_path)
+        except OSError:
+            return None
+        with self._lock:
+            self._summaries[task_path] = (signature, summary)
+        return summary
+
+    def summaries(self, owner_path, task_names):
+        return [dict(name=name, **(self.summary(os.path.join(owner_path, name)) or {})) for name in task_names]
+
+    def stats(self):
+        with self._lock:
+            return {'listings': len(self._listings), 'summaries': len(self._summaries), 'hits': self.hits,
+                    'misses': self.misses}
@@ -0,0 +1,120 @@
+# train_metrics.py
+import os
+import re
+import threading
+import time
+
+# results.csv 列名 -> 输出字段 (兼容检测 (B) / 分割 (M) / 旧版本带空格的列名)
+_METRIC_KEYS = {
+    'metrics/precision': 'precision',
+    'metrics/recall': 'recall',
+    'metrics/mAP50': 'map50',
+    'metrics/mAP50-95': 'map50_95',
+}
+
+# Ultralytics 训练进度行，例如 "      3/50      1.2G      1.234      2.345      1.111         12        640: 45%|████ | 9/20"
+_PROGRESS_RE = re.compile(r'^\s*(\d+)/(\d+)\s+\S+\s+((?:[\d.]+\s+)+)\d+\s+\d+:\s+(\d+)%.*?(\d+)/(\d+)')
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_results_row(header, values):
+    """把 results.csv 的一行转换为结构化的 epoch 记录。"""
+    row = {}
+    for name, raw in zip(header, values):
+        name = name.strip()
+        value = _to_float(raw.strip())
+        if name == 'epoch':
+            row['epoch'] = int(value) if value is not None else None
+        elif name == 'time':
+            row['time'] = value
+        elif name.startswith(('train/', 'val/')) and name.endswith('_loss'):
+            row.setdefault('losses', {})[name] = value
+        elif name.startswith('lr/'):
+            row.setdefault('lr', {})[name[3:]] = value
+        else:
+            base = name.split('(')[0]
+            if base in _METRIC_KEYS:
+                suffix = name[len(base):].strip('()') or 'B'
+                key = _METRIC_KEYS[base] if suffix == 'B' else f"{_METRIC_KEYS[base]}_{suffix.lower()}"
+                row[key] = value
+    return row
+
+
+class MetricsCollector:
+    """
+    训练指标采集：增量读取运行目录下不断增长的 results.csv，并从 stdout 中解析当前 epoch 进度。
+    每个 epoch 一条带类型的记录 (losses / precision / recall / map50 / map50_95 / lr / epoch_time)，
+    前端可以用 since_epoch 只拉取增量。
+    """
+
+    def __init__(self, run_path):
+        self.results_path = os.path.join(run_path, 'results.csv')
+        self._lock = threading.Lock()
+        self._offset = 0
+        self._pending = ''
+        self._header = None
+        self._epochs = []
+        self._progress = {}
+        self._last_poll = 0.0
+
+    def feed_stdout(self, line):
+        """解析一行训练输出中的 epoch / batch 进度，顺便按节流间隔检查 results.csv。"""
+        m = _PROGRESS_RE.match(line)
+        if m:
+            with self._lock:
+                self._progress = {
+                    'epoch': int(m.group(1)), 'epochs': int(m.group(2)),
+                    'losses': [float(v) for v in m.group(3).split()],
+                    'percent': int(m.group(4)), 'batch': int(m.group(5)), 'batches': int(m.group(6)),
+                    'updated_at': time.time(),
+                }
+        if time.time() - self._last_poll > 2.0:
+            self.poll()
+
+    def poll(self):
+        """读取 results.csv 新增的完整行。"""
+        self._last_poll = time.time()
+        if not os.path.exists(self.results_path):
+            return
+        with self._lock:
+            with open(self.results_path, 'r', encoding='utf-8', errors='replace') as f:
+                f.seek(self._offset)
+                data = f.read()
+                self._offset = f.tell()
+            self._pending += data
+            *lines, self._pending = self._pending.split('\n')
+            for line in lines:
+                if not line.strip():
+                    continue
+                values = line.split(',')
+                if self._header is None:
+                    self._header = values
+                    continue
+                row = parse_results_row(self._header, values)
+                if row.get('epoch') is None:
+                    continue
+                prev = self._epochs[-1] if self._epochs else None
+                if prev and row.get('time') is not None and prev.get('time') is not None:
+                    row['epoch_time'] = row['time'] - prev['time']
+                elif row.get('time') is not None and prev is None:
+                    row['epoch_time'] = row['time']
+                self._epochs.append(row)
+
+    def snapshot(self, since_epoch=None):
+        with self._lock:
+            epochs = [e for e in self._epochs if since_epoch is None or e['epoch'] > since_epoch]
+            return {'epochs': epochs, 'progress': dict(self._progress),
+                    'last_epoch': self._epochs[-1]['epoch'] if self._epochs else None}
+
+
+def read_results(run_path, since_epoch=None):
+    """一次性读取已结束训练的 results.csv (不需要常驻采集器)。"""
+    collector = MetricsCollector(run_path)
+    collector.poll()
+    return collector.snapshot(since_epoch)
@@ -0,0 +1,276 @@
+# train_scheduler.py
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # psutil 只用于绑定 CPU 核，缺失时退化为不绑核
+    psutil = None
+
+
+class TrainScheduler:
+    """
+    多资源槽位的后台任务调度器 (替代原来的单线程 task_queue)。
+
+    - 槽位 (slot): 每个槽位同一时刻只运行一个任务，可限定可用设备、绑定的 CPU 核以及单任务内存上限。
+      配置示例: [{'name': 'gpu0', 'devices': ['0']}, {'name': 'cpu-a', 'devices': ['cpu'], 'cpus': [0, 1, 2, 3]}]
+    - 任务 (job): 普通 dict，至少包含 stream_id / kind / task_key / user，可选 priority / mem_mb / device。
+    - 调度顺序: 优先级高的先跑；同优先级时，当前运行任务更少的用户优先 (公平性)；再按队列顺序。
+    - 具体执行由按 kind 注册的 runner(job, slot) 完成，runner 在独立线程中运行，返回值为最终状态
+      ('succeeded' / 'failed' / 'cancelled')，返回后槽位释放。
+    - 设置 store (JobStore) 后，入队、调序、启动、结束等状态变化都会持久化，服务重启后可恢复。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = []  # 排队中的任务，列表顺序即队列顺序
+        self._running = {}  # stream_id -> (job, slot)
+        self._slots = [{'name': 'default', 'devices': None, 'cpus': None, 'mem_mb': None}]
+        self._busy = {}  # slot name -> stream_id
+        self._runners = {}
+        self._admission_checks = []
+        self.mem_budget_mb = None
+        self.store = None
+        self._thread = None
+
+    # ---------- 配置 ----------
+
+    def configure(self, slots=None, mem_budget_mb=None):
+        with self._cond:
+            if slots:
+                self._slots = [{
+                    'name': s.get('name') or f"slot{i}",
+                    'devices': s.get('devices'),
+                    'cpus': s.get('cpus'),
+                    'mem_mb': s.get('mem_mb'),
+                } for i, s in enumerate(slots)]
+            self.mem_budget_mb = mem_budget_mb
+            self._cond.notify_all()
+
+    def set_store(self, store):
+        self.store = store
+
+    def register_runner(self, kind, fn):
+        self._runners[kind] = fn
+
+    def add_admission_check(self, fn):
+        """fn(job) -> None 表示允许启动，返回字符串表示暂缓原因。"""
+        self._admission_checks.append(fn)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._dispatch_loop, daemon=True)
+            self._thread.start()
+
+    # ---------- 队列操作 ----------
+
+    def submit(self, job):
+        job.setdefault('kind', 'train')
+        job.setdefault('priority', 0)
+        job.setdefault('mem_mb', 0)
+        job.setdefault('device', 'auto')
+        job['submitted_at'] = job.get('submitted_at') or time.time()
+        if self.store:
+            self.store.save(job, 'queued')
+        with self._cond:
+            self._queue.append(job)
+            self._cond.notify_all()
+        return job
+
+    def adopt(self, job):
+        """
+        接管一个已经在运行的任务 (服务重启后重新接管存活的子进程)。
+        优先放回原来的槽位；槽位不可用时挂在临时槽位上，不占用可调度的槽位。
+        """
+        with self._cond:
+            slot = next((s for s in self._slots if s['name'] == job.get('slot') and s['name'] not in self._busy),
+                        None)
+            if slot is None:
+                slot = {'name': f"recovered-{job['stream_id'][:8]}", 'devices': None, 'cpus': None, 'mem_mb': None}
+            self._running[job['stream_id']] = (job, slot)
+            self._busy[slot['name']] = job['stream_id']
+        threading.Thread(target=self._run, args=(job, slot), daemon=True).start()
+
+    def cancel(self, stream_id):
+        """从队列中移除排队中的任务，成功返回该任务；已在运行或不存在时返回 None。"""
+        with self._cond:
+            for i, job in enumerate(self._queue):
+                if job['stream_id'] == stream_id:
+                    job = self._queue.pop(i)
+                    break
+            else:
+                return None
+        if self.store:
+            self.store.set_state(stream_id, 'cancelled', message='排队期间被取消')
+        return job
+
+    def move(self, stream_id, position, owner=None):
+        """
+        把排队中的任务移到 position。指定 owner 时只在该用户自己的排队任务之间调整顺序：
+        position 是在这些任务中的位置，它们仍占据原来的队列位置，其他用户的任务不受影响。
+        """
+        with self._cond:
+            slots = [i for i, job in enumerate(self._queue) if owner is None or job.get('user') == owner]
+            jobs = [self._queue[i] for i in slots]
+            for i, job in enumerate(jobs):
+                if job['stream_id'] == stream_id:
+                    jobs.pop(i)
+                    position = max(0, min(int(position), len(jobs)))
+                    jobs.insert(position, job)
+                    for slot, moved in zip(slots, jobs):
+                        self._queue[slot] = moved
+                    if self.store:
+                        self.store.save_order([j['stream_id'] for j in self._queue])
+                    self._cond.notify_all()
+                    return True
+        return False
+
+    def set_priority(self, stream_id, priority):
+        with self._cond:
+            for job in self._queue:
+                if job['stream_id'] == stream_id:
+                    job['priority'] = int(priority)
+                    if self.store:
+                        self.store.update(stream_id, priority=job['priority'])
+                    self._cond.notify_all()
+                    return True
+        return False
+
+    # ---------- 状态查询 ----------
+
+    def get_job(self, stream_id):
+        with self._cond:
+            if stream_id in self._running:
+                return self._running[stream_id][0]
+            return next((j for j in self._queue if j['stream_id'] == stream_id), None)
+
+    def running_jobs(self):
+        with self._cond:
+            return [job for job, _ in self._running.values()]
+
+    def position(self, stream_id):
+        """返回任务在调度顺序中的位置 (0 表示下一个)，运行中或不存在时返回 None。"""
+        with self._cond:
+            ordered = self._ordered_queue()
+            for i, job in enumerate(ordered):
+                if job['stream_id'] == stream_id:
+                    return i
+        return None
+
+    def snapshot(self):
+        with self._cond:
+            running = [dict(self._public(job), state='running', slot=slot['name'])
+                       for job, slot in self._running.values()]
+            queued = [dict(self._public(job), state='queued', position=i)
+                      for i, job in enumerate(self._ordered_queue())]
+            slots = [{'name': s['name'], 'devices': s['devices'], 'cpus': s['cpus'],
+                      'running': self._busy.get(s['name'])} for s in self._slots]
+        return {'slots': slots, 'running': running, 'queued': queued}
+
+    def active_tasks(self):
+        """{task_key: stream_id}，包含排队中和运行中的任务。"""
+        with self._cond:
+            mapping = {job['task_key']: job['stream_id'] for job in self._queue if job.get('task_key')}
+            mapping.update({job['task_key']: sid for sid, (job, _) in self._running.items() if job.get('task_key')})
+        return mapping
+
+    def is_active(self):
+        with self._cond:
+            return bool(self._running)
+
+    @staticmethod
+    def _public(job):
+        return {k: job.get(k) for k in ('stream_id', 'kind', 'task_key', 'user', 'priority', 'mem_mb', 'device',
+                                        'submitted_at', 'deferred')}
+
+    # ---------- 调度 ----------
+
+    def _ordered_queue(self):
+        user_running = {}
+        for job, _ in self._running.values():
+            user_running[job.get('user')] = user_running.get(job.get('user'), 0) + 1
+        indexed = list(enumerate(self._queue))
+        indexed.sort(key=lambda x: (-x[1].get('priority', 0), user_running.get(x[1].get('user'), 0), x[0]))
+        return [job for _, job in indexed]
+
+    @staticmethod
+    def _slot_accepts(slot, job):
+        if slot['mem_mb'] and job.get('mem_mb', 0) > slot['mem_mb']:
+            return False
+        device = str(job.get('device') or 'auto')
+        return device == 'auto' or not slot['devices'] or device in slot['devices']
+
+    def _pick(self):
+        """在锁内选择下一个 (job, slot)，没有可启动的任务时返回 None。"""
+        free_slots = [s for s in self._slots if s['name'] not in self._busy]
+        if not free_slots:
+            return None
+        used_mem = sum(job.get('mem_mb', 0) for job, _ in self._running.values())
+        for job in self._ordered_queue():
+            if self.mem_budget_mb and used_mem + job.get('mem_mb', 0) > self.mem_budget_mb:
+                continue
+            slot = next((s for s in free_slots if self._slot_accepts(s, job)), None)
+            if slot is None:
+                continue
+            reason = next((r for r in (check(job) for check in self._admission_checks) if r), None)
+            if reason:
+                job['deferred'] = reason  # 在队列快照中展示暂缓原因
+                continue
+            job.pop('deferred', None)
+            return job, slot
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                picked = self._pick()
+                if picked is None:
+                    # 带超时等待：准入检查 (如内存余量) 可能随时间变化
+                    self._cond.wait(timeout=5)
+                    continue
+                job, slot = picked
+                self._queue.remove(job)
+                self._running[job['stream_id']] = (job, slot)
+                self._busy[slot['name']] = job['stream_id']
+            if self.store:
+                self.store.set_state(job['stream_id'], 'running', slot=slot['name'])
+            threading.Thread(target=self._run, args=(job, slot), daemon=True).start()
+
+    def _run(self, job, slot):
+        final_state, message = 'failed', None
+        try:
+            runner = self._runners.get(job.get('kind', 'train'))
+            if runner is None:
+                raise RuntimeError(f"未注册的任务类型: {job.get('kind')}")
+            final_state = runner(job, slot) or 'succeeded'
+        except Exception as e:
+            message = str(e)
+            print(f"[调度器] 任务 {job['stream_id']} 执行异常: {e}")
+        finally:
+            if self.store:
+                try:
+                    self.store.set_state(job['stream_id'], final_state, message=message or job.get('message'))
+                except Exception as e:
+                    print(f"[调度器] 持久化任务状态失败: {e}")
+            with self._cond:
+                self._running.pop(job['stream_id'], None)
+                self._busy.pop(slot['name'], None)
+                self._cond.notify_all()
+
+
+def resolve_device(job, slot):
+    """job 的 device 为 'auto' 时使用槽位的第一个设备，否则沿用任务指定的设备。"""
+    device = str(job.get('device') or 'auto')
+    if device != 'auto':
+        return device
+    return slot['devices'][0] if slot.get('devices') else ''
+
+
+def apply_cpu_affinity(pid, slot):
+    """把进程绑定到槽位的 CPU 核集合上 (Windows / Linux 均可用)。"""
+    if not slot.get('cpus') or psutil is None:
+        return
+    try:
+        psutil.Process(pid).cpu_affinity(list(slot['cpus']))
+    except Exception as e:
+        print(f"[调度器] 绑定 CPU 核失败 (PID {pid}): {e}")
@@ -0,0 +1,355 @@
+# warm_pool.py
+"""
+预热的训练进程池 (仅 POSIX)。
+
+每个常驻的“母进程”启动时就导入好 torch / ultralytics，之后每来一个训练任务就 fork 出一个子进程执行训练脚本。
+子进程继承已导入的模块，省掉每个任务 10~30 秒的解释器启动和导入开销。子进程是独立的会话和独立的 PID，
+输出写入任务的 stdout.log，所以 kill_task 的 terminate / kill、服务重启后按 PID 重新接管都与普通子进程一致。
+
+母进程与 Web 服务之间通过 stdin / stdout 上的 JSON 行通信:
+    服务 -> 母进程: {"op": "run", "id": ..., "script": ..., "spool": ..., "env": {...}} / {"op": "retire"}
+    母进程 -> 服务: {"event": "ready"} / {"event": "started", "id", "pid"} / {"event": "exited", "id", "pid",
+                    "returncode"} / {"event": "error", "id", "message"}
+母进程执行 N 个任务或内存增长超过上限后退休 (不再接任务，等已 fork 的任务结束后退出)，由新的母进程接替。
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# 母进程预先导入的模块
+WARM_IMPORTS = ('torch', 'ultralytics')
+
+
+# ============ 母进程 (python warm_pool.py) ============
+
+def _emit(event):
+    sys.stdout.write(json.dumps(event) + "\n")
+    sys.stdout.flush()
+
+
+def _run_child(msg):
+    """fork 出的子进程：脱离母进程会话，把输出重定向到 spool 文件，然后执行训练脚本。"""
+    import signal
+
+    os.setsid()
+    # 母进程忽略了 SIGINT，fork 会继承；恢复 Python 的默认处理 (KeyboardInterrupt)，与普通子进程一致
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    fd = os.open(msg['spool'], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    os.dup2(fd, 1)
+    os.dup2(fd, 2)
+    os.close(fd)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    # 与 python -u 一致：无缓冲输出，日志实时写入
+    sys.stdout = open(1, 'w', encoding='utf-8', errors='replace', buffering=1, closefd=False)
+    sys.stderr = open(2, 'w', encoding='utf-8', errors='replace', buffering=1, closefd=False)
+    os.environ.update(msg.get('env') or {})
+    code = 0
+    try:
+        threads = os.environ.get('OMP_NUM_THREADS')
+        if threads and 'torch' in sys.modules:
+            # torch 在母进程中导入时已经读取过 OMP_NUM_THREADS，这里按任务的配置重新设置
+            sys.modules['torch'].set_num_threads(int(threads))
+        sys.argv = ['-c']
+        exec(compile(msg['script'], '<train>', 'exec'), {'__name__': '__main__'})
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+
+def _zygote_main():
+    import selectors
+    import signal
+
+    # 母进程只响应 stdin 关闭 / retire，Ctrl+C 由 Web 服务统一处理
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    for name in WARM_IMPORTS:
+        try:
+            __import__(name)
+        except Exception as e:
+            _emit({'event': 'warn', 'message': f"预导入 {name} 失败: {e}"})
+    _emit({'event': 'ready', 'pid': os.getpid()})
+
+    children = {}  # pid -> job id
+    retiring = False
+    selector = selectors.DefaultSelector()
+    selector.register(sys.stdin, selectors.EVENT_READ)
+    # 单线程循环：fork 时进程内没有其他线程，子进程不会继承到被占用的锁
+    while not (retiring and not children):
+        if not retiring:
+            for _ in selector.select(timeout=0.5):
+                line = sys.stdin.readline()
+                if not line:
+                    retiring = True
+                    break
+                msg = json.loads(line)
+                if msg.get('op') == 'retire':
+                    retiring = True
+                elif msg.get('op') == 'run':
+                    try:
+                        sys.stdout.flush()
+                        pid = os.fork()
+                    except OSError as e:
+                        _emit({'event': 'error', 'id': msg['id'], 'message': str(e)})
+                        continue
+                    if pid == 0:
+                        _run_child(msg)
+                    children[pid] = msg['id']
+                    _emit({'event': 'started', 'id': msg['id'], 'pid': pid})
+        else:
+            time.sleep(0.5)
+        while children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                children.clear()
+                break
+            if pid == 0:
+                break
+            job_id = children.pop(pid, None)
+            code = os.waitstatus_to_exitcode(status)
+            try:
+                _emit({'event': 'exited', 'id': job_id, 'pid': pid, 'returncode': code})
+            except (BrokenPipeError, ValueError):
+                pass  # Web 服务已退出，没有人接收
+    # stdin 关闭 (服务退出) 时仍在运行的训练子进程交由系统接管，重启后的服务按 PID 重新接管
+
+
+# ============ 服务端 ============
+
+class WarmProcess:
+    """
+    由母进程 fork 出的训练进程，提供与 subprocess.Popen 一致的 pid / poll / wait / terminate / kill。
+    退出码由母进程回收后通过管道上报；母进程意外退出时退化为按 PID 判断是否存活。
+    """
+
+    def __init__(self, pid, zygote):
+        self.pid = pid
+        self.returncode = None
+        self._zygote = zygote
+        self._exited = threading.Event()
+
+    def _set_returncode(self, code):
+        self.returncode = code
+        self._exited.set()
+
+    def _orphan_poll(self):
+        if self._zygote.proc.poll() is None:
+            return
+        alive = False
+        if psutil is not None:
+            try:
+                proc = psutil.Process(self.pid)
+                alive = proc.is_running() and proc.status() != psutil.STATUS_ZOMBIE
+            except psutil.NoSuchProcess:
+                alive = False
+        if not alive:
+            self._set_returncode(-1)
+
+    def poll(self):
+        if self.returncode is None:
+            self._orphan_poll()
+        return self.returncode
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while self.returncode is None:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                raise subprocess.TimeoutExpired(str(self.pid), timeout)
+            self._exited.wait(0.5 if remaining is None else min(0.5, remaining))
+            self._orphan_poll()
+        return self.returncode
+
+    def _signal(self, sig):
+        if self.returncode is not None:
+            return
+        try:
+            os.kill(self.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    def terminate(self):
+        import signal
+        self._signal(signal.SIGTERM)
+
+    def kill(self):
+        import signal
+        self._signal(signal.SIGKILL)
+
+
+class _Zygote:
+    def __init__(self, env=None, cwd=None):
+        self.proc = subprocess.Popen([sys.executable, '-u', os.path.abspath(__file__)], stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE, env=env, cwd=cwd, start_new_session=True, text=True,
+                                     encoding='utf-8')
+        self.jobs = 0
+        self.baseline_rss = None
+        self.retiring = False
+        self.ready = threading.Event()
+        self.children = {}  # job id -> WarmProcess
+        self._waiting = {}  # job id -> [Event, WarmProcess | error]
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        threading.Thread(target=self._read_events, daemon=True).start()
+
+    def _read_events(self):
+        for line in self.proc.stdout:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            kind = event.get('event')
+            if kind == 'ready':
+                self.baseline_rss = self.rss()
+                self.ready.set()
+            elif kind == 'warn':
+                print(f"[预热进程池] {event['message']}")
+            elif kind in ('started', 'error'):
+                with self._lock:
+                    waiter = self._waiting.pop(event['id'], None)
+                if waiter:
+                    waiter[1] = WarmProcess(event['pid'], self) if kind == 'started' else event['message']
+                    if kind == 'started':
+                        self.children[event['id']] = waiter[1]
+                    waiter[0].set()
+            elif kind == 'exited':
+                child = self.children.pop(event['id'], None)
+                if child:
+                    child._set_returncode(event['returncode'])
+        self.ready.set()  # 母进程退出：唤醒等待者
+        with self._lock:
+            for waiter in self._waiting.values():
+                waiter[1] = "预热进程已退出"
+                waiter[0].set()
+            self._waiting.clear()
+
+    @property
+    def alive(self):
+        return self.proc.poll() is None
+
+    def rss(self):
+        if psutil is None:
+            return None
+        try:
+            return psutil.Process(self.proc.pid).memory_info().rss
+        except Exception:
+            return None
+
+    def send(self, msg):
+        with self._write_lock:
+            self.proc.stdin.write(json.dumps(msg) + "\n")
+            self.proc.stdin.flush()
+
+    def run(self, job_id, script, spool, env, timeout=30):
+        waiter = [threading.Event(), None]
+        with self._lock:
+            self._waiting[job_id] = waiter
+        self.send({'op': 'run', 'id': job_id, 'script': script, 'spool': spool, 'env': env})
+        if not waiter[0].wait(timeout) or not isinstance(waiter[1], WarmProcess):
+            raise RuntimeError(waiter[1] or "预热进程无响应")
+        self.jobs += 1
+        return waiter[1]
+
+    def retire(self):
+        self.retiring = True
+        try:
+            self.send({'op': 'retire'})
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+
+
+class WarmTrainerPool:
+    """
+    维护 size 个预热的母进程。launch() 选一个空闲度最高的母进程 fork 出训练进程；
+    不可用 (Windows、未启用、母进程启动失败) 时返回 None，调用方退回普通的子进程方式。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.size = 1
+        self.max_jobs = 20
+        self.max_rss_growth_mb = 1024
+        self._zygotes = []
+        self._lock = threading.Lock()
+        self._env = None
+
+    def configure(self, enabled=False, size=1, max_jobs=20, max_rss_growth_mb=1024, env=None):
+        self.enabled = bool(enabled) and hasattr(os, 'fork')
+        self.size = max(1, int(size or 1))
+        self.max_jobs = max_jobs
+        self.max_rss_growth_mb = max_rss_growth_mb
+        self._env = env
+
+    def start(self):
+        """后台预先启动母进程，第一个训练任务也能直接用上预热好的进程。"""
+        if self.enabled:
+            threading.Thread(target=self._ensure, daemon=True).start()
+
+    def _ensure(self):
+        with self._lock:
+            self._zygotes = [z for z in self._zygotes if z.alive and not z.retiring]
+            while len(self._zygotes) < self.size:
+                self._zygotes.append(_Zygote(env=self._env))
+            return list(self._zygotes)
+
+    def _should_recycle(self, zygote):
+        if self.max_jobs and zygote.jobs >= self.max_jobs:
+            return f"已执行 {zygote.jobs} 个任务"
+        rss = zygote.rss()
+        if self.max_rss_growth_mb and rss and zygote.baseline_rss and \
+                rss - zygote.baseline_rss > self.max_rss_growth_mb * 1024 * 1024:
+            return f"内存增长 {(rss - zygote.baseline_rss) // (1024 * 1024)} MB"
+        return None
+
+    def launch(self, job_id, script, spool, env=None, ready_timeout=2):
+        """
+        在预热进程中启动训练，返回 WarmProcess；不可用时返回 None。
+        母进程还在导入 torch (冷启动) 时最多等待 ready_timeout 秒，之后直接退回普通子进程，不让调度线程久等。
+        """
+        if not self.enabled:
+            return None
+        try:
+            deadline = time.monotonic() + ready_timeout
+            zygotes = [z for z in self._ensure() if z.ready.wait(max(0.0, deadline - time.monotonic())) and z.alive]
+            if not zygotes:
+                print("[预热进程池] 母进程尚未就绪，本次改用普通子进程")
+                return None
+            zygote = min(zygotes, key=lambda z: len(z.children))
+            process = zygote.run(job_id, script, spool, env or {})
+            reason = self._should_recycle(zygote)
+            if reason:
+                print(f"[预热进程池] 母进程 {zygote.proc.pid} {reason}，退休并启动新的母进程")
+                zygote.retire()
+                self.start()
+            return process
+        except Exception as e:
+            print(f"[预热进程池] 无法使用预热进程，改用普通子进程: {e}")
+            return None
+
+    def stats(self):
+        with self._lock:
+            return [{'pid': z.proc.pid, 'alive': z.alive, 'ready': z.ready.is_set(), 'jobs': z.jobs,
+                     'running': len(z.children), 'retiring': z.retiring, 'rss': z.rss()} for z in self._zygotes]
+
+
+if __name__ == '__main__':
+    _zygote_main()